@@ -0,0 +1,252 @@
+"""Campaign load benchmark for ``send_email_template`` at increasing user counts.
+
+For each ``--users`` size a fresh child process tops the scratch database up to that many active users (a temporary
+SQLite file, or ``--db-url`` for e.g. a local MySQL), then sends one template to all of them twice:
+
+    phases    the command's steps driven one batch at a time through ``indabom.campaigns`` so each is timed on its
+              own: recipient selection, merge-data build, send (ESP calls, excluding the merge build) and log writes
+              (claiming batches as sending, then recording their outcome)
+    command   the whole ``send_email_template`` command with ``--batch-size`` and ``--concurrency``
+
+Each is reported with wall time, query count (``indabom.query_budget.QueryCounter``) and the process's peak RSS once
+it finished. Sends go to anymail's test backend (``--esp test``; messages are not kept, so RSS reflects the command)
+or through the real Mailgun backend to the local stand-in from ``stand_ins.py`` (``--esp stand-in``).
+
+Results are written as JSON to ``benchmarks/reports/`` tagged with the git commit.
+
+    python benchmarks/campaign_load.py [--users 10000,100000,1000000] [--esp test|stand-in]
+                                       [--stand-in-latency-ms 20] [--batch-size 1000] [--concurrency 4]
+                                       [--db-url mysql://user:pw@127.0.0.1/indabom_bench]
+
+``--db-url`` databases keep their users between sizes (and runs) and lose all send logs; never point it at data you
+want to keep.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+
+from anymail.backends.test import EmailBackend as AnymailTestBackend
+
+from common import BASE_DIR, setup_django
+from http_load import REPORTS_DIR, git_revision
+
+TEMPLATE_NAME = 'campaign-load'
+SEED_BATCH_SIZE = 5000
+
+
+class DiscardingBackend(AnymailTestBackend):
+    """anymail's test backend without the outbox, which would otherwise hold every message sent."""
+
+    def post_to_esp(self, payload, message):
+        response = super().post_to_esp(payload, message)
+        from django.core import mail
+        mail.outbox.clear()
+        return response
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Phase:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+    def measure(self, fn, *args, **kwargs):
+        from indabom.query_budget import QueryCounter
+
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            self.seconds += time.perf_counter() - started
+        self.queries += counter.count
+        return result
+
+    def report(self, recipients: int) -> dict:
+        return {'seconds': round(self.seconds, 3), 'queries': self.queries, 'peak_rss_mb': round(peak_rss_mb(), 1),
+                'per_second': round(recipients / self.seconds) if self.seconds else None}
+
+
+def seed(users: int):
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+
+    from indabom.models import EmailSendBatch, EmailSendLog, EmailSendQuota, EmailTemplate
+
+    call_command('migrate', verbosity=0, interactive=False)
+    User = get_user_model()
+    existing = User.objects.count()
+    password = make_password('campaign-load')
+    for start in range(existing, users, SEED_BATCH_SIZE):
+        User.objects.bulk_create(
+            User(username=f'load{n}', email=f'load{n}@example.com', password=password, first_name=f'Load{n}')
+            for n in range(start, min(users, start + SEED_BATCH_SIZE)))
+    EmailSendLog.objects.all().delete()
+    EmailSendBatch.objects.all().delete()
+    EmailSendQuota.objects.all().delete()
+    EmailTemplate.objects.update_or_create(name=TEMPLATE_NAME, defaults={
+        'subject': 'Hi {{ user.first_name }}',
+        'html_body': '<p>Hello {{ user.get_full_name }},</p><p>News for {{ user.username }} ({{ user.email }}).</p>',
+        'enabled': True,
+    })
+    return existing
+
+
+def reset_sends():
+    from indabom.models import EmailSendBatch, EmailSendLog, EmailSendQuota
+
+    EmailSendLog.objects.all().delete()
+    EmailSendBatch.objects.all().delete()
+    EmailSendQuota.objects.all().delete()
+
+
+def run_phases(users: int, batch_size: int) -> dict:
+    from django.conf import settings
+
+    from indabom import campaigns
+    from indabom.email_rendering import get_compiled
+    from indabom.models import EmailTemplate
+
+    template = EmailTemplate.objects.get(name=TEMPLATE_NAME)
+    select, merge, send, logs = Phase(), Phase(), Phase(), Phase()
+
+    recipients, rows = select.measure(campaigns.select_recipients, template, users)
+    compiled = get_compiled(template)
+    build_merge_data = compiled.merge_data
+    compiled.merge_data = lambda batch_rows: merge.measure(build_merge_data, batch_rows)
+
+    from_email = settings.DEFAULT_FROM_EMAIL
+    for number, start in enumerate(range(0, len(recipients), batch_size), start=1):
+        chunk = recipients[start:start + batch_size]
+        logs.measure(campaigns.reserve_quota, users, len(chunk))
+        batch, chunk = logs.measure(campaigns.claim_batch, template, 'campaign-load', number, chunk)
+        merge_seconds = merge.seconds
+        outcome = send.measure(campaigns.deliver, compiled, from_email, [rows[email] for email, _id in chunk])
+        send.seconds -= merge.seconds - merge_seconds
+        logs.measure(campaigns.record_batch, template, batch, chunk, *outcome)
+    del compiled.merge_data
+
+    n = len(recipients)
+    return {'recipients': n, 'recipient selection': select.report(n), 'merge-data build': merge.report(n),
+            'send': send.report(n), 'log writes': logs.report(n)}
+
+
+def run_command(users: int, batch_size: int, concurrency: int) -> dict:
+    from django.core.management import call_command
+
+    phase = Phase()
+    phase.measure(call_command, 'send_email_template', '--template-name', TEMPLATE_NAME, '--max-per-day', str(users),
+                  '--batch-size', str(batch_size), '--concurrency', str(concurrency), stdout=StringIO())
+    return phase.report(users)
+
+
+def child(args):
+    """Runs one size in this process, so its peak RSS is its own, and prints the result as JSON."""
+    setup_django()
+    from django.db import connection
+    from django.test.utils import override_settings
+
+    if args.esp == 'stand-in':
+        from django.conf import settings
+
+        from stand_ins import StandInServer
+
+        stand_ins = StandInServer(latency_ms=args.stand_in_latency_ms).start()
+        esp_settings = {'EMAIL_BACKEND': 'anymail.backends.mailgun.EmailBackend',
+                        'ANYMAIL': {**settings.ANYMAIL, 'MAILGUN_API_URL': f'{stand_ins.url}/v3'}}
+    else:
+        stand_ins = None
+        esp_settings = {'EMAIL_BACKEND': 'campaign_load.DiscardingBackend'}
+
+    started = time.perf_counter()
+    existing = seed(args.child_size)
+    result = {'users': args.child_size, 'database': connection.vendor,
+              'seed_seconds': round(time.perf_counter() - started, 3), 'seeded_users': args.child_size - existing}
+    with override_settings(DEFAULT_FROM_EMAIL='no-reply@indabom.com', **esp_settings):
+        result['phases'] = run_phases(args.child_size, args.batch_size)
+        reset_sends()
+        result['command'] = run_command(args.child_size, args.batch_size, args.concurrency)
+    if stand_ins is not None:
+        result['stand_in_calls'] = stand_ins.snapshot()
+        stand_ins.stop()
+    print(json.dumps(result))
+
+
+def format_result(result: dict) -> str:
+    lines = [f"{result['users']} users ({result['database']}, seeded {result['seeded_users']} in "
+             f"{result['seed_seconds']:.1f}s)"]
+    rows = [*result['phases'].items(), ('command', result['command'])]
+    for name, row in rows:
+        if name == 'recipients':
+            continue
+        rate = f"{row['per_second']:>9}/s" if row['per_second'] else ' ' * 11
+        lines.append(f"  {name:<20} {row['seconds']:9.3f}s {rate} {row['queries']:>7} queries "
+                     f"peak RSS {row['peak_rss_mb']:8.1f} MB")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='10000,100000',
+                        help='Comma-separated user counts, e.g. 10000,100000,1000000')
+    parser.add_argument('--esp', choices=('test', 'stand-in'), default='test')
+    parser.add_argument('--stand-in-latency-ms', type=float, default=20.0,
+                        help='Added to every stand-in Mailgun response (--esp stand-in)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--db-url', default=None, help='Scratch database to use instead of a temporary SQLite file')
+    parser.add_argument('--output', default=None, help='Report path (default: benchmarks/reports/)')
+    parser.add_argument('--child-size', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_size is not None:
+        return child(args)
+
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    tmpdir = tempfile.TemporaryDirectory(prefix='indabom-campaign-')
+    env = {**os.environ, 'DB_URL': args.db_url or f"sqlite:///{Path(tmpdir.name) / 'db.sqlite3'}"}
+    results = []
+    for users in sorted(int(size) for size in args.users.split(',')):
+        command = [sys.executable, __file__, '--child-size', str(users), '--esp', args.esp,
+                   '--stand-in-latency-ms', str(args.stand_in_latency_ms), '--batch-size', str(args.batch_size),
+                   '--concurrency', str(args.concurrency)]
+        output = subprocess.run(command, env=env, cwd=BASE_DIR, capture_output=True, text=True)
+        if output.returncode:
+            sys.exit(f'{users} users failed:\n{output.stderr[-5000:]}')
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(format_result(result))
+
+    report = {
+        'revision': git_revision(),
+        'run_at': run_id,
+        'esp': args.esp,
+        'batch_size': args.batch_size,
+        'concurrency': args.concurrency,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    path = Path(args.output) if args.output else REPORTS_DIR / f"campaign_load-{report['revision']}-{run_id}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2))
+    print(f'report written to {path}')
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Shared helpers for the scripts in this directory.
+
+Benchmarks need the same environment as the test suite, e.g. ``cp .env_example .env``.
+"""
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'indabom.settings')
+    os.environ.setdefault('CI', 'true')
+    os.environ.setdefault('WARMUP_ON_START', '0')
+
+    import django
+    django.setup()
+
+
+def create_test_database() -> str:
+    """Creates and migrates a throwaway database, returning its name.
+
+    Also applies the test environment (``testserver`` host, in-memory email backend).
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    return connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+
+
+def destroy_test_database(old_name: str):
+    from django.db import connection
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def wsgi_get(application, path: str, host: str = 'testserver') -> str:
+    """Issues a GET straight through the WSGI handler (unlike the test client, this is what gunicorn and Sentry see)."""
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host, 'SERVER_NAME': host}
+    setup_testing_defaults(environ)
+    status_holder = []
+    body = application(environ, lambda status, headers, exc_info=None: status_holder.append(status))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return status_holder[0]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def time_calls(fn: Callable[[], object], iterations: int, warmup: int = 5) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def format_row(label: str, stats: Dict[str, float]) -> str:
+    return (f"{label:<32} n={stats['n']:<6} mean={stats['mean_ms']:8.3f}ms "
+            f"p50={stats['p50_ms']:8.3f}ms p95={stats['p95_ms']:8.3f}ms")
@@ -0,0 +1,80 @@
+"""Measures per-recipient rendering throughput for campaign sends.
+
+Builds Mailgun merge data for a template of plain ``{{ variables }}`` the way the previous five-pattern conversion
+did and the way the compiled template does, then fully renders a template with tags serially and across the process
+pool. Reports renders per second for each.
+
+    python benchmarks/email_rendering.py [--recipients 100000]
+"""
+import argparse
+import time
+
+from common import setup_django
+
+MERGE_SUBJECT = 'Hi {{ user.first_name }}'
+MERGE_HTML = ('<p>Hello {{ user.get_full_name }},</p><p>Your IndaBOM account {{ user.username }} '
+              '({{ user.email }}) now has new features.</p>')
+TAGS_HTML = ('{% if user.first_name %}<p>Hello {{ user.first_name }},</p>{% else %}<p>Hello,</p>{% endif %}'
+             '<p>Your IndaBOM account {{ user.username|upper }} ({{ user.email }}) now has new features.</p>')
+
+
+def previous_merge_data(rows):
+    merge_data = {}
+    for row in rows:
+        first_name = row['first_name'] or ""
+        last_name = row['last_name'] or ""
+        merge_data[row['email']] = {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": row['email'],
+            "full_name": f"{first_name} {last_name}".strip(),
+            "username": row['username'] or "",
+        }
+    return merge_data
+
+
+def report(label, count, seconds):
+    print(f'{label:<44} {count} recipients in {seconds:8.3f}s ({count / seconds:10.0f}/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=100000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.utils import timezone
+
+    from indabom import email_rendering
+    from indabom.models import EmailTemplate
+
+    rows = [{'pk': n, 'email': f'user{n}@example.com', 'first_name': f'User{n}', 'last_name': 'Example',
+             'username': f'user{n}'} for n in range(args.recipients)]
+    now = timezone.now()
+    merge = email_rendering.get_compiled(
+        EmailTemplate(pk=1, name='merge', subject=MERGE_SUBJECT, html_body=MERGE_HTML, updated_at=now))
+    tags = email_rendering.get_compiled(
+        EmailTemplate(pk=2, name='tags', subject=MERGE_SUBJECT, html_body=TAGS_HTML, updated_at=now))
+    assert merge.merge and not tags.merge
+
+    started = time.perf_counter()
+    previous_merge_data(rows)
+    report('merge data, fixed five fields (previous)', len(rows), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    merge.merge_data(rows)
+    report('merge data, compiled template', len(rows), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    email_rendering._render_rows(tags.pk, tags.updated_at, tags.subject_source, tags.html_source, rows)
+    report('full render, one process', len(rows), time.perf_counter() - started)
+
+    email_rendering._pool().submit(int).result()  # start the workers outside the timing
+    started = time.perf_counter()
+    tags.render(rows)
+    report(f'full render, process pool ({email_rendering._pool()._max_workers} workers)', len(rows),
+           time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
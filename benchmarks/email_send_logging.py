@@ -0,0 +1,81 @@
+"""Measures writing EmailSendLog rows for one ``send_email_template`` campaign.
+
+Compares the previous one-INSERT-per-recipient logging in autocommit with the chunked ``bulk_create`` the command
+now uses, then runs the whole command against anymail's test backend. Statement counts come from
+``indabom.query_budget.QueryCounter``.
+
+    python benchmarks/email_send_logging.py [--recipients 50000]
+"""
+import argparse
+import time
+from io import StringIO
+
+from common import create_test_database, destroy_test_database, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.db import transaction
+    from django.test.utils import override_settings
+
+    from indabom.campaigns import LOG_BATCH_SIZE
+    from indabom.models import EmailSendLog, EmailTemplate
+    from indabom.query_budget import QueryCounter
+
+    old_name = create_test_database()
+    try:
+        User = get_user_model()
+        password = make_password('pw')
+        User.objects.bulk_create(
+            (User(username=f'user{n}', email=f'user{n}@example.com', password=password, first_name=f'User{n}')
+             for n in range(args.recipients)),
+            batch_size=1000,
+        )
+        users = list(User.objects.all())
+        template = EmailTemplate.objects.create(name='bench', subject='Hi {{ user.first_name }}',
+                                                html_body='<p>Hello {{ user.first_name }}</p>')
+
+        def log(user):
+            return EmailSendLog(template=template, user=user, email=user.email, status=EmailSendLog.STATUS_SENT)
+
+        def per_row():
+            for user in users:
+                log(user).save()
+
+        def bulk():
+            with transaction.atomic():
+                EmailSendLog.objects.bulk_create([log(user) for user in users], batch_size=LOG_BATCH_SIZE)
+                template.save(update_fields=['last_sent_at'])
+
+        for label, write in (('per-row create (previous)', per_row), ('bulk_create in a transaction', bulk)):
+            EmailSendLog.objects.all().delete()
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                write()
+                elapsed = time.perf_counter() - started
+            print(f'{label:<32} {args.recipients} rows in {elapsed:8.3f}s, {counter.count} statements')
+
+        EmailSendLog.objects.all().delete()
+        with override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend',
+                               DEFAULT_FROM_EMAIL='no-reply@indabom.com'):
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                call_command('send_email_template', '--template-name', 'bench', '--max-per-day', str(args.recipients),
+                             stdout=StringIO())
+                elapsed = time.perf_counter() - started
+        inserts = sum(1 for sql in counter.queries if sql.startswith('INSERT INTO "indabom_emailsendlog"'))
+        print(f'{"send_email_template command":<32} {EmailSendLog.objects.count()} rows in {elapsed:8.3f}s, '
+              f'{counter.count} statements ({inserts} log INSERTs)')
+    finally:
+        destroy_test_database(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""Gunicorn config used by ``http_load.py`` to point a worker's outbound calls at ``stand_ins.StandInServer``.
+
+Only hooks live here; bind, workers, threads and timeout come from the Dockerfile command line so the server under
+test is configured exactly as in production.
+"""
+import os
+
+
+def post_worker_init(worker):
+    import stripe
+    from django.conf import settings
+
+    base_url = os.environ['INDABOM_STAND_IN_URL']
+    stripe.api_base = base_url
+    settings.ANYMAIL['MAILGUN_API_URL'] = f'{base_url}/v3'
+    settings.RECAPTCHA_VERIFY_URL = f'{base_url}/recaptcha/api/siteverify'
@@ -0,0 +1,445 @@
+"""End-to-end HTTP load test of the site served by the gunicorn command from the Dockerfile.
+
+Migrates and seeds a scratch database (a temporary SQLite file, or ``--db-url`` for e.g. a local MySQL), starts local
+stand-ins for Stripe, Mailgun and reCAPTCHA (see ``stand_ins.py``) and launches gunicorn with the exact ``CMD``
+flags from the Dockerfile plus ``gunicorn_stand_ins.py`` for the outbound hooks. Each scenario is then run at every
+concurrency level, one client thread with its own session per concurrent user:
+
+    anonymous       marketing pages (index, about, product, pricing, install, privacy, terms)
+    login           POST /login/ (password hash, session rotation)
+    signup          POST /signup/ (reCAPTCHA verification, password hash, user and profile creation)
+    checkout-get    GET /checkout/ (Stripe price lookup)
+    checkout-post   POST /checkout/ (Stripe customer lookup, checkout session creation)
+    settings        GET /bom/settings/ with the subscription panel
+    account-delete  POST /account/delete/ (logging in each victim is not timed)
+    webhook         signed subscription.updated and invoice.payment_failed deliveries (Mailgun send)
+
+Results are written as JSON to ``benchmarks/reports/`` tagged with the git commit. Pass ``--compare`` with an earlier
+report to print the throughput and p95 change per scenario and concurrency level.
+
+    python benchmarks/http_load.py [--concurrency 1,4,8,16] [--requests 200] [--scenarios login,webhook]
+                                   [--stand-in-latency-ms 50] [--db-url mysql://user:pw@127.0.0.1/indabom_bench]
+                                   [--compare benchmarks/reports/http_load-abc1234-....json]
+
+``--db-url`` databases are flushed before seeding; never point it at data you want to keep. SQLite serializes
+writers, so write-heavy scenarios (signup, webhook) can report "database is locked" 500s at high concurrency; use a
+MySQL ``--db-url`` for numbers comparable to production.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from common import BASE_DIR, setup_django, summarize
+from stand_ins import StandInServer, sign_webhook
+
+REPORTS_DIR = BASE_DIR / 'benchmarks' / 'reports'
+PASSWORD = 'load-test-password'
+PRICE_ID = 'price_standin'
+WEBHOOK_SECRET = 'whsec_load_test'
+MARKETING_PATHS = ('/', '/about/', '/product/', '/pricing/', '/install/', '/privacy-policy/',
+                   '/terms-and-conditions/')
+
+
+def dockerfile_command(port: int):
+    """The gunicorn argv from the Dockerfile ``CMD`` with ``$PORT`` filled in."""
+    cmd = next(line for line in (BASE_DIR / 'Dockerfile').read_text().splitlines() if line.startswith('CMD '))
+    argv = shlex.split(cmd[len('CMD '):].replace('$PORT', str(port)))
+    if argv[0] == 'exec':
+        argv = argv[1:]
+    # Same interpreter as this script, so the gunicorn under test sees the same packages
+    return [sys.executable, '-m', 'gunicorn', *argv[1:]]
+
+
+def git_revision() -> str:
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True,
+                             check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{sha}-dirty' if dirty else sha
+
+
+def seed(max_concurrency: int, doomed: int):
+    """Creates the users each scenario logs in as. All share one password hash so seeding stays fast."""
+    from bom.models import Organization
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.utils import timezone as django_timezone
+
+    from indabom.models import IndabomUserMeta, OrganizationMeta, OrganizationSubscription
+
+    call_command('migrate', verbosity=0, interactive=False)
+    call_command('flush', verbosity=0, interactive=False)
+
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    usernames = ([f'owner{n}' for n in range(max_concurrency)] + [f'subscriber{n}' for n in range(max_concurrency)] +
+                 [f'doomed{n}' for n in range(doomed)])
+    User.objects.bulk_create(User(username=name, email=f'{name}@example.com', password=password) for name in usernames)
+    users = {user.username: user for user in User.objects.all()}
+    now = django_timezone.now()
+    IndabomUserMeta.objects.bulk_create(IndabomUserMeta(user=user, terms_accepted_at=now) for user in users.values())
+
+    for n in range(max_concurrency):
+        for prefix in ('owner', 'subscriber'):
+            owner = users[f'{prefix}{n}']
+            organization = Organization.objects.create(name=f'{prefix} org {n}', owner=owner,
+                                                       subscription='P' if prefix == 'subscriber' else 'F')
+            profile = owner.bom_profile()
+            profile.organization = organization
+            profile.role = 'A'
+            profile.save()
+            meta = OrganizationMeta.objects.create(organization=organization, stripe_customer_id=f'cus_{prefix}{n}')
+            if prefix == 'subscriber':
+                OrganizationSubscription.objects.create(
+                    organization_meta=meta, stripe_subscription_id=f'sub_{n}', stripe_price_id=PRICE_ID,
+                    status='active', quantity=5, current_period_start=now, current_period_end=now, started_by=owner)
+
+
+class LoadClient:
+    """One simulated user: a keep-alive session plus the timings of its measured requests."""
+
+    def __init__(self, base_url: str, index: int):
+        import requests
+
+        self.base_url = base_url
+        self.index = index
+        self.session = requests.Session()
+        self.samples = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.state = {}
+
+    def request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', 60)
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+    def timed(self, method: str, path: str, expect=(200,), **kwargs):
+        import requests
+
+        started = time.perf_counter()
+        try:
+            response = self.request(method, path, **kwargs)
+        except requests.RequestException:
+            self.samples.append(time.perf_counter() - started)
+            self.statuses['exception'] += 1
+            self.errors += 1
+            return None
+        self.samples.append(time.perf_counter() - started)
+        self.statuses[str(response.status_code)] += 1
+        if response.status_code not in expect:
+            self.errors += 1
+        return response
+
+    def csrf_data(self, **data):
+        return {'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', ''), **data}
+
+    def log_out_locally(self):
+        self.session.cookies.pop('sessionid', None)
+
+    def log_in(self, username: str):
+        self.log_out_locally()
+        self.request('GET', '/login/')
+        response = self.request('POST', '/login/', data=self.csrf_data(username=username, password=PASSWORD))
+        if response.status_code != 302:
+            raise RuntimeError(f'Could not log in as {username}: HTTP {response.status_code}')
+
+
+class Scenario:
+    def prepare(self, client: LoadClient):
+        pass
+
+    def step(self, client: LoadClient, i: int):
+        raise NotImplementedError
+
+
+class Anonymous(Scenario):
+    def step(self, client, i):
+        client.timed('GET', MARKETING_PATHS[i % len(MARKETING_PATHS)])
+
+
+class Login(Scenario):
+    def prepare(self, client):
+        client.request('GET', '/login/')
+
+    def step(self, client, i):
+        client.log_out_locally()
+        client.timed('POST', '/login/', expect=(302,),
+                     data=client.csrf_data(username=f'owner{client.index}', password=PASSWORD))
+
+
+class Signup(Scenario):
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.sequence = itertools.count()
+
+    def prepare(self, client):
+        client.request('GET', '/signup/')
+
+    def step(self, client, i):
+        client.log_out_locally()
+        username = f'signup-{self.run_id}-{next(self.sequence)}'
+        client.timed('POST', '/signup/', expect=(302,), data=client.csrf_data(
+            username=username, first_name='Load', last_name='Test', email=f'{username}@example.com',
+            password1=PASSWORD, password2=PASSWORD, **{'g-recaptcha-response': 'stand-in-token'}))
+
+
+class CheckoutGet(Scenario):
+    def prepare(self, client):
+        client.log_in(f'owner{client.index}')
+
+    def step(self, client, i):
+        client.timed('GET', '/checkout/')
+
+
+class CheckoutPost(Scenario):
+    def prepare(self, client):
+        from bom.models import Organization
+
+        client.log_in(f'owner{client.index}')
+        client.state['organization'] = Organization.objects.get(owner__username=f'owner{client.index}').pk
+
+    def step(self, client, i):
+        client.timed('POST', '/checkout/', expect=(303,), data=client.csrf_data(
+            price_id=PRICE_ID, organization=client.state['organization'], unit=1, renewal_consent='on'))
+
+
+class Settings(Scenario):
+    def prepare(self, client):
+        client.log_in(f'subscriber{client.index}')
+
+    def step(self, client, i):
+        client.timed('GET', '/bom/settings/')
+
+
+class AccountDelete(Scenario):
+    def __init__(self, victims):
+        self.victims = victims
+
+    def step(self, client, i):
+        client.log_in(f'doomed{next(self.victims)}')
+        client.timed('POST', '/account/delete/', data=client.csrf_data(password=PASSWORD))
+
+
+class Webhook(Scenario):
+    def step(self, client, i):
+        customer = f'cus_subscriber{client.index}'
+        if i % 2:
+            event = {'id': f'evt_{client.index}_{i}', 'type': 'invoice.payment_failed',
+                     'data': {'object': {'object': 'invoice', 'customer': customer}}}
+        else:
+            event = {'id': f'evt_{client.index}_{i}', 'type': 'customer.subscription.updated', 'data': {'object': {
+                'object': 'subscription', 'id': f'sub_{client.index}', 'customer': customer, 'status': 'active',
+                'quantity': 5, 'items': {'data': [{'price': {'id': PRICE_ID}, 'current_period_start': 1700000000,
+                                                   'current_period_end': 1702592000}]},
+            }}}
+        payload = json.dumps(event).encode()
+        client.timed('POST', '/webhooks/stripe/', data=payload, headers={
+            'Content-Type': 'application/json', 'Stripe-Signature': sign_webhook(payload, WEBHOOK_SECRET)})
+
+
+def run_scenario(base_url: str, scenario: Scenario, concurrency: int, requests_total: int) -> dict:
+    clients = [LoadClient(base_url, index) for index in range(concurrency)]
+    counter = itertools.count()
+    barrier = threading.Barrier(concurrency + 1)
+    failures = []
+
+    def worker(client):
+        try:
+            scenario.prepare(client)
+        except Exception as e:  # noqa: BLE001
+            failures.append(e)
+        barrier.wait()
+        if failures:
+            return
+        while (i := next(counter)) < requests_total:
+            scenario.step(client, i)
+
+    threads = [threading.Thread(target=worker, args=(client,), daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if failures:
+        raise failures[0]
+
+    samples = [sample for client in clients for sample in client.samples]
+    statuses = Counter()
+    for client in clients:
+        statuses.update(client.statuses)
+    stats = summarize(samples)
+    stats.update({
+        'concurrency': concurrency,
+        'errors': sum(client.errors for client in clients),
+        'statuses': dict(statuses),
+        'seconds': elapsed,
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+    })
+    return stats
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 120.0):
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {process.returncode}')
+        try:
+            if requests.get(f'{base_url}/readyz/', timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError('gunicorn did not become ready in time')
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def compare(previous: dict, current: dict):
+    print(f"\nchange from {previous['revision']} to {current['revision']}:")
+    old = {(row['scenario'], row['concurrency']): row for row in previous['results']}
+    for row in current['results']:
+        before = old.get((row['scenario'], row['concurrency']))
+        if before is None:
+            continue
+        throughput = (row['throughput_rps'] / before['throughput_rps'] - 1) * 100 if before['throughput_rps'] else 0
+        print(f"{row['scenario']:<16} c={row['concurrency']:<4} throughput {throughput:+7.1f}%  "
+              f"p95 {before['p95_ms']:8.1f}ms -> {row['p95_ms']:8.1f}ms")
+
+
+def format_result(row: dict) -> str:
+    return (f"{row['scenario']:<16} c={row['concurrency']:<4} {row['throughput_rps']:8.1f} req/s  "
+            f"p50={row['p50_ms']:8.1f}ms p95={row['p95_ms']:8.1f}ms p99={row['p99_ms']:8.1f}ms "
+            f"errors={row['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='1,4,8,16',
+                        help='Comma-separated concurrent users to sweep (gunicorn runs 8 threads)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario per concurrency level')
+    parser.add_argument('--scenarios', default=None, help='Comma-separated subset of scenarios to run')
+    parser.add_argument('--stand-in-latency-ms', type=float, default=50.0,
+                        help='Added to every Stripe, Mailgun and reCAPTCHA stand-in response')
+    parser.add_argument('--db-url', default=None, help='Scratch database to use instead of a temporary SQLite file')
+    parser.add_argument('--output', default=None, help='Report path (default: benchmarks/reports/)')
+    parser.add_argument('--compare', default=None, help='Earlier report to compare against')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    tmpdir = tempfile.TemporaryDirectory(prefix='indabom-load-')
+    db_url = args.db_url or f"sqlite:///{Path(tmpdir.name) / 'db.sqlite3'}"
+
+    os.environ.update({
+        'DB_URL': db_url,
+        'STRIPE_WEBHOOK_SECRET': WEBHOOK_SECRET,
+        'INDABOM_STRIPE_PRICE_ID': PRICE_ID,
+    })
+    setup_django()
+    from django.db import connection
+
+    scenarios = {
+        'anonymous': Anonymous(),
+        'login': Login(),
+        'signup': Signup(run_id),
+        'checkout-get': CheckoutGet(),
+        'checkout-post': CheckoutPost(),
+        'settings': Settings(),
+        'account-delete': AccountDelete(itertools.count()),
+        'webhook': Webhook(),
+    }
+    if args.scenarios:
+        scenarios = {name: scenarios[name] for name in args.scenarios.split(',')}
+
+    doomed = args.requests * len(levels) if 'account-delete' in scenarios else 0
+    print(f'seeding {connection.vendor} database...')
+    seed(max(levels), doomed)
+    connection.close()
+
+    stand_ins = StandInServer(latency_ms=args.stand_in_latency_ms).start()
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    command = dockerfile_command(port) + ['--config', str(BASE_DIR / 'benchmarks' / 'gunicorn_stand_ins.py')]
+    server_env = {
+        **os.environ,
+        'DEBUG': 'False',
+        'CI': 'true',
+        'WARMUP_ON_START': '1',
+        'ALLOWED_HOSTS': '127.0.0.1,localhost',
+        'INDABOM_STAND_IN_URL': stand_ins.url,
+        'PORT': str(port),
+        # Every simulated user comes from 127.0.0.1; throttle_load.py measures the throttle on its own
+        'THROTTLE_ENABLED': 'False',
+    }
+    log_path = Path(tmpdir.name) / 'gunicorn.log'
+    print(' '.join(shlex.quote(part) for part in command))
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=BASE_DIR, env=server_env, stdout=log, stderr=subprocess.STDOUT)
+    results = []
+    try:
+        wait_until_ready(base_url, process)
+        for concurrency in levels:
+            for name, scenario in scenarios.items():
+                row = {'scenario': name, **run_scenario(base_url, scenario, concurrency, args.requests)}
+                results.append(row)
+                print(format_result(row))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        stand_ins.stop()
+
+    report = {
+        'revision': git_revision(),
+        'run_at': run_id,
+        'command': command,
+        'database': connection.vendor,
+        'requests_per_level': args.requests,
+        'stand_in_latency_ms': args.stand_in_latency_ms,
+        'stand_in_calls': stand_ins.snapshot(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    output = Path(args.output) if args.output else REPORTS_DIR / f"http_load-{report['revision']}-{run_id}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'stand-in calls: {report["stand_in_calls"]}')
+    print(f'report written to {output}')
+
+    errors = sum(row['errors'] for row in results)
+    if errors:
+        print(f'{errors} requests failed; gunicorn log follows\n{log_path.read_text()[-5000:]}')
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), report)
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Measures the logging cost of handling a Stripe webhook on the request thread.
+
+Runs ``subscription_changed_handler`` repeatedly with logging filtered out (baseline), through a synchronous
+``StreamHandler`` and through ``indabom.log.QueueingHandler`` with JSON formatting, all writing to /dev/null.
+The difference from the baseline is the logging cost per webhook. A final run writes to a deliberately slow
+stream to show that request threads are not held up and that overflow is coalesced.
+
+    python benchmarks/logging_overhead.py [--iterations 500]
+"""
+import argparse
+import logging
+import os
+import time
+
+from common import create_test_database, destroy_test_database, format_row, setup_django, time_calls
+
+
+class SlowStream:
+    def write(self, _text):
+        time.sleep(0.001)
+
+    def flush(self):
+        pass
+
+
+def _event(quantity):
+    return {
+        'id': 'evt_bench',
+        'data': {'object': {
+            'id': 'sub_bench',
+            'customer': 'cus_bench',
+            'status': 'active',
+            'quantity': quantity,
+            'items': {'data': [{'price': {'id': 'price_bench'}, 'current_period_start': 1700000000,
+                                'current_period_end': 1702592000}]},
+        }},
+    }
+
+
+def _configure(logger, handler, level=logging.INFO):
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    if handler is not None:
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from bom.models import Organization
+    from django.contrib.auth import get_user_model
+
+    from indabom.log import JsonFormatter, QueueingHandler
+    from indabom.models import OrganizationMeta
+    from indabom.stripe import subscription_changed_handler
+
+    old_name = create_test_database()
+    devnull = open(os.devnull, 'w')
+    try:
+        owner = get_user_model().objects.create_user(username='bench', email='bench@example.com', password='pw')
+        organization = Organization.objects.create(name='Bench', owner=owner)
+        OrganizationMeta.objects.create(organization=organization, stripe_customer_id='cus_bench')
+
+        logger = logging.getLogger('indabom')
+        counter = iter(range(10 ** 9))
+
+        def handle_webhook():
+            subscription_changed_handler(_event(next(counter) % 5 + 1))
+
+        timestamp_format = "[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s"
+        results = {}
+        for stream_label, stream in (('/dev/null', devnull), ('1ms stream', SlowStream())):
+            sync_handler = logging.StreamHandler(stream)
+            sync_handler.setFormatter(logging.Formatter(timestamp_format))
+            queued_handler = QueueingHandler(stream=stream)
+            queued_handler.setFormatter(JsonFormatter())
+
+            for label, handler, level in (
+                    ('filtered (baseline)', None, logging.CRITICAL),
+                    ('sync StreamHandler', sync_handler, logging.INFO),
+                    ('QueueingHandler + JSON', queued_handler, logging.INFO),
+            ):
+                _configure(logger, handler, level)
+                results[label] = time_calls(handle_webhook, args.iterations)
+                print(format_row(f'{stream_label} {label}', results[label]))
+            queued_handler.stop()
+
+            baseline = results['filtered (baseline)']['mean_ms']
+            for label in ('sync StreamHandler', 'QueueingHandler + JSON'):
+                print(f"{stream_label} {label}: {results[label]['mean_ms'] - baseline:+.3f}ms logging cost per webhook")
+
+        slow_handler = QueueingHandler(queue_size=100, stream=SlowStream())
+        slow_handler.setFormatter(JsonFormatter())
+        _configure(logger, slow_handler)
+        stats = time_calls(lambda: logger.info('burst %s', 'record'), 5000, warmup=0)
+        print(format_row('burst into 1ms stream', stats))
+        print(f'dropped under backpressure: {slow_handler.dropped_total} of 5000')
+        slow_handler.stop()
+    finally:
+        devnull.close()
+        destroy_test_database(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Measures per-request overhead of Sentry tracing.
+
+Compares requests with Sentry disabled, with the route-based ``traces_sampler`` used in production and with every
+transaction traced. Envelopes are serialized by a local transport but never leave the process, so the numbers
+cover SDK instrumentation and serialization, not network time.
+
+    python benchmarks/sentry_overhead.py [--iterations 300]
+"""
+import argparse
+
+from common import create_test_database, destroy_test_database, format_row, setup_django, time_calls, wsgi_get
+
+PATHS = ('/', '/about/', '/pricing/', '/robots.txt')
+
+
+def _init_sentry(**options):
+    import sentry_sdk
+    from sentry_sdk.integrations.django import DjangoIntegration
+    from sentry_sdk.transport import Transport
+
+    class SerializingTransport(Transport):
+        sent = 0
+
+        def capture_envelope(self, envelope):
+            envelope.serialize()
+            SerializingTransport.sent += 1
+
+    sentry_sdk.init(
+        dsn='https://public@sentry.invalid/1',
+        transport=SerializingTransport,
+        integrations=[DjangoIntegration(middleware_spans=False, signals_spans=False)],
+        **options,
+    )
+    return SerializingTransport
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+
+    from indabom.tracing import make_traces_sampler
+
+    old_name = create_test_database()
+    try:
+        application = get_wsgi_application()
+        modes = (
+            ('off', None),
+            ('sampler', {'traces_sampler': make_traces_sampler()}),
+            ('always', {'traces_sample_rate': 1.0}),
+        )
+        # 'off' must run first: once the Django integration is installed it stays patched for the process
+        for mode, options in modes:
+            transport = _init_sentry(**options) if options is not None else None
+            for path in PATHS:
+                stats = time_calls(lambda: wsgi_get(application, path), args.iterations)
+                print(format_row(f'{mode} {path}', stats))
+            if transport is not None:
+                import sentry_sdk
+                sentry_sdk.flush()
+                print(f'{mode}: {transport.sent} envelopes serialized')
+    finally:
+        destroy_test_database(old_name)
+
+
+if __name__ == '__main__':
+    main()
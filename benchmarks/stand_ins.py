@@ -0,0 +1,134 @@
+"""Local stand-ins for the Stripe, Mailgun and reCAPTCHA APIs used by ``http_load.py``.
+
+Each endpoint answers with the smallest payload the app reads, after an optional fixed latency to approximate the
+real round trip. Calls are counted per route so a report shows how much outbound traffic each scenario caused.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def sign_webhook(payload: bytes, secret: str) -> str:
+    """Builds a ``Stripe-Signature`` header that ``stripe.Webhook.construct_event`` accepts for ``payload``."""
+    timestamp = int(time.time())
+    signed = f'{timestamp}.'.encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'StandInServer'
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _reply(self, route: str, payload: dict, status: int = 200):
+        self.server.count(route)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        match = re.fullmatch(r'/v1/(prices|products|customers|subscriptions)/([^/]+)', path)
+        if match is None:
+            return self._reply('unknown', {'error': {'message': f'No stand-in for GET {path}'}}, status=404)
+        kind, object_id = match.groups()
+        return self._reply(f'stripe {kind}.retrieve', self.server.stripe_object(kind, object_id))
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = parse_qs(self._body().decode())
+        if path == '/v1/customers':
+            customer = self.server.stripe_object('customers', self.server.next_id('cus'))
+            return self._reply('stripe customers.create', customer)
+        if path == '/v1/checkout/sessions':
+            session_id = self.server.next_id('cs')
+            return self._reply('stripe checkout.sessions.create', {
+                'id': session_id, 'object': 'checkout.session', 'url': f'{self.server.url}/pay/{session_id}',
+            })
+        if path == '/v1/billing_portal/sessions':
+            return self._reply('stripe billing_portal.sessions.create', {
+                'id': self.server.next_id('bps'), 'object': 'billing_portal.session',
+                'url': f'{self.server.url}/portal',
+            })
+        if re.fullmatch(r'/v3/[^/]+/messages', path):
+            return self._reply('mailgun messages', {'id': f'<{self.server.next_id("msg")}@stand-in>',
+                                                    'message': 'Queued. Thank you.'})
+        if path == '/recaptcha/api/siteverify':
+            return self._reply('recaptcha siteverify', {'success': bool(form.get('response')),
+                                                        'hostname': 'stand-in'})
+        return self._reply('unknown', {'error': {'message': f'No stand-in for POST {path}'}}, status=404)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency_ms: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency_ms / 1000
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, route: str):
+        with self._lock:
+            self.calls[route] += 1
+
+    def next_id(self, prefix: str) -> str:
+        return f'{prefix}_standin{next(self._ids)}'
+
+    def stripe_object(self, kind: str, object_id: str) -> dict:
+        if kind == 'prices':
+            return {
+                'id': object_id, 'object': 'price', 'unit_amount': 500, 'currency': 'usd',
+                'recurring': {'interval': 'month'},
+                'product': {'id': 'prod_standin', 'object': 'product', 'name': 'IndaBOM Pro'},
+            }
+        if kind == 'products':
+            return {'id': object_id, 'object': 'product', 'name': 'IndaBOM Pro'}
+        if kind == 'customers':
+            return {'id': object_id, 'object': 'customer', 'email': 'billing@example.com'}
+        return {
+            'id': object_id, 'object': 'subscription', 'status': 'active', 'quantity': 1,
+            'items': {'object': 'list', 'data': [{
+                'price': {'id': 'price_standin', 'object': 'price'},
+                'current_period_start': 1700000000, 'current_period_end': 1702592000,
+            }]},
+        }
+
+    def start(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='stand-ins', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.calls)
@@ -0,0 +1,104 @@
+"""Measures what login throttling saves under a credential-stuffing burst.
+
+Replays the same attack-shaped load through the test client with throttling off and on: ``--attackers`` addresses
+each cycle wrong passwords over ``--accounts`` real accounts, interleaved with one legitimate login (own address,
+right password) every ``--legit-every`` requests. Every request goes through the real password hasher, so the CPU
+seconds of the two runs show the hashing the throttle avoids. Reported per run: CPU and wall time, responses by
+status, password hashes, whether legitimate users got in, and the throttle's own counters.
+
+    python benchmarks/throttle_load.py [--requests 600] [--attackers 3] [--accounts 20] [--legit-every 20]
+"""
+import argparse
+import json
+import time
+from collections import Counter
+from unittest.mock import patch
+
+from common import create_test_database, destroy_test_database, setup_django
+
+PASSWORD = 'throttle-load-password'
+
+
+def run(requests: int, attackers: int, accounts: int, legit_every: int, enabled: bool) -> dict:
+    from django.contrib.auth import hashers
+    from django.core.cache import caches
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    from indabom import throttling
+
+    caches['throttle'].clear()
+    throttling._counts.clear()
+    hashes = Counter()
+    check_password = hashers.check_password
+    make_password = hashers.make_password
+
+    def counting_check(*args, **kwargs):
+        hashes['check'] += 1
+        return check_password(*args, **kwargs)
+
+    def counting_make(*args, **kwargs):
+        hashes['make'] += 1
+        return make_password(*args, **kwargs)
+
+    statuses = Counter()
+    legit = Counter()
+    client = Client()
+    with override_settings(THROTTLE_ENABLED=enabled), \
+            patch('django.contrib.auth.base_user.check_password', counting_check), \
+            patch('django.contrib.auth.base_user.make_password', counting_make):
+        cpu, wall = time.process_time(), time.perf_counter()
+        for n in range(requests):
+            if legit_every and n % legit_every == 0:
+                account = n // legit_every % accounts
+                data, address = {'username': f'user{account}', 'password': PASSWORD}, f'10.1.{account}.1'
+            else:
+                data = {'username': f'user{n % accounts}', 'password': f'guess{n}'}
+                address = f'203.0.113.{n % attackers}'
+            response = client.post('/login/', data, REMOTE_ADDR=address)
+            statuses[response.status_code] += 1
+            if data['password'] == PASSWORD:
+                legit['ok' if response.status_code == 302 else 'refused'] += 1
+            client.cookies.clear()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+    return {'throttling': enabled, 'cpu_seconds': round(cpu, 3), 'wall_seconds': round(wall, 3),
+            'cpu_ms_per_request': round(cpu / requests * 1000, 3), 'statuses': dict(statuses),
+            'password_hashes': sum(hashes.values()), 'legitimate_logins': dict(legit),
+            'counters': throttling.counters()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--attackers', type=int, default=3, help='Distinct attacking addresses')
+    parser.add_argument('--accounts', type=int, default=20, help='Accounts the attack cycles through')
+    parser.add_argument('--legit-every', type=int, default=20, help='One legitimate login per this many requests')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+
+    old_name = create_test_database()
+    try:
+        password = make_password(PASSWORD)
+        get_user_model().objects.bulk_create(
+            get_user_model()(username=f'user{n}', email=f'user{n}@example.com', password=password)
+            for n in range(args.accounts))
+        results = [run(args.requests, args.attackers, args.accounts, args.legit_every, enabled)
+                   for enabled in (False, True)]
+    finally:
+        destroy_test_database(old_name)
+
+    for result in results:
+        print(json.dumps(result))
+    off, on = results
+    if off['cpu_seconds']:
+        print(f"throttling saved {off['cpu_seconds'] - on['cpu_seconds']:.2f} CPU seconds "
+              f"({1 - on['cpu_seconds'] / off['cpu_seconds']:.0%}) and "
+              f"{off['password_hashes'] - on['password_hashes']} password hashes over {args.requests} requests")
+
+
+if __name__ == '__main__':
+    main()
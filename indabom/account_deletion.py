@@ -0,0 +1,191 @@
+"""
+Account deletion in the background.
+
+``request_deletion`` deactivates the user, which also ends their other sessions, and queues an AccountDeletionJob. The
+process_account_deletions worker claims due jobs and deletes the organization the user owns, then the user, walking
+their cascades children first so every transaction deletes at most one batch of rows of one model. A job that fails
+is retried with backoff, and whatever it had already deleted stays deleted, so a retry carries on where it stopped.
+
+``purge_candidates`` and ``purge_users`` apply the same rules and deletion to dormant accounts in bulk, for the
+purge_inactive_accounts command.
+"""
+import logging
+import time
+from datetime import timedelta
+from typing import Optional
+
+from bom.models import Organization
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mail
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from indabom import billing_metrics
+from indabom.models import AccountDeletionJob, OrganizationSubscription
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 500
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=1)  # Doubled on every further attempt
+# A running job not heard from in this long belonged to a worker that died, and is claimed again
+STALE_AFTER = timedelta(minutes=15)
+
+User = get_user_model()
+
+
+def request_deletion(user, organization: Optional[Organization] = None) -> AccountDeletionJob:
+    """Deactivates ``user`` and queues them, and ``organization`` if given, for deletion."""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        job = AccountDeletionJob.objects.create(
+            user=user, organization=organization, username=user.username, email=user.email or '',
+            organization_name=organization.name if organization is not None else '')
+    logger.info("Queued account deletion %s for %s", job.pk, user.username)
+    return job
+
+
+def claim_job(now=None) -> Optional[AccountDeletionJob]:
+    """Marks the next due job as running and returns it, or None when there is nothing to do."""
+    now = now or timezone.now()
+    due = Q(status=AccountDeletionJob.STATUS_PENDING, next_attempt_at__lte=now) | Q(
+        status=AccountDeletionJob.STATUS_RUNNING, updated_at__lt=now - STALE_AFTER)
+    with transaction.atomic():
+        job = AccountDeletionJob.objects.select_for_update(skip_locked=True).filter(due).order_by(
+            'next_attempt_at', 'pk').first()
+        if job is None:
+            return None
+        job.status = AccountDeletionJob.STATUS_RUNNING
+        job.attempts += 1
+        job.started_at = job.started_at or now
+        job.save(update_fields=['status', 'attempts', 'started_at', 'updated_at'])
+    return job
+
+
+def _cascades(model):
+    """Reverse relations whose rows are deleted along with ``model``'s."""
+    return [relation for relation in model._meta.related_objects
+            if not relation.many_to_many and getattr(relation, 'on_delete', None) is models.CASCADE]
+
+
+def delete_in_batches(model, condition: Q, on_batch, batch_size: int = DELETE_BATCH_SIZE, pause: float = 0.0,
+                      path=()):
+    """
+    Deletes the rows of ``model`` matching ``condition``, batch_size rows at a time. Each batch's cascaded rows are
+    deleted first, in batches of their own, so the final delete of the batch has nothing left to collect; SET_NULL
+    relations are still handled by Django as usual. ``on_batch`` receives the {model label: rows} of every delete.
+    """
+    manager = model._base_manager
+    path = (*path, model)
+    while True:
+        pks = list(manager.filter(condition).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        for relation in _cascades(model):
+            # Cycles (including a model pointing at itself) are left to Django's collector
+            if relation.related_model not in path:
+                delete_in_batches(relation.related_model, Q(**{f'{relation.field.name}__in': pks}), on_batch,
+                                  batch_size, pause, path)
+        if model is OrganizationSubscription:
+            # Takes the subscriptions out of the billing rollup in the same transaction
+            _count, deleted = billing_metrics.delete_subscriptions(manager.filter(pk__in=pks))
+        else:
+            with transaction.atomic():
+                _count, deleted = manager.filter(pk__in=pks).delete()
+        on_batch(deleted)
+        if pause:
+            time.sleep(pause)
+
+
+def _record_batch(job: AccountDeletionJob, deleted):
+    for label, count in deleted.items():
+        if count:
+            job.progress[label] = job.progress.get(label, 0) + count
+            job.rows_deleted += count
+    job.save(update_fields=['progress', 'rows_deleted', 'updated_at'])
+
+
+def run_job(job: AccountDeletionJob, batch_size: int = DELETE_BATCH_SIZE, pause: float = 0.0,
+            max_attempts: int = MAX_ATTEMPTS) -> AccountDeletionJob:
+    """Deletes what is left of a claimed job's organization and user, then marks it done or schedules a retry."""
+    def on_batch(deleted):
+        _record_batch(job, deleted)
+
+    try:
+        if job.organization_id is not None:
+            delete_in_batches(Organization, Q(pk=job.organization_id), on_batch, batch_size, pause)
+            job.organization_id = None
+        if job.user_id is not None:
+            delete_in_batches(User, Q(pk=job.user_id), on_batch, batch_size, pause)
+            job.user_id = None
+    except Exception as e:
+        _retry_or_fail(job, e, max_attempts)
+        return job
+
+    job.status = AccountDeletionJob.STATUS_DONE
+    job.error = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    logger.info("Deleted account %s (job %s): %s rows in %s attempts", job.username, job.pk, job.rows_deleted,
+                job.attempts)
+    _notify(job)
+    return job
+
+
+def _retry_or_fail(job: AccountDeletionJob, error: Exception, max_attempts: int):
+    job.error = f"{type(error).__name__}: {error}"
+    if job.attempts >= max_attempts:
+        job.status = AccountDeletionJob.STATUS_FAILED
+        job.finished_at = timezone.now()
+        logger.error("Account deletion %s for %s failed after %s attempts", job.pk, job.username, job.attempts,
+                     exc_info=error)
+    else:
+        job.status = AccountDeletionJob.STATUS_PENDING
+        job.next_attempt_at = timezone.now() + RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        logger.warning("Account deletion %s for %s failed (attempt %s), retrying at %s", job.pk, job.username,
+                       job.attempts, job.next_attempt_at, exc_info=error)
+    job.save(update_fields=['status', 'error', 'finished_at', 'next_attempt_at', 'updated_at'])
+
+
+def _notify(job: AccountDeletionJob):
+    if not job.email:
+        return
+    send_mail(
+        'Your IndaBOM account has been deleted',
+        f"Your IndaBOM account ({job.username}) and its data have been deleted. If this was a mistake, you can "
+        f"create a new account at any time.",
+        getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@indabom.com'),
+        [job.email],
+        fail_silently=True,
+    )
+
+
+def purge_candidates(cutoff):
+    """
+    Users with no sign of life since ``cutoff`` that delete_account would let go: not staff, neither logged in,
+    joined nor accepted the terms since then, not the owner of an organization with an active subscription or with
+    members active since then, not a member of a paying organization and not already queued for deletion.
+    """
+    owns_subscribed = OrganizationSubscription.objects.filter(
+        organization_meta__organization__owner=OuterRef('pk'), status='active')
+    member_of_subscribed = OrganizationSubscription.objects.filter(
+        organization_meta__organization__usermeta__user=OuterRef('pk'), status='active')
+    owns_active_members = User.objects.filter(
+        Q(last_login__gte=cutoff) | Q(date_joined__gte=cutoff), usermeta__organization__owner=OuterRef('pk'))
+    queued = AccountDeletionJob.objects.filter(
+        user=OuterRef('pk'), status__in=(AccountDeletionJob.STATUS_PENDING, AccountDeletionJob.STATUS_RUNNING))
+    return User.objects.filter(
+        Q(last_login__lt=cutoff) | Q(last_login__isnull=True), date_joined__lt=cutoff,
+        is_staff=False, is_superuser=False,
+    ).exclude(indabom_meta__terms_accepted_at__gte=cutoff).exclude(
+        Exists(owns_subscribed)).exclude(Exists(member_of_subscribed)).exclude(
+        Exists(owns_active_members)).exclude(Exists(queued))
+
+
+def purge_users(user_ids, on_batch, batch_size: int = DELETE_BATCH_SIZE, pause: float = 0.0):
+    """Deletes the organizations the users own, then the users, as run_job does for a single account."""
+    delete_in_batches(Organization, Q(owner_id__in=user_ids), on_batch, batch_size, pause)
+    delete_in_batches(User, Q(pk__in=user_ids), on_batch, batch_size, pause)
@@ -1,23 +1,106 @@
+import re
+
 from bom.models import Organization as BomOrganization
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
 from django.urls import path, reverse
-from django.utils.html import format_html
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
 
+from . import campaigns, stripe_sync
 from .models import (
+    AccountDeletionJob,
+    BillingMetricsDay,
     OrganizationMeta,
     OrganizationSubscription,
     CheckoutSessionRecord,
     EmailTemplate,
+    EmailSendBatch,
     EmailSendLog,
+    EmailSendQuota,
+    EmailSuppression,
     IndabomUserMeta,
+    RequestProfile,
 )
+from .pagination import EstimatedCountPaginator
+from .profiling import HEADER as PROFILE_HEADER, QUERY_PARAM as PROFILE_QUERY_PARAM, TOKEN_MAX_AGE, make_token
 from .settings import STRIPE_SECRET_KEY
 from .stripe import manage_subscription as stripe_manage_subscription
 
 User = get_user_model()
 
+# Send logs shown per page of an EmailTemplate's send-log panel, and days of per-day counts above them
+SEND_LOG_PAGE_SIZE = 50
+SEND_LOG_DAYS = 14
+
+
+class ListOnlyMixin:
+    """Loads just the ``list_only`` columns on the changelist; change views still load whole rows."""
+    list_only = ()
+
+    def get_changelist(self, request, **kwargs):
+        changelist_class = super().get_changelist(request, **kwargs)
+        fields = self.list_only
+        if not fields:
+            return changelist_class
+
+        class ListOnlyChangeList(changelist_class):
+            def get_queryset(self, request, exclude_parameters=None):
+                return super().get_queryset(request, exclude_parameters).only(*fields)
+
+        return ListOnlyChangeList
+
+
+def stripe_bulk_response(request, title: str, runs):
+    """
+    Streams a page that reports each chunk of a stripe_sync run as it completes, so support can watch a run over
+    hundreds of rows rather than wait on a blank page.
+    """
+    back_url = request.get_full_path()
+
+    def page():
+        yield format_html('<!DOCTYPE html><html><head><title>{}</title></head><body><h1>{}</h1><ul>', title, title)
+        progress = None
+        for progress in runs:
+            yield format_html('<li>{} of {} done: {} updated, {} failed</li>\n', progress.done, progress.total,
+                              progress.updated, progress.failed)
+        if progress is None:
+            yield format_html('<li>Nothing to do: no selected row has a Stripe id.</li>')
+        elif progress.errors:
+            yield format_html('</ul><h2>Errors</h2><ul>{}',
+                              format_html_join('', '<li>{}</li>', ((error,) for error in progress.errors)))
+        yield format_html('</ul><p><a href="{}">Back</a></p></body></html>', back_url)
+
+    return StreamingHttpResponse(page(), content_type='text/html; charset=utf-8')
+
+
+class FullTextSearchMixin:
+    """
+    On MySQL, answers the admin search from the FULLTEXT index over ``full_text_fields`` (each word as a prefix, all
+    required). Other databases fall back to ``search_fields``.
+    """
+    full_text_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        connection = connections[queryset.db]
+        # Boolean-mode operators in the term would change the query's meaning, so only word characters are kept
+        words = [word for word in (re.sub(r'\W+', '', word) for word in search_term.split()) if word]
+        if not self.full_text_fields or not words or connection.vendor != 'mysql':
+            return super().get_search_results(request, queryset, search_term)
+        columns = ', '.join(connection.ops.quote_name(self.model._meta.get_field(name).column)
+                            for name in self.full_text_fields)
+        match = RawSQL(f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)",
+                       (' '.join(f'+{word}*' for word in words),), output_field=FloatField())
+        return queryset.alias(search_rank=match).filter(search_rank__gt=0), False
+
 
 class OrganizationSubscriptionInline(admin.TabularInline):
     model = OrganizationSubscription
@@ -35,12 +118,6 @@ class CheckoutSessionRecordInline(admin.TabularInline):
     raw_id_fields = ('organization_subscription',)
 
 
-class EmailSendLogInline(admin.TabularInline):
-    model = EmailSendLog
-    extra = 0
-    readonly_fields = ("email", "status", "message_id", "error", "sent_at", "user")
-
-
 class IndabomUserMetaInline(admin.TabularInline):
     model = IndabomUserMeta
     readonly_fields = ("terms_accepted_at",)
@@ -53,12 +130,17 @@ class BomOrganizationInline(admin.TabularInline):
     raw_id_fields = ('owner',)
 
 @admin.register(OrganizationMeta)
-class OrganizationMetaAdmin(admin.ModelAdmin):
+class OrganizationMetaAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ('organization', 'stripe_customer_id',)
+    list_select_related = ('organization',)
+    list_only = ('organization__name', 'stripe_customer_id')
     raw_id_fields = ('organization',)
     ordering = ('organization__name',)
+    # Exact and prefix matches, so the unique customer id index answers the search
+    search_fields = ('=stripe_customer_id', '^organization__name')
     inlines = [OrganizationSubscriptionInline]
     readonly_fields = ("stripe_portal_link", "stripe_customer_link",)
+    actions = ("resync_from_stripe", "verify_stripe_customer_ids")
     fieldsets = (
         (None, {
             'fields': ('organization', 'stripe_customer_id', 'stripe_portal_link', 'stripe_customer_link')
@@ -102,36 +184,260 @@ class OrganizationMetaAdmin(admin.ModelAdmin):
         # Re-use existing portal creation/redirect logic
         return stripe_manage_subscription(request, obj.organization)
 
+    @admin.action(description="Resync subscriptions from Stripe", permissions=["change"])
+    def resync_from_stripe(self, request, queryset):
+        # The changelist queryset only loads the listed columns; the sync needs whole rows
+        metas = list(queryset.defer(None).select_related('organization'))
+        return stripe_bulk_response(request, "Resync subscriptions from Stripe", stripe_sync.resync_customers(metas))
+
+    @admin.action(description="Verify Stripe customer ids", permissions=["change"])
+    def verify_stripe_customer_ids(self, request, queryset):
+        metas = list(queryset.select_related(None).only('pk', 'stripe_customer_id'))
+        return stripe_bulk_response(request, "Verify Stripe customer ids", stripe_sync.verify_customer_ids(metas))
+
 
 @admin.register(OrganizationSubscription)
-class OrganizationSubscriptionAdmin(admin.ModelAdmin):
+class OrganizationSubscriptionAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ('organization_meta__organization', 'quantity', 'started_by', 'status')
+    list_select_related = ('organization_meta__organization', 'started_by')
+    list_only = ('organization_meta__organization__name', 'quantity', 'started_by__username', 'status')
     inlines = [CheckoutSessionRecordInline]
     raw_id_fields = ('organization_meta', 'started_by',)
+    search_fields = ('=stripe_subscription_id', '=organization_meta__stripe_customer_id',
+                     '^organization_meta__organization__name')
     readonly_fields = ('stripe_subscription_id', 'stripe_price_id', 'current_period_start', 'current_period_end',
                        'status', 'quantity')
+    actions = ("resync_from_stripe", "refresh_period_dates")
+
+    @admin.action(description="Resync from Stripe", permissions=["change"])
+    def resync_from_stripe(self, request, queryset):
+        # The changelist queryset only loads the listed columns; the sync needs whole rows
+        subscriptions = list(queryset.defer(None).select_related('organization_meta'))
+        return stripe_bulk_response(request, "Resync subscriptions from Stripe",
+                                    stripe_sync.resync_subscriptions(subscriptions))
+
+    @admin.action(description="Refresh period dates from Stripe", permissions=["change"])
+    def refresh_period_dates(self, request, queryset):
+        subscriptions = list(queryset.defer(None).select_related('organization_meta'))
+        return stripe_bulk_response(request, "Refresh period dates from Stripe",
+                                    stripe_sync.refresh_period_dates(subscriptions))
 
 
 @admin.register(CheckoutSessionRecord)
-class CheckoutSessionRecordAdmin(admin.ModelAdmin):
+class CheckoutSessionRecordAdmin(ListOnlyMixin, admin.ModelAdmin):
     list_display = ('user', 'organization_subscription', 'renewal_consent_timestamp')
+    list_select_related = ('user', 'organization_subscription__organization_meta__organization')
+    list_only = ('user__username', 'organization_subscription__status',
+                 'organization_subscription__organization_meta__organization__name', 'renewal_consent_timestamp')
     raw_id_fields = ('user', 'organization_subscription',)
     ordering = ('-renewal_consent_timestamp',)
 
 
 @admin.register(EmailTemplate)
-class EmailTemplateAdmin(admin.ModelAdmin):
-    list_display = ("name", "enabled", "updated_at", "last_sent_at")
+class EmailTemplateAdmin(FullTextSearchMixin, ListOnlyMixin, admin.ModelAdmin):
+    list_display = ("name", "enabled", "scheduled", "updated_at", "last_sent_at")
+    list_only = ("name", "enabled", "scheduled", "updated_at", "last_sent_at")
+    list_filter = ("enabled", "scheduled")
     search_fields = ("name", "subject")
-    inlines = [EmailSendLogInline]
+    full_text_fields = ("name", "subject")
+    # The change form fetches the send-log panel from send_logs_view once the page has loaded, so opening a
+    # template costs the same however many users it went to
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:pk>/send-logs/',
+                self.admin_site.admin_view(self.send_logs_view),
+                name='indabom_emailtemplate_send_logs',
+            ),
+        ]
+        return custom_urls + urls
+
+    def send_logs_view(self, request, pk: int):
+        template = get_object_or_404(EmailTemplate.objects.only('pk', 'name'), pk=pk)
+        if not self.has_view_permission(request, template):
+            raise PermissionDenied
+
+        context = {'email_template': template}
+        try:
+            # Page links carry the total from the first load and only replace the log table, so paging through
+            # the logs does not count them again
+            total = int(request.GET['total'])
+            panel = 'admin/indabom/emailtemplate/send_log_page.html'
+        except (KeyError, ValueError):
+            totals, by_day = campaigns.send_log_counts(template, SEND_LOG_DAYS)
+            total = sum(totals.values())
+            panel = 'admin/indabom/emailtemplate/send_log_panel.html'
+            context.update({
+                'totals': [(label, totals.get(status, 0)) for status, label in EmailSendLog.STATUS_CHOICES],
+                'by_day': [(day, [counts.get(status, 0) for status, _label in EmailSendLog.STATUS_CHOICES])
+                           for day, counts in by_day],
+                'status_labels': [label for _status, label in EmailSendLog.STATUS_CHOICES],
+            })
+
+        num_pages = max(1, -(-total // SEND_LOG_PAGE_SIZE))
+        try:
+            page = min(max(1, int(request.GET.get('page', 1))), num_pages)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * SEND_LOG_PAGE_SIZE
+        logs = (EmailSendLog.objects.filter(template=template)
+                .only('pk', 'email', 'status', 'delivery_status', 'message_id', 'error', 'sent_at')
+                .order_by('-sent_at', '-pk')[offset:offset + SEND_LOG_PAGE_SIZE])
+
+        context.update({
+            'total': total,
+            'logs': logs,
+            'page': page,
+            'num_pages': num_pages,
+            'previous_page': page - 1 if page > 1 else None,
+            'next_page': page + 1 if page < num_pages else None,
+        })
+        return TemplateResponse(request, panel, context)
 
 
 @admin.register(EmailSendLog)
-class EmailSendLogAdmin(admin.ModelAdmin):
-    list_display = ("template", "email", "status", "message_id", "sent_at")
+class EmailSendLogAdmin(ListOnlyMixin, admin.ModelAdmin):
+    list_display = ("template", "email", "status", "delivery_status", "message_id", "sent_at")
+    list_select_related = ("template",)
+    list_only = ("template__name", "email", "status", "delivery_status", "message_id", "sent_at")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_filter = ("status", "delivery_status", "template")
+    # Prefix on the address and exact on the message id, so both indexes serve the search instead of a scan
+    search_fields = ("^email", "=message_id")
+    readonly_fields = ("template", "batch", "user", "email", "status", "message_id", "error", "sent_at",
+                       "delivery_status", "delivery_updated_at")
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        # ESP message ids are stored in angle brackets, which are easy to leave off when pasting one
+        if '@' in term and not term.startswith('<') and not any(char.isspace() for char in term):
+            results |= queryset.filter(message_id=f'<{term}>')
+        return results, may_have_duplicates
+
+
+@admin.register(EmailSendBatch)
+class EmailSendBatchAdmin(ListOnlyMixin, admin.ModelAdmin):
+    list_display = ("template", "run_id", "number", "status", "recipient_count", "sent_count", "failed_count",
+                    "duration_ms", "started_at")
+    list_select_related = ("template",)
+    list_only = ("template__name", "run_id", "number", "status", "recipient_count", "sent_count", "failed_count",
+                 "duration_ms", "started_at")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     list_filter = ("status", "template")
-    search_fields = ("email", "message_id")
-    readonly_fields = ("template", "user", "email", "status", "message_id", "error", "sent_at")
+    search_fields = ("=run_id",)
+    readonly_fields = ("template", "run_id", "number", "status", "recipient_count", "sent_count", "failed_count",
+                       "error", "started_at", "finished_at", "duration_ms")
+
+
+@admin.register(EmailSuppression)
+class EmailSuppressionAdmin(admin.ModelAdmin):
+    list_display = ("email", "reason", "created_at")
+    list_filter = ("reason",)
+    search_fields = ("^email",)
+
+
+@admin.register(EmailSendQuota)
+class EmailSendQuotaAdmin(admin.ModelAdmin):
+    list_display = ("day", "used")
+    ordering = ("-day",)
+
+
+@admin.register(BillingMetricsDay)
+class BillingMetricsDayAdmin(admin.ModelAdmin):
+    list_display = ("day", "mrr", "seats", "active", "new_subscriptions", "churned_subscriptions")
+    ordering = ("-day",)
+    date_hierarchy = "day"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AccountDeletionJob)
+class AccountDeletionJobAdmin(admin.ModelAdmin):
+    list_display = ("username", "organization_name", "status", "attempts", "rows_deleted", "created_at",
+                    "finished_at")
+    list_filter = ("status",)
+    search_fields = ("^username", "^email")
+    ordering = ("-created_at",)
+    readonly_fields = ("user", "organization", "username", "email", "organization_name", "attempts", "rows_deleted",
+                       "progress", "error", "created_at", "updated_at", "started_at", "finished_at")
+    actions = ["retry_jobs"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Retry selected failed deletions", permissions=["change"])
+    def retry_jobs(self, request, queryset):
+        retried = queryset.filter(status=AccountDeletionJob.STATUS_FAILED).update(
+            status=AccountDeletionJob.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), finished_at=None)
+        self.message_user(request, f"Queued {retried} deletions to run again.")
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(ListOnlyMixin, admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+                    'http_count', 'http_ms', 'cache_count', 'user')
+    list_select_related = ('user',)
+    # The profile report is a large JSON document; the list only needs the summary columns
+    list_only = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+                 'http_count', 'http_ms', 'cache_count', 'user__username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_filter = ('method', 'status_code')
+    search_fields = ('path',)
+    ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
+    exclude = ('report',)
+    readonly_fields = ('created_at', 'user', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+                       'cache_count', 'http_count', 'http_ms', 'slowest_queries', 'http_calls', 'cache_calls',
+                       'profile')
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        token = make_token(request.user)
+        header = PROFILE_HEADER.removeprefix('HTTP_').replace('_', '-').title()
+        messages.info(request, format_html(
+            'To profile a request, send the header <code>{}: {}</code> or append <code>?{}={}</code>. '
+            'The token is valid for {} hours and only for your account.',
+            header, token, PROFILE_QUERY_PARAM, token, TOKEN_MAX_AGE // 3600,
+        ))
+        return super().changelist_view(request, extra_context)
+
+    @staticmethod
+    def _calls_table(rows, columns):
+        def cell(value):
+            if isinstance(value, list):
+                value = '\n'.join(value)
+            return format_html('<td><pre style="white-space: pre-wrap">{}</pre></td>', value)
+
+        header = format_html_join('', '<th>{}</th>', ((column,) for column in columns))
+        body = format_html_join('', '<tr>{}</tr>', (
+            (format_html_join('', '{}', ((cell(row.get(column)),) for column in columns)),) for row in rows
+        ))
+        return format_html('<table><thead><tr>{}</tr></thead><tbody>{}</tbody></table>', header, body)
+
+    def slowest_queries(self, obj: RequestProfile):
+        queries = sorted(obj.report.get('queries', []), key=lambda query: query['ms'], reverse=True)
+        return self._calls_table(queries, ('ms', 'alias', 'sql', 'origin'))
+
+    def http_calls(self, obj: RequestProfile):
+        return self._calls_table(obj.report.get('http_calls', []), ('ms', 'method', 'url', 'status', 'origin'))
+
+    def cache_calls(self, obj: RequestProfile):
+        return self._calls_table(obj.report.get('cache_calls', []), ('ms', 'alias', 'call', 'key', 'origin'))
+
+    def profile(self, obj: RequestProfile):
+        return format_html('<pre>{}</pre>', obj.report.get('profile', ''))
 
 
 current_admin = admin.site._registry.get(User)
@@ -0,0 +1,61 @@
+"""
+Case-insensitive email lookups that an index can serve.
+
+``email__iexact`` compiles to UPPER()/LIKE comparisons no index on auth_user can answer. Every lookup here instead
+compares EMAIL_KEY, the lower-cased email with blanks as NULL, which is exactly the expression the unique
+``indabom_user_email_key`` index (migration 0016) is built on, so it is an index lookup and two accounts can never share
+an address.
+"""
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q, Value
+from django.db.models.functions import Lower, NullIf
+
+EMAIL_KEY = NullIf(Lower('email'), Value(''))
+EMAIL_KEY_INDEX = 'indabom_user_email_key'
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def users_with_email(email: Optional[str]):
+    """The users whose email matches ``email`` ignoring case; at most one once the unique index exists."""
+    User = get_user_model()
+    key = normalize_email(email)
+    if key is None:
+        return User._default_manager.none()
+    return User._default_manager.alias(email_key=EMAIL_KEY).filter(email_key=key)
+
+
+def email_in_use(email: Optional[str]) -> bool:
+    return users_with_email(email).exists()
+
+
+class EmailBackend(ModelBackend):
+    """
+    Lets users log in with their email address as well as their username. Listed before ModelBackend, which still
+    handles plain usernames: for an address that belongs to an account this backend decides alone, so a wrong password
+    costs one hash like any other failed login.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        key = normalize_email(username)
+        if password is None or key is None or '@' not in key:
+            return None
+        User = get_user_model()
+        # Someone whose username happens to be this address keeps precedence over the account with the address
+        candidates = list(User._default_manager.alias(email_key=EMAIL_KEY).filter(
+            Q(username=username) | Q(email_key=key))[:2])
+        if not candidates:
+            return None
+        user = next((user for user in candidates if user.username == username), candidates[0])
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        raise PermissionDenied
@@ -0,0 +1,250 @@
+"""
+Daily billing rollups for the admin dashboard.
+
+Writes to OrganizationSubscription go through ``track_subscription_change`` (one subscription, from a webhook),
+``apply_changes`` with exact before/after states (the bulk Stripe sync), ``update_subscriptions`` or
+``delete_subscriptions``. Each adds the difference the write made (MRR, seats, status counts, new and churned
+subscriptions) to today's BillingMetricsDay row. The dashboard then reads the latest row instead of aggregating
+subscriptions, and ``rebuild_billing_metrics`` recomputes all rows from the subscriptions when the rollup needs a fresh
+start. Writes that bypass these, such as a cascade from deleting an organization through Django's collector, make the
+rollup drift until the next rebuild.
+"""
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from indabom.models import BillingMetricsDay, CheckoutSessionRecord, OrganizationSubscription
+
+logger = logging.getLogger(__name__)
+
+STATUS_ACTIVE = 'active'
+SNAPSHOT_FIELDS = ('mrr', 'seats', *BillingMetricsDay.STATUSES)
+DASHBOARD_WINDOW_DAYS = 30
+REBUILD_CHUNK_SIZE = 2000
+# Months per billing interval, to bring every price to a monthly amount
+INTERVAL_MONTHS = {'day': 12 / 365, 'week': 12 / 52, 'month': 1, 'year': 12}
+
+State = Tuple[str, int, Optional[int]]  # (status, quantity, monthly_unit_amount)
+STATE_FIELDS = ('status', 'quantity', 'monthly_unit_amount')
+
+
+def monthly_unit_amount(price) -> Optional[int]:
+    """Cents per seat per month for a Stripe price, or a legacy plan, as found on a subscription item."""
+    if not price:
+        return None
+    amount = price.get('unit_amount', price.get('amount'))
+    recurring = price.get('recurring') or {}
+    interval = recurring.get('interval') or price.get('interval')
+    interval_count = recurring.get('interval_count') or price.get('interval_count') or 1
+    if not isinstance(amount, int) or not isinstance(interval_count, int) or interval not in INTERVAL_MONTHS:
+        return None
+    return round(amount / (INTERVAL_MONTHS[interval] * interval_count))
+
+
+def contribution(state: Optional[State]) -> Dict[str, int]:
+    """What one subscription in ``state`` adds to the snapshot fields."""
+    if state is None:
+        return {}
+    status, quantity, amount = state
+    if status not in BillingMetricsDay.STATUSES:
+        logger.warning("Subscription status %s is not tracked in billing metrics", status)
+        return {}
+    counts = {status: 1}
+    if status == STATUS_ACTIVE:
+        counts['seats'] = quantity
+        counts['mrr'] = quantity * (amount or 0)
+    return counts
+
+
+def change(before: Optional[State], after: Optional[State]) -> Dict[str, int]:
+    """Field increments for one subscription going from ``before`` to ``after`` (None when it did not exist)."""
+    delta: Dict[str, int] = defaultdict(int)
+    for field, value in contribution(after).items():
+        delta[field] += value
+    for field, value in contribution(before).items():
+        delta[field] -= value
+    was_active = before is not None and before[0] == STATUS_ACTIVE
+    is_active = after is not None and after[0] == STATUS_ACTIVE
+    if is_active and not was_active:
+        delta['new_subscriptions'] += 1
+    elif was_active and not is_active:
+        delta['churned_subscriptions'] += 1
+    return {field: value for field, value in delta.items() if value}
+
+
+def _current_snapshot() -> Dict[str, int]:
+    """Snapshot fields aggregated from the subscriptions themselves; only used to seed the first row."""
+    snapshot = dict.fromkeys(SNAPSHOT_FIELDS, 0)
+    rows = OrganizationSubscription.objects.values('status').annotate(
+        count=Count('pk'), seats=Sum('quantity'),
+        mrr=Sum(F('quantity') * F('monthly_unit_amount'), filter=Q(monthly_unit_amount__isnull=False)))
+    for row in rows:
+        if row['status'] not in BillingMetricsDay.STATUSES:
+            continue
+        snapshot[row['status']] = row['count']
+        if row['status'] == STATUS_ACTIVE:
+            snapshot['seats'] = row['seats'] or 0
+            snapshot['mrr'] = row['mrr'] or 0
+    return snapshot
+
+
+def _seed(day: date, delta: Dict[str, int]) -> Dict[str, int]:
+    """Values for the day's first row, including ``delta``, the change that is creating it."""
+    flows = {field: delta.get(field, 0) for field in ('new_subscriptions', 'churned_subscriptions')}
+    previous = BillingMetricsDay.objects.filter(day__lt=day).order_by('-day').values(*SNAPSHOT_FIELDS).first()
+    if previous is None:
+        # No rollup yet: the subscriptions, which already include this change, are the snapshot
+        return {**_current_snapshot(), **flows}
+    return {**{field: value + delta.get(field, 0) for field, value in previous.items()}, **flows}
+
+
+def apply_change(day: date, before: Optional[State], after: Optional[State]):
+    """Adds one subscription's change to the day's row, creating it from the previous day's on the first change."""
+    apply_changes(day, [(before, after)])
+
+
+def apply_changes(day: date, transitions: Iterable[Tuple[Optional[State], Optional[State]]]):
+    """Adds the changes of many subscriptions, as (before, after) pairs, to the day's row in one update."""
+    delta: Dict[str, int] = defaultdict(int)
+    for before, after in transitions:
+        for field, value in change(before, after).items():
+            delta[field] += value
+    delta = {field: value for field, value in delta.items() if value}
+    if not delta:
+        return
+    increments = {field: F(field) + value for field, value in delta.items()}
+    if BillingMetricsDay.objects.filter(day=day).update(**increments):
+        return
+    _metrics, created = BillingMetricsDay.objects.get_or_create(day=day, defaults=_seed(day, delta))
+    if not created:
+        BillingMetricsDay.objects.filter(day=day).update(**increments)
+
+
+def state_of(subscription: OrganizationSubscription) -> State:
+    return subscription.status, subscription.quantity, subscription.monthly_unit_amount
+
+
+def _state(stripe_subscription_id: str, lock: bool = False) -> Optional[State]:
+    subscriptions = OrganizationSubscription.objects.filter(stripe_subscription_id=stripe_subscription_id)
+    if lock:
+        subscriptions = subscriptions.select_for_update()
+    return subscriptions.values_list(*STATE_FIELDS).first()
+
+
+def _states(subscriptions) -> Dict[int, State]:
+    return {pk: tuple(state) for pk, *state in subscriptions.values_list('pk', *STATE_FIELDS)}
+
+
+def update_subscriptions(subscriptions, **values) -> int:
+    """Updates the ``subscriptions`` queryset in one statement and adds what changed to today's rollup."""
+    with transaction.atomic():
+        before = _states(subscriptions.select_for_update())
+        updated = OrganizationSubscription.objects.filter(pk__in=before).update(**values)
+        after = _states(OrganizationSubscription.objects.filter(pk__in=before))
+        apply_changes(timezone.localdate(), [(state, after.get(pk)) for pk, state in before.items()])
+    return updated
+
+
+def delete_subscriptions(subscriptions) -> Tuple[int, Dict[str, int]]:
+    """Deletes the ``subscriptions`` queryset and takes them out of today's rollup; returns what delete() does."""
+    with transaction.atomic():
+        before = _states(subscriptions.select_for_update())
+        deleted = OrganizationSubscription.objects.filter(pk__in=before).delete()
+        apply_changes(timezone.localdate(), [(state, None) for state in before.values()])
+    return deleted
+
+
+@contextmanager
+def track_subscription_change(stripe_subscription_id: str):
+    """
+    Wraps a write to one subscription and adds what it changed to today's rollup. The subscription row is locked
+    from the first read, so concurrent webhooks for the same subscription apply their changes one after the other.
+    """
+    with transaction.atomic():
+        before = _state(stripe_subscription_id, lock=True)
+        yield
+        apply_change(timezone.localdate(), before, _state(stripe_subscription_id))
+
+
+def dashboard(today: Optional[date] = None) -> Optional[dict]:
+    """The latest snapshot and the last DASHBOARD_WINDOW_DAYS days of new and churned subscriptions."""
+    today = today or timezone.localdate()
+    latest = BillingMetricsDay.objects.filter(day__lte=today).order_by('-day').first()
+    if latest is None:
+        return None
+    window = BillingMetricsDay.objects.filter(day__gt=today - timedelta(days=DASHBOARD_WINDOW_DAYS),
+                                              day__lte=today).aggregate(
+        new=Sum('new_subscriptions'), churned=Sum('churned_subscriptions'))
+    new, churned = window['new'] or 0, window['churned'] or 0
+    # Share of the subscriptions active at the start of the window that have since churned
+    at_start = latest.active - new + churned
+    return {
+        'as_of': latest.day,
+        'mrr': latest.mrr / 100,
+        'seats': latest.seats,
+        'by_status': [(status, count) for status, count in latest.by_status if count],
+        'window_days': DASHBOARD_WINDOW_DAYS,
+        'new': new,
+        'churned': churned,
+        'churn_rate': churned / at_start if at_start > 0 else None,
+    }
+
+
+def rebuild(today: Optional[date] = None) -> int:
+    """
+    Recomputes every row from the subscriptions in one streaming pass and returns the number of days written.
+
+    Today's row stays locked for the whole rebuild. A webhook adds its change to that row before committing, so the
+    change is either committed before the subscriptions are read here, or waits and lands on the rebuilt row.
+
+    Only the current state of each subscription is stored, so history is inferred: a subscription starts on its first
+    checkout (or its current period start), a canceled one was active until the end of its last period, and any other
+    subscription has had its current status since it started.
+    """
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        BillingMetricsDay.objects.select_for_update().get_or_create(day=today)
+        days = _rebuilt_days(today)
+        BillingMetricsDay.objects.all().delete()
+        BillingMetricsDay.objects.bulk_create(days, batch_size=500)
+    return len(days)
+
+
+def _rebuilt_days(today: date) -> List[BillingMetricsDay]:
+    first_checkout = CheckoutSessionRecord.objects.filter(
+        organization_subscription=OuterRef('pk'), renewal_consent_timestamp__isnull=False,
+    ).order_by('renewal_consent_timestamp').values('renewal_consent_timestamp')[:1]
+    subscriptions = OrganizationSubscription.objects.annotate(first_checkout=Subquery(first_checkout)).values_list(
+        *STATE_FIELDS, 'current_period_start', 'current_period_end', 'first_checkout')
+
+    changes: Dict[date, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for status, quantity, amount, period_start, period_end, checkout in subscriptions.iterator(
+            chunk_size=REBUILD_CHUNK_SIZE):
+        started = min(timezone.localdate(min(filter(None, (checkout, period_start)))), today)
+        if status == 'canceled':
+            active = (STATUS_ACTIVE, quantity, amount)
+            ended = min(max(timezone.localdate(period_end), started), today)
+            steps = ((started, None, active), (ended, active, (status, quantity, amount)))
+        else:
+            steps = ((started, None, (status, quantity, amount)),)
+        for day, before, after in steps:
+            for field, value in change(before, after).items():
+                changes[day][field] += value
+
+    # Always write today's row, so incremental updates carry on from it
+    changes.setdefault(today, defaultdict(int))
+    snapshot = dict.fromkeys(SNAPSHOT_FIELDS, 0)
+    days = []
+    for day in sorted(changes):
+        delta = changes[day]
+        for field in SNAPSHOT_FIELDS:
+            snapshot[field] += delta.get(field, 0)
+        days.append(BillingMetricsDay(day=day, new_subscriptions=delta.get('new_subscriptions', 0),
+                                      churned_subscriptions=delta.get('churned_subscriptions', 0), **snapshot))
+    return days
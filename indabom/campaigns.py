@@ -0,0 +1,284 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from anymail.message import AnymailMessage, AnymailRecipientStatus
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from indabom.email_rendering import CompiledTemplate
+from indabom.models import EmailTemplate, EmailSendBatch, EmailSendLog, EmailSendQuota, EmailSuppression
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT when writing send logs; keeps statements under SQLite's variable cap and MySQL's packet size
+LOG_BATCH_SIZE = 500
+# Rows fetched per round trip while streaming recipients
+RECIPIENT_CHUNK_SIZE = 2000
+# User fields needed to address a recipient and fill in Mailgun merge data
+RECIPIENT_FIELDS = ('pk', 'email', 'first_name', 'last_name', 'username')
+# Mailgun rejects batch sends with more recipients than this
+MAILGUN_MAX_BATCH_SIZE = 1000
+# Batches in flight at once; each holds one worker thread waiting on the ESP
+DEFAULT_SEND_CONCURRENCY = 4
+INTERRUPTED_ERROR = "Interrupted before the ESP confirmed delivery"
+
+Recipient = Tuple[str, int]  # (email, user id)
+Rows = Dict[str, Dict[str, object]]  # email -> RECIPIENT_FIELDS values
+
+
+def _logged_on(day: date) -> int:
+    # A range on the indexed sent_at column, unlike the __date transform
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return EmailSendLog.objects.filter(sent_at__gte=start, sent_at__lt=start + timedelta(days=1)).count()
+
+
+def _quota_for(day: date) -> EmailSendQuota:
+    # A day's row is seeded from the logs already written that day, so sends from before the ledger existed count
+    quota, _created = EmailSendQuota.objects.get_or_create(day=day, defaults={'used': lambda: _logged_on(day)})
+    return quota
+
+
+def sent_today() -> int:
+    return _quota_for(timezone.localdate()).used
+
+
+def remaining_quota(max_per_day: int) -> int:
+    return max(0, max_per_day - sent_today())
+
+
+def reserve_quota(max_per_day: int, wanted: int) -> Tuple[date, int]:
+    """
+    Reserves up to ``wanted`` of today's sends and returns the day and how many were granted. Today's ledger row is
+    locked for the read-and-increment, so concurrent senders can never reserve more than ``max_per_day`` between them.
+    """
+    day = timezone.localdate()
+    pk = _quota_for(day).pk
+    with transaction.atomic():
+        used = EmailSendQuota.objects.select_for_update().values_list('used', flat=True).get(pk=pk)
+        granted = max(0, min(wanted, max_per_day - used))
+        if granted:
+            EmailSendQuota.objects.filter(pk=pk).update(used=F('used') + granted)
+    return day, granted
+
+
+def select_recipients(template: EmailTemplate, limit: int,
+                      target_emails: Optional[Iterable[str]] = None) -> Tuple[List[Recipient], Rows]:
+    """Up to ``limit`` active users, in pk order, who have not been sent ``template`` and are not being sent it."""
+    User = get_user_model()
+    users_qs = User.objects.filter(is_active=True).exclude(email__isnull=True).exclude(email='')
+
+    if target_emails is not None:
+        users_qs = users_qs.filter(email__in=list(target_emails))
+
+    # Exclude users already sent this template with a NOT EXISTS against the (template, email) index, rather
+    # than shipping every sent address back to the database as an IN list
+    already_sent = EmailSendLog.objects.filter(
+        template=template, status__in=(EmailSendLog.STATUS_SENT, EmailSendLog.STATUS_SENDING),
+        email=OuterRef('email'))
+    # Addresses that hard-bounced or complained are never mailed again; the unique email index serves the lookup
+    suppressed = EmailSuppression.objects.filter(email=OuterRef('email'))
+    users_qs = users_qs.filter(~Exists(already_sent), ~Exists(suppressed)).order_by('pk')
+
+    # Stream only the fields needed to render; one entry per address
+    rows: Rows = {}
+    for row in users_qs.values(*RECIPIENT_FIELDS)[:limit].iterator(chunk_size=RECIPIENT_CHUNK_SIZE):
+        rows.setdefault(row['email'], row)
+    return [(email, row['pk']) for email, row in rows.items()], rows
+
+
+def claim_batch(template: EmailTemplate, run_id: str, number: int,
+                chunk: List[Recipient]) -> Tuple[Optional[EmailSendBatch], List[Recipient]]:
+    """
+    Records the batch and logs its recipients as sending before anything goes to the ESP, and returns it with the
+    recipients actually claimed. Recipients are selected without a lock, so another sender (the scheduler or a
+    manual send of the same template) may have claimed some of them since; claims of a template are serialized on
+    its row and anyone already sent or sending is dropped. Returns no batch when nobody is left.
+    """
+    with transaction.atomic():
+        EmailTemplate.objects.select_for_update().filter(pk=template.pk).values_list('pk', flat=True).get()
+        taken = set(EmailSendLog.objects.filter(
+            template=template, status__in=(EmailSendLog.STATUS_SENT, EmailSendLog.STATUS_SENDING),
+            email__in=[email for email, _user_id in chunk]).values_list('email', flat=True))
+        if taken:
+            logger.warning("Skipping %d recipients of %s claimed by another sender", len(taken), template.name)
+            chunk = [(email, user_id) for email, user_id in chunk if email not in taken]
+        if not chunk:
+            return None, chunk
+        batch = EmailSendBatch.objects.create(template=template, run_id=run_id, number=number,
+                                              recipient_count=len(chunk))
+        EmailSendLog.objects.bulk_create([
+            EmailSendLog(
+                template=template,
+                batch=batch,
+                user_id=user_id,
+                email=email,
+                status=EmailSendLog.STATUS_SENDING,
+            )
+            for email, user_id in chunk
+        ], batch_size=LOG_BATCH_SIZE)
+    return batch, chunk
+
+
+def deliver(compiled: CompiledTemplate, from_email: str,
+            rows: List[Dict[str, object]]) -> Tuple[Optional[dict], Optional[Exception], float]:
+    """Renders and sends one batch; runs on a worker thread and does not touch the database."""
+    started = time.perf_counter()
+    try:
+        if not compiled.merge:
+            return _deliver_individually(compiled, from_email, rows), None, time.perf_counter() - started
+        merge_data = compiled.merge_data(rows)
+        msg = AnymailMessage(
+            subject=compiled.subject,
+            body=compiled.text,
+            from_email=from_email,
+            to=list(merge_data),
+        )
+        msg.attach_alternative(compiled.html, "text/html")
+        msg.merge_data = merge_data  # per-recipient variables
+        msg.send(fail_silently=False)
+    except Exception as e:  # noqa: BLE001
+        return None, e, time.perf_counter() - started
+
+    # anymail_status provides per-recipient details
+    status = getattr(msg, "anymail_status", None)
+    # dict: email -> {status, message_id, ...}
+    recipient_statuses = status.recipients if status is not None else {}
+    return recipient_statuses, None, time.perf_counter() - started
+
+
+def _deliver_individually(compiled: CompiledTemplate, from_email: str, rows: List[Dict[str, object]]) -> dict:
+    # One message per recipient over a single connection; a rejected message only fails its own recipient.
+    # A rendering error fails the whole batch and is raised to deliver.
+    recipient_statuses = {}
+    connection = get_connection()
+    for email, subject, text, html in compiled.render(rows):
+        msg = AnymailMessage(subject=subject, body=text, from_email=from_email, to=[email], connection=connection)
+        msg.attach_alternative(html, "text/html")
+        try:
+            msg.send(fail_silently=False)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to send campaign email to %s: %s", email, e)
+            recipient_statuses[email] = AnymailRecipientStatus(message_id=None, status="failed")
+            continue
+        status = getattr(msg, "anymail_status", None)
+        if status is not None:
+            recipient_statuses.update(status.recipients)
+    return recipient_statuses
+
+
+def record_batch(template: EmailTemplate, batch: EmailSendBatch, chunk: List[Recipient],
+                 recipient_statuses: Optional[dict], error: Optional[Exception], elapsed: float) -> EmailSendBatch:
+    """Moves the batch's logs from sending to sent or failed; the checkpoint an interrupted run resumes from."""
+    # (status, message_id, error) -> emails, so a batch that went through is a single UPDATE
+    outcomes: Dict[Tuple[str, Optional[str], Optional[str]], List[str]] = defaultdict(list)
+    for email, _user_id in chunk:
+        if error is not None:
+            outcomes[(EmailSendLog.STATUS_FAILED, None, str(error))].append(email)
+            continue
+        st = recipient_statuses.get(email)
+        message_id = getattr(st, "message_id", None) if st else None
+        if st is None or st.status == "queued" or st.status == "sent":
+            outcomes[(EmailSendLog.STATUS_SENT, message_id, None)].append(email)
+        else:
+            outcomes[(EmailSendLog.STATUS_FAILED, message_id, f"ESP status: {st.status}")].append(email)
+
+    batch.sent_count = sum(len(emails) for (status, _m, _e), emails in outcomes.items()
+                           if status == EmailSendLog.STATUS_SENT)
+    batch.failed_count = len(chunk) - batch.sent_count
+    batch.status = EmailSendBatch.STATUS_FAILED if error is not None else EmailSendBatch.STATUS_SENT
+    batch.error = str(error) if error is not None else None
+    batch.finished_at = timezone.now()
+    batch.duration_ms = round(elapsed * 1000, 3)
+
+    with transaction.atomic():
+        logs = EmailSendLog.objects.filter(batch=batch)
+        for (status, message_id, log_error), emails in outcomes.items():
+            matching = logs if len(outcomes) == 1 else logs.filter(email__in=emails)
+            matching.update(status=status, message_id=message_id, error=log_error)
+        batch.save(update_fields=["sent_count", "failed_count", "status", "error", "finished_at", "duration_ms"])
+        template.last_sent_at = timezone.now()
+        template.save(update_fields=["last_sent_at"])
+    return batch
+
+
+def unconfirmed_count(template: EmailTemplate) -> int:
+    return EmailSendLog.objects.filter(template=template, status=EmailSendLog.STATUS_SENDING).count()
+
+
+def release_unconfirmed(template: EmailTemplate) -> int:
+    """Marks recipients of batches that never heard back from the ESP as failed, so they are selected again."""
+    with transaction.atomic():
+        released = EmailSendLog.objects.filter(template=template, status=EmailSendLog.STATUS_SENDING).update(
+            status=EmailSendLog.STATUS_FAILED, error=INTERRUPTED_ERROR)
+        EmailSendBatch.objects.filter(template=template, status=EmailSendBatch.STATUS_SENDING).update(
+            status=EmailSendBatch.STATUS_FAILED, error=INTERRUPTED_ERROR, finished_at=timezone.now())
+    return released
+
+
+def send_log_counts(template: EmailTemplate, days: int) -> Tuple[Dict[str, int], List[Tuple[date, Dict[str, int]]]]:
+    """
+    Sends of ``template`` per status overall, and per day (newest first) for the last ``days`` days, the latter from
+    a GROUP BY over the (template, sent_at) index that only reads the window.
+    """
+    totals = dict(EmailSendLog.objects.filter(template=template).values_list('status').annotate(count=Count('pk'))
+                  .order_by())
+    since = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    by_day: Dict[date, Dict[str, int]] = {}
+    rows = (EmailSendLog.objects.filter(template=template, sent_at__gte=since)
+            .annotate(day=TruncDate('sent_at'))
+            .values_list('day', 'status')
+            .annotate(count=Count('pk'))
+            .order_by('-day', 'status'))
+    for day, status, count in rows:
+        by_day.setdefault(day, defaultdict(int))[status] += count
+    return totals, [(day, dict(counts)) for day, counts in by_day.items()]
+
+
+class TokenBucket:
+    """Grants up to ``capacity`` sends at once, refilled continuously at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def take(self, wanted: int) -> int:
+        """Takes as many whole tokens as are available, up to ``wanted``."""
+        with self._lock:
+            self._refill()
+            granted = max(0, min(wanted, int(self.tokens)))
+            self.tokens -= granted
+            return granted
+
+    def give_back(self, unused: int):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + unused)
+
+    def seconds_until(self, wanted: int = 1) -> float:
+        with self._lock:
+            self._refill()
+            missing = min(wanted, self.capacity) - self.tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate if self.rate > 0 else float('inf')
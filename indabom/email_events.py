@@ -0,0 +1,124 @@
+"""
+Ingests ESP delivery events from the tracking webhook.
+
+Each webhook request carries a handful of events at most, so concurrent requests are group-committed: the first one
+in waits briefly for others to join, writes everyone's events in one transaction, and every request returns only once
+its events are stored. Nothing is acknowledged to the ESP before it is written, so a failed write is retried by the
+ESP rather than lost.
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from anymail.signals import AnymailTrackingEvent, EventType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from indabom.models import EmailSendLog, EmailSuppression
+
+# anymail tracking event -> EmailSendLog.delivery_status; opens and clicks don't change it
+DELIVERY_STATUSES = {
+    EventType.DELIVERED: EmailSendLog.DELIVERY_DELIVERED,
+    EventType.DEFERRED: EmailSendLog.DELIVERY_DEFERRED,
+    EventType.BOUNCED: EmailSendLog.DELIVERY_BOUNCED,
+    EventType.REJECTED: EmailSendLog.DELIVERY_REJECTED,
+    EventType.COMPLAINED: EmailSendLog.DELIVERY_COMPLAINED,
+    EventType.UNSUBSCRIBED: EmailSendLog.DELIVERY_UNSUBSCRIBED,
+}
+SUPPRESSION_REASONS = {
+    EventType.BOUNCED: EmailSuppression.REASON_BOUNCED,
+    EventType.COMPLAINED: EmailSuppression.REASON_COMPLAINED,
+}
+# (message_id, email) pairs per UPDATE when applying delivery events
+EVENT_UPDATE_BATCH_SIZE = 200
+# Longest a request waits for others to share its write, and the most events written together
+GROUP_COMMIT_WAIT = 0.05
+GROUP_COMMIT_MAX_EVENTS = 500
+
+
+def apply_delivery_events(events: Iterable[AnymailTrackingEvent]) -> int:
+    """
+    Records ESP tracking events on the matching send logs and suppresses hard-bounced and complaining addresses.
+    Logs are matched on the indexed message_id plus the recipient, since a batch send shares one message id, and
+    are written with one UPDATE per status rather than one per event. Returns the number of logs updated.
+    """
+    latest: Dict[Tuple[str, str], str] = {}
+    suppressions: Dict[str, str] = {}
+    for event in sorted(events, key=lambda e: e.timestamp or timezone.now()):
+        if not event.recipient:
+            continue
+        if event.event_type in SUPPRESSION_REASONS:
+            suppressions.setdefault(event.recipient, SUPPRESSION_REASONS[event.event_type])
+        status = DELIVERY_STATUSES.get(event.event_type)
+        if status is not None and event.message_id:
+            latest[(event.message_id, event.recipient)] = status
+
+    by_status: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+    for key, status in latest.items():
+        by_status[status].append(key)
+
+    updated = 0
+    now = timezone.now()
+    with transaction.atomic():
+        for status, keys in by_status.items():
+            for i in range(0, len(keys), EVENT_UPDATE_BATCH_SIZE):
+                match = Q()
+                for message_id, email in keys[i:i + EVENT_UPDATE_BATCH_SIZE]:
+                    match |= Q(message_id=message_id, email=email)
+                logs = EmailSendLog.objects.filter(match)
+                if status == EmailSendLog.DELIVERY_DEFERRED:
+                    # A late retry notice must not hide a delivery or bounce that was already recorded
+                    logs = logs.filter(Q(delivery_status__isnull=True) | Q(delivery_status=status))
+                updated += logs.update(delivery_status=status, delivery_updated_at=now)
+        if suppressions:
+            EmailSuppression.objects.bulk_create(
+                [EmailSuppression(email=email, reason=reason) for email, reason in suppressions.items()],
+                ignore_conflicts=True)
+    return updated
+
+
+class _Group:
+    def __init__(self):
+        self.events: List[AnymailTrackingEvent] = []
+        self.has_leader = False
+        self.done = threading.Event()
+        self.error = None
+
+
+class DeliveryEventBuffer:
+    """Group-commits events submitted by concurrent webhook requests."""
+
+    def __init__(self, max_wait: float = GROUP_COMMIT_WAIT, max_events: int = GROUP_COMMIT_MAX_EVENTS):
+        self.max_wait = max_wait
+        self.max_events = max_events
+        self._cond = threading.Condition()
+        self._group = _Group()
+
+    def submit(self, events: Iterable[AnymailTrackingEvent]):
+        """Blocks until ``events`` are written (with whatever else arrived meanwhile); re-raises a failed write."""
+        with self._cond:
+            group = self._group
+            group.events.extend(events)
+            leader = not group.has_leader
+            group.has_leader = True
+            if len(group.events) >= self.max_events:
+                self._cond.notify_all()
+            if leader:
+                self._cond.wait_for(lambda: len(group.events) >= self.max_events, timeout=self.max_wait)
+                self._group = _Group()
+
+        if leader:
+            try:
+                apply_delivery_events(group.events)
+            except Exception as e:  # noqa: BLE001
+                group.error = e
+            finally:
+                group.done.set()
+        else:
+            group.done.wait()
+        if group.error is not None:
+            raise group.error
+
+
+event_buffer = DeliveryEventBuffer()
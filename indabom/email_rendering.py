@@ -0,0 +1,221 @@
+"""
+Renders EmailTemplates for campaign sends.
+
+A template made only of text and ``{{ variables }}`` is compiled once into an ESP merge template: each distinct
+variable becomes a Mailgun ``%recipient.*%`` placeholder and is evaluated per recipient in Python when building merge
+data, so a whole batch goes out in one request. Templates using tags (``{% if %}``, ``{% for %}``, ...) are rendered in
+full per recipient, spread over a process pool for large batches, and sent as individual messages.
+
+Recipients are rendered from the user fields selected for the campaign, not full User instances.
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from html import escape  # same output as django.utils.html.escape without the SafeString wrapping
+from typing import Callable, Dict, List, Optional, Tuple
+
+import django
+from django.template import Context, Engine
+from django.template.base import TextNode, VariableNode
+
+from indabom.models import EmailTemplate
+
+# Rows below this are rendered on the calling thread; pickling them to a worker costs more than it saves
+PROCESS_POOL_MIN_ROWS = 200
+PROCESS_POOL_CHUNK_SIZE = 100
+
+_BR_RE = re.compile(r'<\s*br\s*/?>', re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+_BLANK_LINES_RE = re.compile(r'\n\n+')
+
+Row = Dict[str, object]
+Rendered = Tuple[str, str, str, str]  # (email, subject, text, html)
+
+
+def html_to_text(html: str) -> str:
+    # Minimal fallback: remove tags; KISS for announcements
+    text = _BR_RE.sub('\n', html)
+    text = _TAG_RE.sub('', text)
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+class RecipientUser:
+    """The ``user`` in a campaign template context, built from a selected values() row."""
+    __slots__ = ('pk', 'email', 'first_name', 'last_name', 'username')
+
+    def __init__(self, row: Row):
+        self.pk = row['pk']
+        self.email = row['email']
+        self.first_name = row['first_name'] or ''
+        self.last_name = row['last_name'] or ''
+        self.username = row['username'] or ''
+
+    def get_full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}".strip()
+
+    def get_short_name(self) -> str:
+        return self.first_name
+
+    def __str__(self):
+        return self.username
+
+
+def _parse(source: str):
+    return Engine.get_default().from_string(source)
+
+
+@dataclass
+class CompiledTemplate:
+    pk: Optional[int]
+    updated_at: object
+    subject_source: str
+    html_source: str
+    # ESP merge template; None when the template needs full per-recipient rendering
+    subject: Optional[str] = None
+    text: Optional[str] = None
+    html: Optional[str] = None
+    variables: Dict[str, VariableNode] = field(default_factory=dict)
+
+    @property
+    def merge(self) -> bool:
+        return self.html is not None
+
+    def merge_data(self, rows: List[Row]) -> Dict[str, Dict[str, str]]:
+        """Per-recipient values for every placeholder: raw for the subject and text, escaped for the HTML."""
+        getters = [(key, f'{key}_html', _getter(node)) for key, node in self.variables.items()]
+        data = {}
+        for row in rows:
+            values = {}
+            for key, html_key, getter in getters:
+                values[key], values[html_key] = getter(row)
+            data[row['email']] = values
+        return data
+
+    def render(self, rows: List[Row]) -> List[Rendered]:
+        """Full Django rendering, one message per recipient."""
+        if len(rows) < PROCESS_POOL_MIN_ROWS:
+            return _render_rows(self.pk, self.updated_at, self.subject_source, self.html_source, rows)
+        chunks = [rows[i:i + PROCESS_POOL_CHUNK_SIZE] for i in range(0, len(rows), PROCESS_POOL_CHUNK_SIZE)]
+        futures = [_pool().submit(_render_rows, self.pk, self.updated_at, self.subject_source, self.html_source,
+                                  chunk) for chunk in chunks]
+        return [rendered for future in futures for rendered in future.result()]
+
+
+# Plain {{ user.<field> }} lookups read straight from the row instead of going through a template Context
+_FIELD_GETTERS: Dict[str, Callable[[Row], str]] = {
+    'email': lambda row: row['email'],
+    'first_name': lambda row: row['first_name'] or '',
+    'last_name': lambda row: row['last_name'] or '',
+    'username': lambda row: row['username'] or '',
+    'get_full_name': lambda row: f"{row['first_name'] or ''} {row['last_name'] or ''}".strip(),
+    'get_short_name': lambda row: row['first_name'] or '',
+}
+
+
+def _getter(node: VariableNode) -> Callable[[Row], Tuple[str, str]]:
+    """Returns a function of a row giving the node's (raw, HTML-escaped) output."""
+    expression = node.filter_expression
+    var = expression.var
+    lookups = getattr(var, 'lookups', None)
+    if not expression.filters and lookups and len(lookups) == 2 and lookups[0] == 'user' \
+            and lookups[1] in _FIELD_GETTERS:
+        field_getter = _FIELD_GETTERS[lookups[1]]
+
+        def fast(row: Row) -> Tuple[str, str]:
+            value = field_getter(row)
+            return value, escape(value)
+        return fast
+
+    def render(row: Row) -> Tuple[str, str]:
+        user = RecipientUser(row)
+        return node.render(Context({'user': user}, autoescape=False)), node.render(Context({'user': user}))
+    return render
+
+
+def _merge_source(nodelist, variables: Dict[str, VariableNode], tokens: Dict[str, str],
+                  suffix: str) -> Optional[str]:
+    parts = []
+    for node in nodelist:
+        if isinstance(node, TextNode):
+            parts.append(node.s)
+        elif isinstance(node, VariableNode):
+            token = node.filter_expression.token
+            if token not in tokens:
+                tokens[token] = f'v{len(tokens)}'
+                variables[tokens[token]] = node
+            parts.append(f'%recipient.{tokens[token]}{suffix}%')
+        else:
+            return None
+    return ''.join(parts)
+
+
+def compile_email_template(template: EmailTemplate) -> CompiledTemplate:
+    compiled = CompiledTemplate(template.pk, template.updated_at, template.subject, template.html_body)
+    variables: Dict[str, VariableNode] = {}
+    tokens: Dict[str, str] = {}
+    subject = _merge_source(_parse(template.subject).nodelist, variables, tokens, '')
+    html_nodes = _parse(template.html_body).nodelist
+    html = _merge_source(html_nodes, variables, tokens, '_html')
+    if subject is None or html is None:
+        return compiled
+    compiled.subject = subject
+    compiled.html = html
+    compiled.text = html_to_text(_merge_source(html_nodes, variables, tokens, ''))
+    compiled.variables = variables
+    return compiled
+
+
+_compiled: Dict[int, CompiledTemplate] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled(template: EmailTemplate) -> CompiledTemplate:
+    """The compiled form of ``template``, cached until its ``updated_at`` changes."""
+    with _compiled_lock:
+        compiled = _compiled.get(template.pk)
+        if compiled is None or compiled.updated_at != template.updated_at:
+            compiled = compile_email_template(template)
+            if template.pk is not None:
+                _compiled[template.pk] = compiled
+        return compiled
+
+
+# Per process: the most recently parsed template, reused across the chunks of a batch
+_parsed: Dict[tuple, tuple] = {}
+
+
+def _render_rows(pk, updated_at, subject_source: str, html_source: str, rows: List[Row]) -> List[Rendered]:
+    key = (pk, updated_at, subject_source, html_source)
+    # Small batches render on the campaign's worker threads, so work from a local reference to the cached pair
+    parsed = _parsed.get(key)
+    if parsed is None:
+        parsed = (_parse(subject_source), _parse(html_source))
+        _parsed.clear()
+        _parsed[key] = parsed
+    subject_template, html_template = parsed
+    rendered = []
+    for row in rows:
+        user = RecipientUser(row)
+        html = html_template.render(Context({'user': user}))
+        subject = subject_template.render(Context({'user': user}, autoescape=False))
+        rendered.append((user.email, subject, html_to_text(html), html))
+    return rendered
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Forking a process that already runs campaign threads, the log listener and DB connections can
+            # inherit a held lock; forkserver workers start from a clean single-threaded server instead. The
+            # initializer is django.setup itself, since unpickling anything from this module imports the models.
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, initializer=django.setup,
+                                            mp_context=multiprocessing.get_context('forkserver'))
+        return _executor
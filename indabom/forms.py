@@ -1,10 +1,10 @@
 from bom.models import Organization
 from django import forms
-from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth.models import User
+from django.contrib.auth.forms import AuthenticationForm, PasswordResetForm, UserCreationForm
 from django.core.exceptions import ValidationError
-from django_recaptcha.fields import ReCaptchaField
 
+from indabom.auth_backends import email_in_use, users_with_email
+from indabom.recaptcha import BoundedReCaptchaField
 from indabom.settings import DEBUG
 
 
@@ -12,18 +12,18 @@ class UserForm(UserCreationForm):
     first_name = forms.CharField(required=True)
     last_name = forms.CharField(required=True)
     email = forms.EmailField(required=True)
-    captcha = ReCaptchaField(label='')
+    captcha = BoundedReCaptchaField(label='')
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, remote_ip=None, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
         self.fields['captcha'].required = not DEBUG
+        self.fields['captcha'].remote_ip = remote_ip
         if DEBUG:
             del self.fields['captcha']
 
     def clean_email(self):
         email = self.cleaned_data['email']
-        exists = User.objects.filter(email__iexact=email).count() > 0
-        if exists:
+        if email_in_use(email):
             raise ValidationError('An account with this email address already exists.')
         return email
 
@@ -36,6 +36,19 @@ class UserForm(UserCreationForm):
         return user
 
 
+class LoginForm(AuthenticationForm):
+    username = forms.CharField(label='Username or email', max_length=254,
+                               widget=forms.TextInput(attrs={'autofocus': True, 'autocomplete': 'username'}))
+
+
+class EmailPasswordResetForm(PasswordResetForm):
+    def get_users(self, email):
+        # Same rules as Django's, but through the indexed email lookup rather than email__iexact
+        for user in users_with_email(email).filter(is_active=True):
+            if user.has_usable_password():
+                yield user
+
+
 class SubscriptionForm(forms.Form):
     price_id = forms.CharField(widget=forms.HiddenInput(), max_length=255)
     organization = forms.ModelChoiceField(queryset=Organization.objects.none(), widget=forms.HiddenInput())
@@ -48,8 +61,9 @@ class SubscriptionForm(forms.Form):
         super(SubscriptionForm, self).__init__(*args, **kwargs)
         queryset = Organization.objects.filter(owner=self.owner)
         self.fields['organization'].queryset = queryset
-        if queryset.count() > 0:
-            self.fields['organization'].initial = queryset[0]
+        first_organization = queryset.first()
+        if first_organization is not None:
+            self.fields['organization'].initial = first_organization
 
 
 class OrganizationForm(forms.Form):
@@ -0,0 +1,134 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import traceback
+from datetime import datetime, timezone
+
+from django.utils.module_loading import import_string
+
+_STOP = object()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON understood by Cloud Logging's structured logging agent."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            # Error Reporting picks up stack traces appended to the message
+            message = f"{message}\n{''.join(traceback.format_exception(*record.exc_info))}"
+        elif record.exc_text:
+            message = f"{message}\n{record.exc_text}"
+
+        payload = {
+            'severity': record.levelname,
+            'message': message,
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'logger': record.name,
+            'thread': record.threadName,
+            'logging.googleapis.com/sourceLocation': {
+                'file': record.pathname,
+                'line': record.lineno,
+                'function': record.funcName,
+            },
+        }
+        status_code = getattr(record, 'status_code', None)
+        if status_code is not None:
+            payload['status_code'] = status_code
+        return json.dumps(payload, default=str)
+
+
+class QueueingHandler(logging.Handler):
+    """Hands records to a listener thread that formats and emits them through a wrapped handler.
+
+    The calling thread only merges the message arguments and enqueues. When the queue is full records are dropped
+    and the listener later emits a single warning with the number dropped, so a burst never blocks a request.
+    """
+
+    def __init__(self, target_class: str = 'logging.StreamHandler', queue_size: int = 10000, **target_kwargs):
+        super().__init__()
+        self.target: logging.Handler = import_string(target_class)(**target_kwargs)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # Since the last overflow warning
+        self.dropped_total = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def _ensure_listener(self):
+        # Started lazily, and again after a fork, because threads do not survive into gunicorn workers
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._listen, name='indabom-log-listener', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now so later mutation of the arguments cannot change the message. exc_info is kept as-is and
+        # the traceback is only rendered on the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+            self.dropped_total += 1
+        except Exception:  # noqa: BLE001
+            self.handleError(record)
+
+    def _report_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        self.target.handle(logging.LogRecord(
+            'indabom.log', logging.WARNING, __file__, 0,
+            'Logging queue full; dropped %d records', (dropped,), None,
+        ))
+
+    def _listen(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is _STOP:
+                    return
+                if self.dropped:
+                    self._report_dropped()
+                self.target.handle(record)
+            except Exception:  # noqa: BLE001
+                self.target.handleError(record)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, timeout: float = 2.0):
+        """Drains the queue and stops the listener. Registered to run at interpreter exit."""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def flush(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from indabom import account_deletion
+from indabom.account_deletion import DELETE_BATCH_SIZE, MAX_ATTEMPTS
+from indabom.models import AccountDeletionJob
+
+DEFAULT_POLL_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    help = "Work through queued account deletions, deleting each account's rows in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DELETE_BATCH_SIZE,
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep after each batch, to go easy on the database')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help='Attempts before a job is marked failed')
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help='Seconds to wait between checks for new jobs')
+        parser.add_argument('--until-idle', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        done = failed = 0
+        while True:
+            job = account_deletion.claim_job()
+            if job is None:
+                if options['until_idle']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            job = account_deletion.run_job(job, batch_size, options['pause'], options['max_attempts'])
+            line = f"{job.username} (job {job.pk}): {job.rows_deleted} rows deleted, attempt {job.attempts}"
+            if job.status == AccountDeletionJob.STATUS_DONE:
+                done += 1
+                self.stdout.write(self.style.SUCCESS(f"Deleted {line}"))
+            elif job.status == AccountDeletionJob.STATUS_FAILED:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"Gave up on {line}: {job.error}"))
+            else:
+                self.stderr.write(self.style.WARNING(f"Will retry {line}: {job.error}"))
+
+        if failed:
+            self.stderr.write(self.style.ERROR(f"{failed} account deletions failed."))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {done} accounts."))
@@ -0,0 +1,100 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from bom.models import Organization
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from indabom import account_deletion
+from indabom.account_deletion import DELETE_BATCH_SIZE
+
+User = get_user_model()
+
+DEFAULT_INACTIVE_DAYS = 730
+DEFAULT_USER_BATCH_SIZE = 100
+DRY_RUN_SAMPLE_SIZE = 20
+
+
+class Command(BaseCommand):
+    help = ("Delete accounts, and the organizations they own, that have not been used for --inactive-days, "
+            "following the same rules as deleting an account from its settings page.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=DEFAULT_INACTIVE_DAYS,
+                            help='Purge accounts with no login, sign up or terms acceptance in this many days')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_USER_BATCH_SIZE,
+                            help='Accounts selected and checked at a time')
+        parser.add_argument('--delete-batch-size', type=int, default=DELETE_BATCH_SIZE,
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep after each delete, to go easy on the database and replicas')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many accounts')
+
+    def handle(self, *args, **options):
+        inactive_days = options['inactive_days']
+        batch_size = options['batch_size']
+        if inactive_days < 1:
+            raise CommandError('--inactive-days must be at least 1.')
+        if batch_size < 1 or options['delete_batch_size'] < 1:
+            raise CommandError('--batch-size and --delete-batch-size must be at least 1.')
+        limit = options['limit']
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(days=inactive_days)
+        candidates = account_deletion.purge_candidates(cutoff)
+
+        deleted = Counter()
+        users = organizations = 0
+        sample = []
+        started = time.perf_counter()
+        self.stdout.write(f"{'Dry run: ' if dry_run else ''}purging accounts inactive since {cutoff:%Y-%m-%d}")
+
+        # Walk the candidates by primary key a batch at a time rather than holding one cursor open over a table
+        # that is being deleted from
+        last_pk = 0
+        while limit is None or users < limit:
+            size = batch_size if limit is None else min(batch_size, limit - users)
+            batch = list(candidates.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            if dry_run:
+                users += len(batch)
+                organizations += Organization.objects.filter(owner_id__in=batch).count()
+                if len(sample) < DRY_RUN_SAMPLE_SIZE:
+                    sample += candidates.filter(pk__in=batch).order_by('pk').values_list(
+                        'username', 'last_login')[:DRY_RUN_SAMPLE_SIZE - len(sample)]
+                continue
+
+            # Check again and deactivate in one go, so nobody who signed in since the batch was read is deleted
+            with transaction.atomic():
+                batch = list(candidates.filter(pk__in=batch).select_for_update().values_list('pk', flat=True))
+                User.objects.filter(pk__in=batch).update(is_active=False)
+            if not batch:
+                continue
+            account_deletion.purge_users(batch, deleted.update, options['delete_batch_size'], options['pause'])
+            users += len(batch)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{users} accounts purged, {sum(deleted.values())} rows in {elapsed:.1f}s")
+
+        elapsed = time.perf_counter() - started
+        if dry_run:
+            for username, last_login in sample:
+                self.stdout.write(f"  {username} (last login {last_login:%Y-%m-%d})" if last_login else
+                                  f"  {username} (never logged in)")
+            self.stdout.write(self.style.WARNING(
+                f"Dry run: would delete {users} accounts and the {organizations} organizations they own "
+                f"(found in {elapsed:.1f}s)."))
+            return
+
+        for label, count in sorted(deleted.items()):
+            self.stdout.write(f"  {label}: {count}")
+        rows = sum(deleted.values())
+        organizations = deleted[Organization._meta.label]
+        rate = f"{users / elapsed:.1f} accounts/s, {rows / elapsed:.0f} rows/s" if elapsed else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {users} accounts and {organizations} organizations, {rows} rows in {elapsed:.1f}s ({rate})."))
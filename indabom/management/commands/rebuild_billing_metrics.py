@@ -0,0 +1,42 @@
+import stripe
+from django.core.management.base import BaseCommand
+
+from indabom import billing_metrics
+from indabom.models import BillingMetricsDay, OrganizationSubscription
+from indabom.stripe import prime_price_cache
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the daily billing metrics rollup shown on the admin dashboard from the subscriptions, in one "
+            "pass. Run it once after deploying the rollup, or whenever it has drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-prices', action='store_true',
+                            help='Do not look up prices in Stripe for subscriptions without a stored amount; they '
+                                 'count towards MRR as 0')
+
+    def handle(self, *args, **options):
+        if not options.get('skip_prices'):
+            self._fill_missing_amounts()
+
+        days = billing_metrics.rebuild()
+        latest = BillingMetricsDay.objects.order_by('-day').first()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {days} days of billing metrics: {latest.active} active subscriptions, {latest.seats} seats, "
+            f"MRR {latest.mrr / 100:.2f}."))
+
+    def _fill_missing_amounts(self):
+        """Stores the monthly amount on subscriptions from before it was recorded, one Stripe call per price."""
+        missing = OrganizationSubscription.objects.filter(monthly_unit_amount__isnull=True)
+        for price_id in missing.values_list('stripe_price_id', flat=True).distinct().order_by():
+            try:
+                amount = billing_metrics.monthly_unit_amount(prime_price_cache(price_id))
+            except stripe.StripeError as e:
+                self.stderr.write(self.style.WARNING(f"Could not retrieve price {price_id}: {e}"))
+                continue
+            if amount is None:
+                self.stderr.write(self.style.WARNING(f"Price {price_id} is not a recurring price."))
+                continue
+            updated = billing_metrics.update_subscriptions(missing.filter(stripe_price_id=price_id),
+                                                           monthly_unit_amount=amount)
+            self.stdout.write(f"Price {price_id}: {amount / 100:.2f}/seat/month for {updated} subscriptions")
@@ -0,0 +1,200 @@
+import logging
+import signal
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from indabom import campaigns
+from indabom.campaigns import DEFAULT_SEND_CONCURRENCY, MAILGUN_MAX_BATCH_SIZE, TokenBucket
+from indabom.email_rendering import get_compiled
+from indabom.models import EmailTemplate
+
+logger = logging.getLogger(__name__)
+
+# Small batches spread a campaign through the day instead of landing on the ESP at once
+DEFAULT_SCHEDULER_BATCH_SIZE = 50
+DEFAULT_POLL_INTERVAL = 60
+
+
+def seconds_until_midnight() -> float:
+    now = timezone.localtime()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1.0, (midnight - now).total_seconds())
+
+
+class Command(BaseCommand):
+    help = ("Continuously send enabled, scheduled EmailTemplates, pacing batches evenly through the day so all "
+            "campaigns together stay under the daily cap.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_email', type=str, default=None,
+                            help='Override from email (defaults to settings.DEFAULT_FROM_EMAIL)')
+        parser.add_argument('--max-per-day', type=int, default=None,
+                            help='Maximum emails to send per day across all campaigns '
+                                 '(defaults to settings.MAILGUN_DAILY_LIMIT)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_SCHEDULER_BATCH_SIZE,
+                            help=f'Largest batch per ESP request (at most {MAILGUN_MAX_BATCH_SIZE})')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_SEND_CONCURRENCY,
+                            help='Batches in flight at once')
+        parser.add_argument('--burst', type=int, default=None,
+                            help='Sends allowed back to back before pacing kicks in (defaults to --batch-size)')
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help='Longest wait in seconds between checks for new campaigns, recipients and quota')
+        parser.add_argument('--resend-interrupted', action='store_true',
+                            help='On start, mark recipients of batches that never confirmed delivery as failed so '
+                                 'they are sent again. Only safe when no other sender is running.')
+        parser.add_argument('--until-idle', action='store_true',
+                            help='Exit once every scheduled campaign has no recipients left or the cap is reached')
+
+    def handle(self, *args, **options):
+        from_email = options.get('from_email') or getattr(settings, 'DEFAULT_FROM_EMAIL', None)
+        if not from_email:
+            raise CommandError('DEFAULT_FROM_EMAIL not set and no --from provided.')
+
+        self.max_per_day = options.get('max_per_day') or getattr(settings, 'MAILGUN_DAILY_LIMIT', 80)
+        self.batch_size = options.get('batch_size') or DEFAULT_SCHEDULER_BATCH_SIZE
+        if not 1 <= self.batch_size <= MAILGUN_MAX_BATCH_SIZE:
+            raise CommandError(f'--batch-size must be between 1 and {MAILGUN_MAX_BATCH_SIZE}.')
+        self.concurrency = options.get('concurrency') or DEFAULT_SEND_CONCURRENCY
+        if self.concurrency < 1:
+            raise CommandError('--concurrency must be at least 1.')
+        burst = options.get('burst') or self.batch_size
+        poll_interval = options.get('poll_interval') or DEFAULT_POLL_INTERVAL
+        until_idle = options.get('until_idle')
+        self.from_email = from_email
+
+        for template in EmailTemplate.objects.filter(enabled=True, scheduled=True):
+            if options.get('resend_interrupted'):
+                released = campaigns.release_unconfirmed(template)
+                if released:
+                    self.stdout.write(self.style.WARNING(
+                        f"{template.name}: released {released} recipients of interrupted batches."))
+            elif campaigns.unconfirmed_count(template):
+                self.stdout.write(self.style.WARNING(
+                    f"{template.name}: skipping {campaigns.unconfirmed_count(template)} recipients of batches that "
+                    f"never confirmed delivery."))
+
+        # The bucket starts full so a (re)start sends one burst, then refills at whatever rate spends the rest of
+        # today's quota by midnight. The quota is read back from the ledger each pass and every batch is reserved
+        # against it, so other senders slow this one down rather than push the day over the cap.
+        bucket = TokenBucket(rate=0.0, capacity=burst)
+        stop = threading.Event()
+        restore = self._handle_signals(stop)
+        self.run_id = uuid.uuid4().hex
+        self.batch_number = 0
+        self.sent_count = self.failed_count = 0
+        cursor = 0
+        self.stdout.write(f"Scheduler {self.run_id}: up to {self.max_per_day}/day, batches of up to "
+                          f"{self.batch_size}, {self.concurrency} at a time")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='indabom-campaign') as executor:
+                pending = {}
+                while not stop.is_set():
+                    remaining = campaigns.remaining_quota(self.max_per_day)
+                    bucket.set_rate(remaining / seconds_until_midnight())
+                    templates = list(EmailTemplate.objects.filter(enabled=True, scheduled=True).order_by('pk'))
+
+                    # Round-robin, starting one campaign further along each pass, so every campaign gets a share
+                    # of the tokens rather than the first draining them
+                    claimed = exhausted = 0
+                    throttled = False
+                    for offset in range(len(templates)):
+                        if len(pending) >= self.concurrency or remaining <= 0:
+                            break
+                        granted = bucket.take(min(self.batch_size, remaining))
+                        if not granted:
+                            throttled = True
+                            break
+                        template = templates[(cursor + offset) % len(templates)]
+                        recipients, rows = campaigns.select_recipients(template, granted)
+                        if not recipients:
+                            bucket.give_back(granted)
+                            exhausted += 1
+                            continue
+                        _day, reserved = campaigns.reserve_quota(self.max_per_day, len(recipients))
+                        bucket.give_back(granted - reserved)
+                        if not reserved:
+                            # Another sender spent the rest of today's quota
+                            remaining = 0
+                            break
+                        remaining -= reserved
+                        if self._submit(executor, pending, template, recipients[:reserved], rows):
+                            claimed += 1
+                    if templates:
+                        cursor = (cursor + 1) % len(templates)
+
+                    idle = not pending and not claimed and not throttled and (
+                        remaining <= 0 or exhausted == len(templates))
+                    if until_idle and idle:
+                        break
+
+                    # Go straight round again while there are free slots and tokens; otherwise sleep until a batch
+                    # finishes, the bucket refills or it is time to look for new campaigns
+                    timeout = poll_interval
+                    if claimed and not throttled and len(pending) < self.concurrency:
+                        timeout = 0
+                    elif throttled:
+                        timeout = min(timeout, bucket.seconds_until(min(self.batch_size, max(remaining, 1))))
+                    if pending:
+                        done, _not_done = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                        self._record(pending, done)
+                    elif timeout:
+                        stop.wait(timeout)
+
+                # Let batches already handed to the ESP finish so their recipients are not left unconfirmed
+                if pending:
+                    self.stdout.write(f"Waiting for {len(pending)} batches in flight...")
+                    self._record(pending, wait(pending).done)
+        finally:
+            restore()
+
+        if self.failed_count:
+            self.stderr.write(self.style.ERROR(f"Failed to send {self.failed_count} emails."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduler stopped: sent {self.sent_count} emails across {self.batch_number} batches."))
+
+    def _submit(self, executor, pending, template, recipients, rows) -> bool:
+        """Claims and hands a batch to the ESP; False when another sender had already claimed every recipient."""
+        batch, recipients = campaigns.claim_batch(template, self.run_id, self.batch_number + 1, recipients)
+        if batch is None:
+            return False
+        self.batch_number += 1
+        future = executor.submit(campaigns.deliver, get_compiled(template), self.from_email,
+                                 [rows[email] for email, _user_id in recipients])
+        pending[future] = (template, batch, recipients)
+        return True
+
+    def _record(self, pending, done):
+        for future in done:
+            template, batch, recipients = pending.pop(future)
+            batch = campaigns.record_batch(template, batch, recipients, *future.result())
+            self.sent_count += batch.sent_count
+            self.failed_count += batch.failed_count
+            line = (f"{template.name} batch {batch.number}: {batch.sent_count} sent, {batch.failed_count} failed "
+                    f"in {batch.duration_ms / 1000:.2f}s")
+            if batch.error:
+                self.stderr.write(self.style.ERROR(f"{line}: {batch.error}"))
+            else:
+                self.stdout.write(line)
+
+    def _handle_signals(self, stop: threading.Event):
+        """Stops the loop on SIGTERM/SIGINT; returns a callable restoring the previous handlers."""
+        if threading.current_thread() is not threading.main_thread():
+            return lambda: None
+
+        def request_stop(signum, _frame):
+            logger.info("Received signal %s, stopping after batches in flight", signum)
+            stop.set()
+
+        previous = {sig: signal.signal(sig, request_stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+        def restore():
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        return restore
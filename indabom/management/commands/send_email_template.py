@@ -1,12 +1,15 @@
-from typing import Iterable, Optional, List, Dict
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Optional
 
-from anymail.message import AnymailMessage
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
 
-from indabom.models import EmailTemplate, EmailSendLog
+from indabom import campaigns
+from indabom.campaigns import DEFAULT_SEND_CONCURRENCY, MAILGUN_MAX_BATCH_SIZE
+from indabom.email_rendering import get_compiled
+from indabom.models import EmailTemplate
 
 
 class Command(BaseCommand):
@@ -24,6 +27,13 @@ class Command(BaseCommand):
         parser.add_argument('--dry-run', action='store_true', help='Show what would be sent without sending')
         parser.add_argument('--only-users', type=str, default=None,
                             help='Optional comma-separated list of email addresses to target')
+        parser.add_argument('--batch-size', type=int, default=MAILGUN_MAX_BATCH_SIZE,
+                            help=f'Recipients per ESP request (at most {MAILGUN_MAX_BATCH_SIZE})')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_SEND_CONCURRENCY,
+                            help='Batches sent in parallel')
+        parser.add_argument('--resend-interrupted', action='store_true',
+                            help='Mark recipients of batches that never confirmed delivery as failed so they are '
+                                 'sent again')
 
     def handle(self, *args, **options):
         template = self._get_template(options)
@@ -37,13 +47,33 @@ class Command(BaseCommand):
         max_per_day = options.get('max_per_day') or getattr(settings, 'MAILGUN_DAILY_LIMIT', 80)
         dry_run = options.get('dry_run')
 
+        batch_size = options.get('batch_size') or MAILGUN_MAX_BATCH_SIZE
+        if not 1 <= batch_size <= MAILGUN_MAX_BATCH_SIZE:
+            raise CommandError(f'--batch-size must be between 1 and {MAILGUN_MAX_BATCH_SIZE}.')
+        concurrency = options.get('concurrency') or DEFAULT_SEND_CONCURRENCY
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1.')
+
+        # Recipients of a batch stay "sending" until the ESP answers. If a run stopped in between they may or may
+        # not have received the email, so they are skipped unless explicitly released.
+        if options.get('resend_interrupted') and not dry_run:
+            released = campaigns.release_unconfirmed(template)
+            if released:
+                self.stdout.write(self.style.WARNING(
+                    f"Released {released} recipients of interrupted batches to be sent again."))
+        else:
+            unconfirmed_count = campaigns.unconfirmed_count(template)
+            if unconfirmed_count:
+                self.stdout.write(self.style.WARNING(
+                    f"Skipping {unconfirmed_count} recipients of batches that never confirmed delivery "
+                    f"(an interrupted or still running send). Use --resend-interrupted to send to them again."))
+
         target_emails: Optional[Iterable[str]] = None
         if options.get('only_users'):
             target_emails = [e.strip() for e in options['only_users'].split(',') if e.strip()]
 
         # compute remaining quota for today
-        today = timezone.now().date()
-        sent_today = EmailSendLog.objects.filter(sent_at__date=today).count()
+        sent_today = campaigns.sent_today()
         remaining_today = max(0, max_per_day - sent_today)
 
         if remaining_today <= 0:
@@ -51,113 +81,83 @@ class Command(BaseCommand):
                 f"Daily send limit reached ({max_per_day}). Nothing to send."))
             return
 
-        User = get_user_model()
-        users_qs = User.objects.filter(is_active=True).exclude(email__isnull=True).exclude(email='')
-
-        if target_emails is not None:
-            users_qs = users_qs.filter(email__in=list(target_emails))
-
-        # Exclude users already sent this template
-        already_sent_emails = set(
-            EmailSendLog.objects.filter(template=template, status=EmailSendLog.STATUS_SENT)
-            .values_list('email', flat=True)
-        )
-        users_qs = users_qs.exclude(email__in=already_sent_emails)
-
-        to_send = list(users_qs[:remaining_today])
+        recipients, rows = campaigns.select_recipients(template, remaining_today, target_emails)
 
         self.stdout.write(
             f"Template: {template.name} | Subject: {template.subject} | From: {from_email}\n"
             f"Daily cap: {max_per_day} | Already today: {sent_today} | Remaining today: {remaining_today}\n"
-            f"Eligible recipients (after excluding already-sent): {len(to_send)}"
+            f"Eligible recipients (after excluding already-sent): {len(recipients)}\n"
+            f"Batches of up to {batch_size}, {concurrency} at a time"
         )
 
-        if not to_send:
+        if not recipients:
             self.stdout.write(self.style.WARNING("No recipients to send."))
             return
 
         if dry_run:
             self.stdout.write(self.style.SUCCESS("Dry run: no emails sent."))
-            for u in to_send:
-                self.stdout.write(f"Would send to: {u.email}")
+            for email, _user_id in recipients:
+                self.stdout.write(f"Would send to: {email}")
             return
 
-        # Use django-anymail batch sending with Mailgun recipient variables
-        # Convert any simple Django {{ user.* }} vars in subject/body to Mailgun %recipient.*% vars
-        subject_template = self._convert_django_vars_to_mailgun(template.subject)
-        html_template = self._convert_django_vars_to_mailgun(template.html_body)
-        text_template = self._html_to_text(html_template)
-
-        # Build recipient list and per-recipient merge data
-        recipient_emails: List[str] = [u.email for u in to_send]
-        merge_data: Dict[str, Dict[str, str]] = {}
-        for u in to_send:
-            merge_data[u.email] = {
-                "first_name": getattr(u, "first_name", "") or "",
-                "last_name": getattr(u, "last_name", "") or "",
-                "email": u.email or "",
-                "full_name": (f"{getattr(u, 'first_name', '')} {getattr(u, 'last_name', '')}" ).strip(),
-                "username": getattr(u, "username", "") or "",
-            }
-
-        sent_count = 0
-        try:
-            msg = AnymailMessage(
-                subject=subject_template,
-                body=text_template,
-                from_email=from_email,
-                to=recipient_emails,
-            )
-            msg.attach_alternative(html_template, "text/html")
-            msg.merge_data = merge_data  # per-recipient variables
-
-            msg.send(fail_silently=False)
-
-            # anymail_status provides per-recipient details
-            status = getattr(msg, "anymail_status", None)
-            recipient_statuses = {}
-            if status is not None:
-                # dict: email -> {status, message_id, ...}
-                recipient_statuses = status.recipients
-
-            for u in to_send:
-                email = u.email
-                st = recipient_statuses.get(email)
-                if st is None or st.status == "queued" or st.status == "sent":
-                    EmailSendLog.objects.create(
-                        template=template,
-                        user=u,
-                        email=email,
-                        status=EmailSendLog.STATUS_SENT,
-                        message_id=getattr(st, "message_id", None) if st else None,
-                    )
-                    sent_count += 1
-                else:
-                    EmailSendLog.objects.create(
-                        template=template,
-                        user=u,
-                        email=email,
-                        status=EmailSendLog.STATUS_FAILED,
-                        error=f"ESP status: {st.status}",
-                        message_id=getattr(st, "message_id", None),
-                    )
-        except Exception as e:  # noqa: BLE001
-            # Log a failure for each intended recipient
-            for u in to_send:
-                EmailSendLog.objects.create(
-                    template=template,
-                    user=u,
-                    email=u.email,
-                    status=EmailSendLog.STATUS_FAILED,
-                    error=str(e),
-                )
-            self.stderr.write(self.style.ERROR(f"Batch send failed: {e}"))
-
-        # Update last_sent_at on the template
-        template.last_sent_at = timezone.now()
-        template.save(update_fields=["last_sent_at"])
-
-        self.stdout.write(self.style.SUCCESS(f"Sent {sent_count} emails."))
+        # Templates of plain {{ variables }} go out as Mailgun batch sends with recipient variables; anything using
+        # tags is rendered per recipient
+        compiled = get_compiled(template)
+
+        chunks = [recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)]
+        run_id = uuid.uuid4().hex
+        sent_count = failed_count = claimed = 0
+        started = time.perf_counter()
+
+        # Batches are claimed (checkpointed) and recorded on this thread; workers only talk to the ESP. At most
+        # `concurrency` batches are in flight, so an interruption leaves at most that many unconfirmed.
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='indabom-email') as executor:
+            pending = {}
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                while next_chunk < len(chunks) and len(pending) < concurrency:
+                    chunk = chunks[next_chunk]
+                    next_chunk += 1
+                    # Reserve each batch against the shared ledger; another sender may have spent the quota since
+                    # the recipients were selected
+                    _day, granted = campaigns.reserve_quota(max_per_day, len(chunk))
+                    if granted < len(chunk):
+                        self.stdout.write(self.style.WARNING(
+                            f"Daily send limit reached ({max_per_day}); skipping "
+                            f"{len(recipients) - claimed - granted} recipients."))
+                        del chunks[next_chunk:]
+                        if not granted:
+                            chunks.pop()
+                            break
+                        chunk = chunks[-1] = chunk[:granted]
+                    claimed += len(chunk)
+                    batch, chunk = campaigns.claim_batch(template, run_id, next_chunk, chunk)
+                    if batch is None:
+                        continue
+                    future = executor.submit(
+                        campaigns.deliver, compiled, from_email, [rows[email] for email, _user_id in chunk])
+                    pending[future] = (batch, chunk)
+
+                done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, chunk = pending.pop(future)
+                    batch = campaigns.record_batch(template, batch, chunk, *future.result())
+                    sent_count += batch.sent_count
+                    failed_count += batch.failed_count
+                    rate = batch.recipient_count / (batch.duration_ms / 1000) if batch.duration_ms else 0
+                    line = (f"Batch {batch.number}/{len(chunks)}: {batch.sent_count} sent, {batch.failed_count} "
+                            f"failed in {batch.duration_ms / 1000:.2f}s ({rate:.0f}/s)")
+                    if batch.error:
+                        self.stderr.write(self.style.ERROR(f"{line}: {batch.error}"))
+                    else:
+                        self.stdout.write(line)
+
+        elapsed = time.perf_counter() - started
+        rate = (sent_count + failed_count) / elapsed if elapsed else 0
+        if failed_count:
+            self.stderr.write(self.style.ERROR(f"Failed to send {failed_count} emails."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent_count} emails in {elapsed:.2f}s ({rate:.0f}/s) across {len(chunks)} batches."))
 
     def _get_template(self, options) -> EmailTemplate:
         template_id = options.get('template_id')
@@ -172,33 +172,3 @@ class Command(BaseCommand):
                 return EmailTemplate.objects.get(name=template_name)
             except EmailTemplate.DoesNotExist as e:
                 raise CommandError(f"EmailTemplate with name='{template_name}' does not exist") from e
-
-    @staticmethod
-    def _html_to_text(html: str) -> str:
-        # Minimal fallback: remove tags; KISS for announcements
-        import re
-        text = re.sub(r'<\s*br\s*/?>', '\n', html, flags=re.I)
-        text = re.sub(r'<[^>]+>', '', text)
-        return re.sub(r'\n\n+', '\n\n', text).strip()
-
-    @staticmethod
-    def _convert_django_vars_to_mailgun(s: str) -> str:
-        """
-        Convert common Django template variables like {{ user.first_name }} to
-        Mailgun recipient variable syntax %recipient.first_name% for use with
-        Anymail merge_data. Keeps KISS: only a few common fields.
-        """
-        import re
-
-        replacements = {
-            r"\{\{\s*user\.first_name\s*\}\}": "%recipient.first_name%",
-            r"\{\{\s*user\.last_name\s*\}\}": "%recipient.last_name%",
-            r"\{\{\s*user\.email\s*\}\}": "%recipient.email%",
-            r"\{\{\s*user\.username\s*\}\}": "%recipient.username%",
-            r"\{\{\s*user\.get_full_name\s*\}\}": "%recipient.full_name%",
-        }
-
-        out = s
-        for pattern, repl in replacements.items():
-            out = re.sub(pattern, repl, out)
-        return out
@@ -1,9 +1,15 @@
+import logging
 from urllib.parse import quote
 
 from django.conf import settings
 from django.shortcuts import redirect
 from django.urls import resolve
 
+from indabom import profiling
+from indabom.query_budget import QueryCounter, budget_for
+
+logger = logging.getLogger(__name__)
+
 
 class TermsAcceptanceMiddleware:
     """Require authenticated users to accept updated Terms/Privacy before continuing.
@@ -23,7 +29,8 @@ class TermsAcceptanceMiddleware:
         'robots-file', 'sitemap',
         'password_reset', 'password_reset_done', 'password_reset_confirm', 'password_reset_complete',
         'update-terms',
-        'stripe-webhook',
+        'stripe-webhook', 'mailgun-tracking-webhook',
+        'readiness',
     }
 
     EXEMPT_PATHS = {
@@ -33,6 +40,8 @@ class TermsAcceptanceMiddleware:
         '/robots.txt',
         '/sitemap.xml',
         '/webhooks/stripe/',
+        '/webhooks/mailgun/tracking/',
+        '/readyz/',
     }
 
     def __init__(self, get_response):
@@ -77,3 +86,77 @@ class TermsAcceptanceMiddleware:
             return redirect(f"/update-terms/?next={quote(next_param)}")
 
         return self.get_response(request)
+
+
+class RequestProfilerMiddleware:
+    """Profile a single request for a staff user who sends a signed profiling token.
+
+    The token comes from the admin's Request profiles page and is sent in the ``X-Indabom-Profile`` header or the
+    ``_profile`` query parameter. The report is stored as a RequestProfile and its id returned in the
+    ``X-Indabom-Profile-Id`` response header. Requests without a token only pay for a META lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = profiling.requested_token(request)
+        if token is None:
+            return self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if not user or not user.is_staff or not profiling.token_is_valid(token, user):
+            return self.get_response(request)
+
+        with profiling.RequestProfiler() as profiler:
+            response = self.get_response(request)
+            # Render lazy responses inside the profile, template rendering is usually part of what is slow
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+
+        try:
+            profile = self._save(request, response, profiler)
+            response['X-Indabom-Profile-Id'] = str(profile.pk)
+        except Exception as e:  # noqa: BLE001
+            logger.error("Could not store request profile for %s: %s", request.path, e, exc_info=True)
+        return response
+
+    @staticmethod
+    def _save(request, response, profiler):
+        from indabom.models import RequestProfile
+
+        return RequestProfile.objects.create(
+            user=request.user,
+            method=request.method,
+            path=request.get_full_path()[:2048],
+            status_code=response.status_code,
+            duration_ms=profiler.duration_ms,
+            query_count=len(profiler.queries),
+            query_ms=round(sum(query['ms'] for query in profiler.queries), 3),
+            cache_count=len(profiler.cache_calls),
+            http_count=len(profiler.http_calls),
+            http_ms=round(sum(call['ms'] for call in profiler.http_calls), 3),
+            report=profiler.report(),
+        )
+
+
+class QueryBudgetMiddleware:
+    """Log a warning when a view runs more SQL queries than its budget in indabom.query_budget.
+
+    Enabled with QUERY_BUDGET_LOGGING. Views outside indabom.urls are held to DEFAULT_QUERY_BUDGET.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        budget = budget_for(view_name, request.method)
+        if counter.count > budget:
+            logger.warning("%s %s (%s) ran %d queries, over its query budget of %d",
+                           request.method, request.path, view_name, counter.count, budget)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0008_emailsendbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='scheduled',
+            field=models.BooleanField(default=False, help_text='Send gradually through the day with the run_email_campaigns scheduler.'),
+        ),
+    ]
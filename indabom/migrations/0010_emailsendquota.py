@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0009_emailtemplate_scheduled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailSendQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('used', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0011_email_delivery_tracking'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailsendlog',
+            index=models.Index(fields=['template', 'sent_at'], name='indabom_ema_templat_f89306_idx'),
+        ),
+    ]
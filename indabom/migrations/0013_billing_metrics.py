@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0012_emailsendlog_template_sent_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingMetricsDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('mrr', models.BigIntegerField(default=0)),
+                ('seats', models.IntegerField(default=0)),
+                ('new_subscriptions', models.IntegerField(default=0)),
+                ('churned_subscriptions', models.IntegerField(default=0)),
+                ('active', models.IntegerField(default=0)),
+                ('trialing', models.IntegerField(default=0)),
+                ('past_due', models.IntegerField(default=0)),
+                ('unpaid', models.IntegerField(default=0)),
+                ('paused', models.IntegerField(default=0)),
+                ('incomplete', models.IntegerField(default=0)),
+                ('incomplete_expired', models.IntegerField(default=0)),
+                ('canceled', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='organizationsubscription',
+            name='monthly_unit_amount',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+FULL_TEXT_INDEX = 'indabom_emailtemplate_search'
+
+
+def create_full_text_index(apps, schema_editor):
+    # Django has no portable FULLTEXT index; only MySQL, which runs in production, gets one
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {FULL_TEXT_INDEX} ON indabom_emailtemplate (name, subject)")
+
+
+def drop_full_text_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(f"DROP INDEX {FULL_TEXT_INDEX} ON indabom_emailtemplate")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0013_billing_metrics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailsendlog',
+            index=models.Index(fields=['email'], name='indabom_ema_email_6f67f5_idx'),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
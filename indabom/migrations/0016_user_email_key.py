@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower, NullIf
+
+# Frozen copies of indabom.auth_backends.EMAIL_KEY and EMAIL_KEY_INDEX as of this migration
+EMAIL_KEY = NullIf(Lower('email'), models.Value(''))
+EMAIL_KEY_INDEX = 'indabom_user_email_key'
+
+
+def _constraint():
+    return models.UniqueConstraint(EMAIL_KEY, name=EMAIL_KEY_INDEX)
+
+
+def create_email_key_index(apps, schema_editor):
+    # auth_user belongs to django.contrib.auth, so the index is created here rather than declared on the model.
+    # MySQL needs 8.0.13 for functional key parts; older servers keep the unindexed lookups.
+    if not schema_editor.connection.features.supports_expression_indexes:
+        return
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    duplicates = User.objects.annotate(email_key=EMAIL_KEY).filter(email_key__isnull=False).values(
+        'email_key').annotate(count=models.Count('pk')).filter(count__gt=1)
+    if duplicates.exists():
+        raise RuntimeError(
+            f"{duplicates.count()} email addresses belong to more than one user (ignoring case). Merge or change "
+            f"them, then migrate again.")
+    schema_editor.add_constraint(User, _constraint())
+
+
+def drop_email_key_index(apps, schema_editor):
+    if schema_editor.connection.features.supports_expression_indexes:
+        schema_editor.remove_constraint(apps.get_model(settings.AUTH_USER_MODEL), _constraint())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indabom', '0015_account_deletion_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_key_index, drop_email_key_index),
+    ]
@@ -40,6 +40,7 @@ class OrganizationSubscription(models.Model):
     current_period_start = models.DateTimeField()
     current_period_end = models.DateTimeField()
     started_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    monthly_unit_amount = models.PositiveIntegerField(null=True, blank=True)  # Cents per seat per month, for MRR
 
     def __str__(self):
         return f"{self.organization_meta.organization.name} - {self.status}"
@@ -62,6 +63,8 @@ class EmailTemplate(models.Model):
     subject = models.CharField(max_length=255)
     html_body = models.TextField(help_text="HTML content. You can use Django template variables like {{ user.first_name }}.")
     enabled = models.BooleanField(default=True)
+    scheduled = models.BooleanField(default=False,
+                                    help_text="Send gradually through the day with the run_email_campaigns scheduler.")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     last_sent_at = models.DateTimeField(null=True, blank=True)
@@ -70,33 +73,143 @@ class EmailTemplate(models.Model):
         return self.name
 
 
+class EmailSendBatch(models.Model):
+    """One ESP batch of a campaign run; its recipients are logged as sending until the ESP answers."""
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    template = models.ForeignKey(EmailTemplate, on_delete=models.CASCADE, related_name='send_batches')
+    run_id = models.CharField(max_length=32, db_index=True)
+    number = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_SENDING)
+    recipient_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.template.name} run {self.run_id} batch {self.number} - {self.status}"
+
+
 class EmailSendLog(models.Model):
     """Log of email sends per user and template for idempotency and rate limiting."""
+    STATUS_SENDING = 'sending'
     STATUS_SENT = 'sent'
     STATUS_FAILED = 'failed'
     STATUS_CHOICES = (
+        (STATUS_SENDING, 'Sending'),
         (STATUS_SENT, 'Sent'),
         (STATUS_FAILED, 'Failed'),
     )
 
+    DELIVERY_DELIVERED = 'delivered'
+    DELIVERY_DEFERRED = 'deferred'
+    DELIVERY_BOUNCED = 'bounced'
+    DELIVERY_REJECTED = 'rejected'
+    DELIVERY_COMPLAINED = 'complained'
+    DELIVERY_UNSUBSCRIBED = 'unsubscribed'
+    DELIVERY_STATUS_CHOICES = (
+        (DELIVERY_DELIVERED, 'Delivered'),
+        (DELIVERY_DEFERRED, 'Deferred'),
+        (DELIVERY_BOUNCED, 'Bounced'),
+        (DELIVERY_REJECTED, 'Rejected'),
+        (DELIVERY_COMPLAINED, 'Complained'),
+        (DELIVERY_UNSUBSCRIBED, 'Unsubscribed'),
+    )
+
     template = models.ForeignKey(EmailTemplate, on_delete=models.CASCADE, related_name='send_logs')
+    batch = models.ForeignKey(EmailSendBatch, null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='send_logs')
     user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
     email = models.EmailField()
     status = models.CharField(max_length=16, choices=STATUS_CHOICES)
     message_id = models.CharField(max_length=256, null=True, blank=True)
     error = models.TextField(null=True, blank=True)
     sent_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # What the ESP reported after accepting the message, from its tracking webhook
+    delivery_status = models.CharField(max_length=16, choices=DELIVERY_STATUS_CHOICES, null=True, blank=True)
+    delivery_updated_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=["template", "email"]),
+            models.Index(fields=["template", "sent_at"]),
             models.Index(fields=["sent_at"]),
+            models.Index(fields=["message_id"]),
+            # Admin search looks addresses up across templates, which the (template, email) index cannot serve
+            models.Index(fields=["email"]),
         ]
 
     def __str__(self):
         return f"{self.email} - {self.template.name} - {self.status}"
 
 
+class EmailSuppression(models.Model):
+    """An address campaigns no longer send to, after it hard-bounced or its owner reported spam."""
+    REASON_BOUNCED = 'bounced'
+    REASON_COMPLAINED = 'complained'
+    REASON_CHOICES = (
+        (REASON_BOUNCED, 'Bounced'),
+        (REASON_COMPLAINED, 'Complained'),
+    )
+
+    email = models.EmailField(unique=True)
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.email} ({self.reason})"
+
+
+class EmailSendQuota(models.Model):
+    """Emails reserved against the daily send cap; senders lock and increment today's row before each batch."""
+    day = models.DateField(unique=True)
+    used = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.used}"
+
+
+class BillingMetricsDay(models.Model):
+    """
+    Billing rollup for one day: a snapshot of MRR, seats and subscriptions by status as of the end of the day, plus
+    the subscriptions that became active or stopped being active that day. Kept up to date by
+    indabom.billing_metrics; days without changes have no row and carry the previous snapshot forward.
+    """
+    # Stripe subscription statuses, each counted in the field of the same name
+    STATUSES = ('active', 'trialing', 'past_due', 'unpaid', 'paused', 'incomplete', 'incomplete_expired', 'canceled')
+
+    day = models.DateField(unique=True)
+    mrr = models.BigIntegerField(default=0)  # Cents, over active subscriptions
+    seats = models.IntegerField(default=0)
+    new_subscriptions = models.IntegerField(default=0)
+    churned_subscriptions = models.IntegerField(default=0)
+    active = models.IntegerField(default=0)
+    trialing = models.IntegerField(default=0)
+    past_due = models.IntegerField(default=0)
+    unpaid = models.IntegerField(default=0)
+    paused = models.IntegerField(default=0)
+    incomplete = models.IntegerField(default=0)
+    incomplete_expired = models.IntegerField(default=0)
+    canceled = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.active} active, MRR {self.mrr / 100:.2f}"
+
+    @property
+    def by_status(self):
+        return [(status, getattr(self, status)) for status in self.STATUSES]
+
+
 class IndabomUserMeta(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, db_index=True, on_delete=models.CASCADE,
                                 related_name='indabom_meta')
@@ -104,3 +217,62 @@ class IndabomUserMeta(models.Model):
 
     def __str__(self):
         return f"Settings for {self.user.username}"
+
+
+class RequestProfile(models.Model):
+    """A profile of one request captured on demand by RequestProfilerMiddleware."""
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    method = models.CharField(max_length=8)
+    path = models.CharField(max_length=2048)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField(default=0)
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    cache_count = models.PositiveIntegerField(default=0)
+    http_count = models.PositiveIntegerField(default=0)
+    http_ms = models.FloatField(default=0)
+    report = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class AccountDeletionJob(models.Model):
+    """An account queued for deletion; the process_account_deletions worker removes its rows in batches."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    # Both are cleared as the worker deletes them, so what is left to delete is what they still point at
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='deletion_jobs')
+    organization = models.ForeignKey(Organization, null=True, blank=True, on_delete=models.SET_NULL,
+                                     related_name='deletion_jobs')
+    username = models.CharField(max_length=150)
+    email = models.EmailField(blank=True)
+    organization_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    rows_deleted = models.PositiveIntegerField(default=0)
+    progress = models.JSONField(default=dict, blank=True)  # Rows deleted so far per model label
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"Delete {self.username} - {self.status}"
@@ -0,0 +1,60 @@
+from typing import Optional
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+# Below this many rows an exact COUNT(*) is cheap enough and the estimate too coarse to be worth showing
+ESTIMATE_MIN_ROWS = 10000
+# Filtered changelists count at most this many rows; pages past it are not offered
+FILTERED_COUNT_LIMIT = 10000
+
+
+def estimated_row_count(model, using: str = 'default') -> Optional[int]:
+    """The database's own row estimate for ``model``'s table, read from statistics rather than a table scan."""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = ("SELECT TABLE_ROWS FROM information_schema.TABLES "
+               "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s")
+    elif connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+    elif connection.vendor == 'sqlite':
+        # Only present once ANALYZE has run; every stat row for a table starts with its row count
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    try:
+        estimate = int(str(row[0]).split()[0])
+    except ValueError:
+        return None
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for tables that grow without bound. An unfiltered list takes its total from table statistics instead of
+    COUNT(*), and a filtered one counts no further than FILTERED_COUNT_LIMIT, so the changelist costs the same at any
+    table size. Small tables, or backends without statistics, are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None:
+            return super().count
+        if not query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_MIN_ROWS:
+                return estimate
+            return super().count
+        return queryset[:FILTERED_COUNT_LIMIT].count()
@@ -0,0 +1,189 @@
+import cProfile
+import http.client
+import io
+import pstats
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import connections
+
+TOKEN_SALT = 'indabom.profiling'
+TOKEN_MAX_AGE = 60 * 60 * 8
+HEADER = 'HTTP_X_INDABOM_PROFILE'
+QUERY_PARAM = '_profile'
+
+CACHE_METHODS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'get_or_set', 'incr', 'decr',
+                 'touch', 'has_key')
+PROFILE_TOP_FUNCTIONS = 60
+ORIGIN_DEPTH = 4
+
+_local = threading.local()
+_http_patch_lock = threading.Lock()
+_http_patched = False
+
+
+def make_token(user) -> str:
+    """Signed token that turns on profiling for ``user``'s requests until it expires."""
+    return signing.dumps({'u': user.pk}, salt=TOKEN_SALT)
+
+
+def token_is_valid(token: str, user) -> bool:
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return data.get('u') == user.pk
+
+
+def requested_token(request) -> Optional[str]:
+    """Returns the profiling token sent with the request, checking only raw META so untriggered requests stay cheap."""
+    token = request.META.get(HEADER)
+    if token:
+        return token
+    if QUERY_PARAM + '=' in request.META.get('QUERY_STRING', ''):
+        return request.GET.get(QUERY_PARAM)
+    return None
+
+
+def _origin() -> List[str]:
+    project_frames = [
+        f"{frame.filename}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()[:-2]
+        if ('/indabom/' in frame.filename or '/bom/' in frame.filename) and not frame.filename.endswith('profiling.py')
+    ]
+    return project_frames[-ORIGIN_DEPTH:]
+
+
+def _patch_http_client():
+    """Wraps http.client once so outbound calls are recorded while a profile is active on the calling thread.
+
+    Requests, urllib3 (Stripe) and urllib (reCAPTCHA) all go through ``putrequest`` and ``getresponse``.
+    """
+    global _http_patched
+    with _http_patch_lock:
+        if _http_patched:
+            return
+        original_putrequest = http.client.HTTPConnection.putrequest
+        original_getresponse = http.client.HTTPConnection.getresponse
+
+        def putrequest(conn, method, url, *args, **kwargs):
+            if getattr(_local, 'profiler', None) is not None:
+                conn._indabom_profile_call = (method, f"{conn.host}{url}", time.perf_counter(), _origin())
+            return original_putrequest(conn, method, url, *args, **kwargs)
+
+        def getresponse(conn, *args, **kwargs):
+            call = getattr(conn, '_indabom_profile_call', None)
+            response = original_getresponse(conn, *args, **kwargs)
+            profiler = getattr(_local, 'profiler', None)
+            if call is not None and profiler is not None:
+                conn._indabom_profile_call = None
+                method, url, started, origin = call
+                profiler.http_calls.append({
+                    'method': method,
+                    'url': url,
+                    'status': response.status,
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                    'origin': origin,
+                })
+            return response
+
+        http.client.HTTPConnection.putrequest = putrequest
+        http.client.HTTPConnection.getresponse = getresponse
+        _http_patched = True
+
+
+class RequestProfiler:
+    """Collects a cProfile profile, SQL queries, cache calls and outbound HTTP calls for one request."""
+
+    def __init__(self):
+        self.queries: List[Dict] = []
+        self.cache_calls: List[Dict] = []
+        self.http_calls: List[Dict] = []
+        self.profile: Optional[cProfile.Profile] = cProfile.Profile()
+        self.duration_ms = 0.0
+        self._stack = ExitStack()
+
+    def _sql_wrapper(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append({
+                    'alias': alias,
+                    'sql': sql,
+                    'many': many,
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                    'origin': _origin(),
+                })
+
+        return wrapper
+
+    def _wrap_cache(self, alias):
+        # Cache backends are per thread, so instance attributes only affect this request
+        backend = caches[alias]
+        for name in CACHE_METHODS:
+            method = getattr(backend, name, None)
+            if method is None:
+                continue
+
+            def recorded(*args, _method=method, _name=name, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    self.cache_calls.append({
+                        'alias': alias,
+                        'call': _name,
+                        'key': str(args[0])[:200] if args else None,
+                        'ms': round((time.perf_counter() - started) * 1000, 3),
+                        'origin': _origin(),
+                    })
+
+            setattr(backend, name, recorded)
+            self._stack.callback(delattr, backend, name)
+
+    def __enter__(self):
+        _patch_http_client()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._sql_wrapper(connection.alias)))
+        for alias in settings.CACHES:
+            self._wrap_cache(alias)
+        _local.profiler = self
+        self._started = time.perf_counter()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Only one profiler can be active per process; still collect queries, cache and HTTP calls
+            self.profile = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+        _local.profiler = None
+        self._stack.close()
+        return False
+
+    def profile_text(self) -> str:
+        if self.profile is None:
+            return 'Skipped: another profile was running in this process.'
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+        return out.getvalue()
+
+    def report(self) -> Dict:
+        return {
+            'queries': self.queries,
+            'cache_calls': self.cache_calls,
+            'http_calls': self.http_calls,
+            'profile': self.profile_text(),
+        }
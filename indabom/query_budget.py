@@ -0,0 +1,127 @@
+import functools
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Maximum queries per request for each (URL name in indabom.urls, method), on the paths exercised by the test suite.
+# Form views are budgeted on their successful POST, which does more than rendering the form or rejecting it; webhooks
+# on a correctly signed event. Authenticated pages include the session, user, bom profile and terms-acceptance lookups.
+URL_QUERY_BUDGETS: Dict[Tuple[str, str], int] = {
+    ('index', 'GET'): 0,
+    ('signup', 'GET'): 0,
+    ('signup', 'POST'): 15,
+    ('login', 'GET'): 0,
+    ('login', 'POST'): 9,
+    ('logout', 'POST'): 4,
+    ('password_reset', 'GET'): 0,
+    ('password_reset', 'POST'): 1,
+    ('password_reset_done', 'GET'): 0,
+    ('password_reset_confirm', 'GET'): 1,
+    ('password_reset_confirm', 'POST'): 6,
+    ('password_reset_complete', 'GET'): 0,
+    ('about', 'GET'): 0,
+    ('product', 'GET'): 0,
+    ('privacy-policy', 'GET'): 0,
+    ('terms-and-conditions', 'GET'): 0,
+    ('update-terms', 'GET'): 6,
+    ('update-terms', 'POST'): 4,
+    ('install', 'GET'): 0,
+    ('pricing', 'GET'): 0,
+    ('sitemap', 'GET'): 0,
+    ('robots-file', 'GET'): 0,
+    ('checkout', 'GET'): 13,
+    ('checkout', 'POST'): 9,
+    ('checkout-success', 'GET'): 0,
+    ('checkout-cancelled', 'GET'): 0,
+    ('stripe-manage', 'GET'): 7,
+    ('stripe-webhook', 'POST'): 14,
+    ('mailgun-tracking-webhook', 'POST'): 4,
+    ('account-delete', 'GET'): 12,
+    ('account-delete', 'POST'): 14,
+    ('readiness', 'GET'): 0,
+    ('abuse-metrics', 'GET'): 3,
+}
+DEFAULT_QUERY_BUDGET = 25
+
+# Queries allowed per Stripe webhook handler invocation (see indabom.stripe), once the day's billing rollup exists
+WEBHOOK_QUERY_BUDGETS: Dict[str, int] = {
+    'subscription_completed_handler': 17,
+    'subscription_changed_handler': 14,
+    'subscription_issue_handler': 1,
+}
+
+
+def budget_for(url_name: Optional[str], method: str) -> int:
+    """The budget for a ``method`` request to ``url_name``; HEAD is held to GET's budget."""
+    method = 'GET' if method == 'HEAD' else method
+    return URL_QUERY_BUDGETS.get((url_name, method), DEFAULT_QUERY_BUDGET)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """Records the SQL run on the given database aliases while active."""
+
+    def __init__(self, using: Optional[Iterable[str]] = None):
+        self.using = list(using) if using is not None else None
+        self.queries: List[str] = []
+        self._wrappers = []
+
+    def _wrapper(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        aliases = self.using if self.using is not None else [conn.alias for conn in connections.all()]
+        for alias in aliases:
+            wrapper = connections[alias].execute_wrapper(self._wrapper)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(*exc_info)
+        return False
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+
+class query_budget(QueryCounter):
+    """Fails with QueryBudgetExceeded when the block or decorated function runs more than ``budget`` queries.
+
+        with query_budget(3):
+            client.get('/')
+
+        @query_budget(6)
+        def test_webhook(self): ...
+    """
+
+    def __init__(self, budget: int, using: Optional[Iterable[str]] = None, label: str = ''):
+        super().__init__(using)
+        self.budget = budget
+        self.label = label
+
+    def __exit__(self, exc_type, *exc_info):
+        super().__exit__(exc_type, *exc_info)
+        if exc_type is None and self.count > self.budget:
+            listing = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(self.queries, start=1))
+            raise QueryBudgetExceeded(
+                f"{self.label or 'Block'} ran {self.count} queries, budget is {self.budget}:\n{listing}")
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # A fresh instance per call so recorded queries do not accumulate across calls
+            with query_budget(self.budget, self.using, self.label or func.__qualname__):
+                return func(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,170 @@
+"""
+reCAPTCHA verification with a deadline.
+
+django_recaptcha opens a new urllib connection per signup and waits up to ten seconds on it, and an unreachable
+Google surfaces as a URLError from ``form.is_valid()``. Here every verification goes through one pooled requests
+session with RECAPTCHA_VERIFY_TIMEOUT, and a circuit breaker stops calling Google for RECAPTCHA_BREAKER_COOLDOWN
+seconds after RECAPTCHA_BREAKER_THRESHOLD failures in a row, so a slow Google costs a signup at most one timeout and,
+while the breaker is open, nothing. Whether an unverifiable signup is let through is RECAPTCHA_FAIL_OPEN.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import requests
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django_recaptcha.fields import ReCaptchaField
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Matches gunicorn's --threads, so concurrent signups each keep a warm connection
+POOL_SIZE = 8
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+
+
+@dataclass
+class Verification:
+    valid: bool
+    # True when Google could not be asked or did not answer, as opposed to rejecting the token
+    unavailable: bool = False
+    error_codes: List[str] = field(default_factory=list)
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` failures in a row, then lets one trial call through every ``cooldown`` seconds."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def succeeded(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("reCAPTCHA verification recovered; closing the circuit breaker")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.error("reCAPTCHA verification failed %s times in a row; skipping it for %ss",
+                                 self.failures, self.cooldown)
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+breaker = CircuitBreaker(settings.RECAPTCHA_BREAKER_THRESHOLD, settings.RECAPTCHA_BREAKER_COOLDOWN)
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # No retries: a retry would double the time a signup waits on a struggling Google
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def _record(outcome: str, seconds: Optional[float] = None):
+    with _stats_lock:
+        _stats[outcome] += 1
+        if seconds is not None:
+            _stats['calls'] += 1
+            _stats['total_ms'] += round(seconds * 1000)
+            _stats['max_ms'] = max(_stats['max_ms'], round(seconds * 1000))
+
+
+def metrics() -> Dict[str, object]:
+    """Verification outcomes and call latency since this process started, plus the breaker state."""
+    with _stats_lock:
+        stats = dict(_stats)
+    calls = stats.get('calls', 0)
+    stats['mean_ms'] = round(stats.get('total_ms', 0) / calls, 1) if calls else None
+    stats['breaker_open'] = breaker.is_open
+    return stats
+
+
+def verify(token: str, remote_ip: Optional[str] = None) -> Verification:
+    """Asks Google whether ``token`` is valid, within RECAPTCHA_VERIFY_TIMEOUT; never raises."""
+    if not breaker.allow():
+        _record('short_circuited')
+        return Verification(valid=False, unavailable=True, error_codes=['circuit-open'])
+
+    data = {'secret': settings.RECAPTCHA_PRIVATE_KEY, 'response': token}
+    if remote_ip:
+        data['remoteip'] = remote_ip
+    started = time.perf_counter()
+    try:
+        response = _get_session().post(settings.RECAPTCHA_VERIFY_URL, data=data,
+                                       timeout=settings.RECAPTCHA_VERIFY_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+    except requests.Timeout:
+        outcome, error = 'timeout', 'timeout'
+    except (requests.RequestException, ValueError) as e:
+        outcome, error = 'error', type(e).__name__
+    else:
+        breaker.succeeded()
+        valid = result.get('success') is True
+        _record('valid' if valid else 'invalid', time.perf_counter() - started)
+        return Verification(valid=valid, error_codes=result.get('error-codes') or [])
+
+    breaker.failed()
+    _record(outcome, time.perf_counter() - started)
+    logger.warning("reCAPTCHA verification unavailable (%s) after %.0fms", error,
+                   (time.perf_counter() - started) * 1000)
+    return Verification(valid=False, unavailable=True, error_codes=[error])
+
+
+class BoundedReCaptchaField(ReCaptchaField):
+    """ReCaptchaField verified through ``verify``; the form sets ``remote_ip`` from the request."""
+    remote_ip: Optional[str] = None
+
+    def validate(self, value):
+        forms.CharField.validate(self, value)
+        verification = verify(value, self.remote_ip)
+        if verification.valid:
+            return
+        if verification.unavailable:
+            if settings.RECAPTCHA_FAIL_OPEN:
+                _record('failed_open')
+                return
+            _record('failed_closed')
+            raise ValidationError(self.error_messages['captcha_error'], code='captcha_error')
+        logger.warning("reCAPTCHA validation failed due to: %s", verification.error_codes)
+        raise ValidationError(self.error_messages['captcha_invalid'], code='captcha_invalid')
@@ -14,6 +14,8 @@ from django.utils import timezone
 from google.cloud import secretmanager
 from sentry_sdk.integrations.django import DjangoIntegration
 
+from indabom.tracing import TRACES_DEFAULT_RATE, make_traces_sampler
+
 # --- Basic Setup and Environment Loading ---
 ## Basic Setup and Environment Loading
 
@@ -30,28 +32,28 @@ try:
     # This call is often used to establish the project context
     _, os.environ['GOOGLE_CLOUD_PROJECT'] = google.auth.default()
     project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    logger.info(f'Project ID: {project_id}')
+    logger.info('Project ID: %s', project_id)
 except (google.auth.exceptions.DefaultCredentialsError,
         google.auth.exceptions.RefreshError,
         google.auth.exceptions.TransportError,
         TypeError) as e:
-    logger.warning(f'Could not determine Google Cloud Project ID: {e}')
+    logger.warning('Could not determine Google Cloud Project ID: %s', e)
 
 # Load environment variables
 if os.path.isfile(env_file):
-    logger.info(f'Found local .env file: {env_file}')
+    logger.info('Found local .env file: %s', env_file)
     env.read_env(env_file)
 elif project_id:
     # Load secrets from Google Secret Manager
     client = secretmanager.SecretManagerServiceClient()
     settings_name = os.environ.get("SETTINGS_NAME", "django_settings")
-    logger.info(f'Fetching secrets from {settings_name} in project {project_id}')
+    logger.info('Fetching secrets from %s in project %s', settings_name, project_id)
     try:
         name = f"projects/{project_id}/secrets/{settings_name}/versions/latest"
         payload = client.access_secret_version(name=name).payload.data.decode("UTF-8")
         env.read_env(io.StringIO(payload))
     except Exception as e:
-        logger.error(f"Error accessing secret manager: {e}")
+        logger.error("Error accessing secret manager: %s", e)
         raise
 else:
     # Only raise if essential for running, otherwise default to minimal settings
@@ -80,12 +82,14 @@ CSRF_TRUSTED_ORIGINS = env.list("CSRF_TRUSTED_ORIGINS", default=[])
 
 # Append Cloud Run specific settings
 if CLOUDRUN_SERVICE_URL:
-    logger.info(f'Cloud Run Service URL detected: {CLOUDRUN_SERVICE_URL}')
+    logger.info('Cloud Run Service URL detected: %s', CLOUDRUN_SERVICE_URL)
     parsed_url = urlparse(CLOUDRUN_SERVICE_URL)
     ALLOWED_HOSTS.append(parsed_url.netloc)
     CSRF_TRUSTED_ORIGINS.append(CLOUDRUN_SERVICE_URL)
     SECURE_SSL_REDIRECT = True
     SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
+    # Cloud Run startup probes hit the container over plain HTTP
+    SECURE_REDIRECT_EXEMPT = [r'^readyz/$']
 
 # Normalize CSRF_TRUSTED_ORIGINS to include a scheme (required since Django 4+)
 _SCHEMES = ("http://", "https://")
@@ -136,12 +140,18 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'indabom.middleware.RequestProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
     'indabom.middleware.TermsAcceptanceMiddleware',
 ]
 
+# Log views that exceed their SQL query budget (indabom.query_budget)
+QUERY_BUDGET_LOGGING = env.bool("QUERY_BUDGET_LOGGING", False)
+if QUERY_BUDGET_LOGGING:
+    MIDDLEWARE.insert(1, 'indabom.middleware.QueryBudgetMiddleware')
+
 ROOT_URLCONF = 'indabom.urls'
 NEW_TERMS_EFFECTIVE = timezone.make_aware(datetime(2025, 12, 22, 0, 0, 0))
 
@@ -167,6 +177,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'indabom.wsgi.application'
+WARMUP_ON_START = env.bool("WARMUP_ON_START", not DEBUG)  # Prime resolver, templates, DB and caches at boot
 
 # --- Authentication and Authorization ---
 ## Authentication and Authorization
@@ -174,6 +185,7 @@ WSGI_APPLICATION = 'indabom.wsgi.application'
 AUTHENTICATION_BACKENDS = (
     'social_core.backends.google.GoogleOAuth2',
     'bom.auth_backends.OrganizationPermissionBackend',
+    'indabom.auth_backends.EmailBackend',  # Log in with an email address; plain usernames fall through
     'django.contrib.auth.backends.ModelBackend',
 )
 
@@ -205,8 +217,13 @@ SOCIAL_AUTH_LOGIN_ERROR_URL = '/'
 # --- Database and Cache ---
 ## Database and Cache
 
-if os.environ.get("GOOGLE_CLOUD_PROJECT") and not LOCALHOST and not env.bool("CI", False):
-    logger.info(f"Using Cloud-based database configuration.")
+if env.str("DB_URL", None):
+    # Explicit database, e.g. a scratch MySQL or SQLite file for benchmarks/http_load.py
+    logger.info("Using database from DB_URL.")
+    DATABASES = {'default': env.db_url("DB_URL")}
+    DATABASES['readonly'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+elif os.environ.get("GOOGLE_CLOUD_PROJECT") and not LOCALHOST and not env.bool("CI", False):
+    logger.info("Using Cloud-based database configuration.")
 
     DATABASES = {
         'default': {
@@ -215,6 +232,8 @@ if os.environ.get("GOOGLE_CLOUD_PROJECT") and not LOCALHOST and not env.bool("CI
             'NAME': env.str("DB_NAME"),
             'USER': env.str("DB_USER"),
             'PASSWORD': env.str("DB_PASSWORD"),
+            'CONN_MAX_AGE': env.int("DB_CONN_MAX_AGE", 60),
+            'CONN_HEALTH_CHECKS': True,
         },
         'readonly': {
             'ENGINE': 'django.db.backends.mysql',
@@ -222,6 +241,8 @@ if os.environ.get("GOOGLE_CLOUD_PROJECT") and not LOCALHOST and not env.bool("CI
             'NAME': env.str("DB_NAME"),
             'USER': env.str("DB_READONLY_USER"),
             'PASSWORD': env.str("DB_READONLY_PASSWORD"),
+            'CONN_MAX_AGE': env.int("DB_CONN_MAX_AGE", 60),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 else:
@@ -234,6 +255,7 @@ else:
         'readonly': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'TEST': {'MIRROR': 'default'},
         }
     }
 
@@ -254,6 +276,25 @@ else:
         }
     }
 
+# Attempt counters for indabom.throttling. The database cache can't increment atomically, and each instance runs a
+# single gunicorn worker, so a per-process cache sees all of an instance's traffic. Point THROTTLE_CACHE at a shared
+# memcached or redis cache to count across instances.
+CACHES['throttle'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'indabom-throttle',
+    'OPTIONS': {'MAX_ENTRIES': 20000},
+}
+THROTTLE_CACHE = 'throttle'
+THROTTLE_ENABLED = env.bool("THROTTLE_ENABLED", True)
+# Proxies that append to X-Forwarded-For in front of gunicorn (Cloud Run's front end adds one)
+THROTTLE_PROXY_COUNT = env.int("THROTTLE_PROXY_COUNT", 1 if CLOUDRUN_SERVICE_URL else 0)
+# scope -> {'ip' | 'account': (attempts, per seconds)}
+THROTTLE_RATES = {
+    'login': {'ip': (30, 300), 'account': (10, 900)},
+    'signup': {'ip': (10, 3600)},
+    'password_reset': {'ip': (10, 3600), 'account': (3, 3600)},
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # --- Static and Media Files (Storage) ---
@@ -276,7 +317,7 @@ STORAGES = {
 }
 
 if GS_BUCKET_NAME and not env.bool("CI", False):
-    logger.info(f"Using Google Cloud Storage bucket: {GS_BUCKET_NAME}")
+    logger.info("Using Google Cloud Storage bucket: %s", GS_BUCKET_NAME)
 
     GCS_STORAGE_BACKEND = "storages.backends.gcloud.GoogleCloudStorage"
 
@@ -302,6 +343,9 @@ MAILGUN_SENDER_DOMAIN = os.environ.get('MAILGUN_SENDER_DOMAIN', f'mg.{DOMAIN}')
 ANYMAIL = {
     "MAILGUN_API_KEY": MAILGUN_API_KEY,
     "MAILGUN_SENDER_DOMAIN": MAILGUN_SENDER_DOMAIN,
+    # Verifies tracking webhooks. Mailgun signs them with the HTTP webhook signing key under Sending > Webhooks, not
+    # the API key, so there is no fallback: a wrong key would only show up as every webhook failing its signature
+    "MAILGUN_WEBHOOK_SIGNING_KEY": env.str("MAILGUN_WEBHOOK_SIGNING_KEY"),
 }
 EMAIL_BACKEND = "anymail.backends.mailgun.EmailBackend"
 DEFAULT_FROM_EMAIL = "info@indabom.com"
@@ -317,6 +361,11 @@ USE_TZ = True
 # --- Logging ---
 ## Logging Configuration
 
+# Request threads only enqueue console records; a listener thread formats and writes them (see indabom.log).
+# JSON lines are picked up as structured entries by Cloud Logging; local runs keep the readable format.
+LOG_FORMATTER = env.str("LOG_FORMATTER", 'timestamp' if DEBUG or LOCALHOST else 'json')
+LOG_QUEUE_SIZE = env.int("LOG_QUEUE_SIZE", 10000)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -324,8 +373,13 @@ LOGGING = {
         'timestamp': {
             'format': "[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s"
         },
+        'json': {
+            '()': 'indabom.log.JsonFormatter',
+        },
     },
     'handlers': {
+        # Stays synchronous: the HTML report reads record.request (user, session) and has to be built on the
+        # request thread, not after the response has gone out
         'mail_admins': {
             'class': 'django.utils.log.AdminEmailHandler',
             'level': 'ERROR',
@@ -333,8 +387,10 @@ LOGGING = {
             'formatter': 'timestamp',
         },
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'timestamp',
+            '()': 'indabom.log.QueueingHandler',
+            'target_class': 'logging.StreamHandler',
+            'queue_size': LOG_QUEUE_SIZE,
+            'formatter': LOG_FORMATTER,
         },
     },
     'loggers': {
@@ -365,10 +421,18 @@ SENTRY_DSN = env.str("SENTRY_DSN")
 if not LOCALHOST and SENTRY_DSN and SENTRY_DSN != 'supersecretdsn':
     sentry_sdk.init(
         dsn=SENTRY_DSN,
-        integrations=[DjangoIntegration()],
+        # Middleware and signal spans add a span per middleware/receiver on every traced request
+        integrations=[DjangoIntegration(middleware_spans=False, signals_spans=False)],
         release=GITHUB_SHA,
         environment=ENVIRONMENT,
-        traces_sample_rate=1.0 if DEBUG else 0.5,
+        traces_sampler=make_traces_sampler(
+            default_rate=env.float("SENTRY_TRACES_DEFAULT_RATE", TRACES_DEFAULT_RATE),
+            scale=10.0 if DEBUG else 1.0,
+        ),
+        # Bound what a single worker buffers in memory; drop rather than queue when Sentry is slow
+        transport_queue_size=env.int("SENTRY_TRANSPORT_QUEUE_SIZE", 30),
+        enable_backpressure_handling=True,
+        max_breadcrumbs=50,
         debug=DEBUG,
     )
 
@@ -389,10 +453,18 @@ STRIPE_SECRET_KEY = env.str("STRIPE_SECRET_KEY")
 STRIPE_TEST_PUBLIC_KEY = env.str("STRIPE_TEST_PUBLIC_KEY", STRIPE_PUBLIC_KEY) # Fallback to live if test not provided
 STRIPE_TEST_SECRET_KEY = env.str("STRIPE_TEST_SECRET_KEY", STRIPE_SECRET_KEY) # Fallback to live if test not provided
 STRIPE_WEBHOOK_SECRET = env.str("STRIPE_WEBHOOK_SECRET")
+STRIPE_CHECKOUT_TIMEOUT = env.float("STRIPE_CHECKOUT_TIMEOUT", 3.0)  # Seconds before checkout renders without a price
+STRIPE_REQUEST_TIMEOUT = env.float("STRIPE_REQUEST_TIMEOUT", 10.0)  # Seconds any single Stripe API call may take
 
 # reCAPTCHA
 RECAPTCHA_PRIVATE_KEY = env.str("RECAPTCHA_PRIVATE_KEY")
 RECAPTCHA_PUBLIC_KEY = env.str("RECAPTCHA_PUBLIC_KEY")
+RECAPTCHA_VERIFY_URL = env.str("RECAPTCHA_VERIFY_URL", "https://www.google.com/recaptcha/api/siteverify")
+RECAPTCHA_VERIFY_TIMEOUT = env.float("RECAPTCHA_VERIFY_TIMEOUT", 2.0)  # Seconds, connecting and reading each
+# Whether signups go through unverified while Google can't be reached, rather than being turned away
+RECAPTCHA_FAIL_OPEN = env.bool("RECAPTCHA_FAIL_OPEN", False)
+RECAPTCHA_BREAKER_THRESHOLD = env.int("RECAPTCHA_BREAKER_THRESHOLD", 5)  # Failures in a row that open the breaker
+RECAPTCHA_BREAKER_COOLDOWN = env.float("RECAPTCHA_BREAKER_COOLDOWN", 30.0)  # Seconds before a trial call
 
 # Other API Keys
 OCTOPART_API_KEY = env.str("OCTOPART_API_KEY")
@@ -6,7 +6,7 @@ class StaticViewSitemap(sitemaps.Sitemap):
     changefreq = 'weekly'
 
     def items(self):
-        return ['index', 'about', 'install', 'learn-more', ]
+        return ['index', 'about', 'install', 'product', ]
 
     def location(self, item):
         return reverse(item)
\ No newline at end of file
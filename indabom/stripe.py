@@ -1,11 +1,13 @@
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import stripe
 from bom.constants import SUBSCRIPTION_TYPE_FREE, SUBSCRIPTION_TYPE_PRO
 from bom.models import Organization
 from django.contrib import messages
+from django.core.cache import cache
 from django.core.mail import send_mail, EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
@@ -14,12 +16,20 @@ from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from indabom.billing_metrics import monthly_unit_amount, track_subscription_change
 from indabom.models import CheckoutSessionRecord
-from indabom.settings import ROOT_DOMAIN, STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET
+from indabom.settings import ROOT_DOMAIN, STRIPE_REQUEST_TIMEOUT, STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET
 from .models import OrganizationMeta, OrganizationSubscription
 
 logger = logging.getLogger(__name__)
 stripe.api_key = STRIPE_SECRET_KEY
+# The library default is 80s; a hung call would hold a request or pool thread long after its page was served
+stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_REQUEST_TIMEOUT)
+
+# Shared pool for outbound Stripe reads that should overlap with local work on the request thread
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='indabom-stripe')
+
+PRICE_CACHE_TIMEOUT = 60 * 15  # Prices rarely change; keep the expanded price around for a few minutes
 
 
 def _to_dt(ts):
@@ -45,26 +55,32 @@ def get_active_subscription(organization: Organization) -> Optional[Organization
         return None
     except OrganizationSubscription.MultipleObjectsReturned as e:
         logger.error(
-            f"Multiple active subscriptions found for organization {organization.name} ({organization.id}). Please contact support@indabom.com.")
+            "Multiple active subscriptions found for organization %s (%s). Please contact support@indabom.com.",
+            organization.name, organization.id)
         raise e
 
 
 # --- Stripe helpers
-def get_price(price_id: str, request: HttpRequest) -> Optional[stripe.Price]:
+def fetch_price(price_id: str, expand: Optional[List[str]] = None) -> Tuple[Optional[stripe.Price], Optional[str]]:
+    """Returns the price, or None and a message to show the user.
+
+    It never touches the request, so it is safe on the Stripe pool; the caller adds the message.
+    """
+    params = {'expand': expand} if expand else {}
     try:
-        price = stripe.Price.retrieve(price_id)
+        # Checkout renders without the price past its deadline, so a retry would only keep a pool thread busy
+        price = stripe.Price.retrieve(price_id, max_network_retries=0, **params)
     except stripe.StripeError as e:
-        messages.error(request, f"Error fetching subscription details: {str(e)}. Please contact administrator.")
-        return None
+        return None, f"Error fetching subscription details: {str(e)}. Please contact administrator."
     except Exception:
-        messages.error(request, "A critical error occurred while connecting to the payment service.")
-        return None
-    return price
+        logger.exception("Failed to fetch Stripe price %s", price_id)
+        return None, "A critical error occurred while connecting to the payment service."
+    return price, None
 
 
 def get_product(product_id: str, request: HttpRequest) -> Optional[stripe.Product]:
     try:
-        product = stripe.Product.retrieve(product_id)
+        product = stripe.Product.retrieve(product_id, max_network_retries=0)
     except stripe.StripeError as e:
         messages.error(request, f"Error fetching subscription details: {str(e)}. Please contact administrator.")
         return None
@@ -74,6 +90,38 @@ def get_product(product_id: str, request: HttpRequest) -> Optional[stripe.Produc
     return product
 
 
+def _price_cache_key(price_id: str) -> str:
+    return f'indabom:stripe-price:{price_id}'
+
+
+def _get_and_cache_price(price_id: str) -> Tuple[Optional[stripe.Price], Optional[str]]:
+    price, error = fetch_price(price_id, ['product'])
+    if price is not None:
+        cache.set(_price_cache_key(price_id), price, PRICE_CACHE_TIMEOUT)
+    return price, error
+
+
+def prime_price_cache(price_id: str) -> stripe.Price:
+    """Fetches the price with its product expanded and stores it in the cache. Raises on Stripe errors."""
+    price = stripe.Price.retrieve(price_id, expand=['product'])
+    cache.set(_price_cache_key(price_id), price, PRICE_CACHE_TIMEOUT)
+    return price
+
+
+def get_price_async(price_id: str) -> Future:
+    """Fetches the price with its product expanded on the Stripe pool, so both arrive in one round trip.
+
+    The future resolves to fetch_price's (price, error message) pair; a cached price resolves immediately without
+    touching Stripe.
+    """
+    cached = cache.get(_price_cache_key(price_id))
+    if cached is not None:
+        future = Future()
+        future.set_result((cached, None))
+        return future
+    return _executor.submit(_get_and_cache_price, price_id)
+
+
 # --- Core Subscription Functions ---
 
 def create_org_customer_if_needed(organization: Organization) -> str:
@@ -87,7 +135,8 @@ def create_org_customer_if_needed(organization: Organization) -> str:
         except stripe.InvalidRequestError as e:
             if e.code == 'resource_missing':
                 logger.warning(
-                    f"Stale Stripe customer ID '{org_meta.stripe_customer_id}' found for Org {organization.id}. Re-creating.")
+                    "Stale Stripe customer ID '%s' found for Org %s. Re-creating.",
+                    org_meta.stripe_customer_id, organization.id)
                 org_meta.stripe_customer_id = None
             else:
                 raise e
@@ -137,7 +186,7 @@ def subscribe(request: HttpRequest, price_id: str, organization: Organization, q
         return checkout_session
     except Exception as e:
         messages.error(request, str(e))
-        logger.error(f"Stripe Checkout Error: {e}", exc_info=True)
+        logger.error("Stripe Checkout Error: %s", e, exc_info=True)
         return None
 
 
@@ -155,11 +204,58 @@ def manage_subscription(request: HttpRequest, organization: Organization) -> Htt
         )
         return redirect(session.url)
     except Exception as e:
-        logger.error(f"Error creating Stripe Billing Portal session: {e}", exc_info=True)
+        logger.error("Error creating Stripe Billing Portal session: %s", e, exc_info=True)
         messages.error(request, "Error creating stripe session, please try again or contact support.")
         return HttpResponseRedirect(reverse('bom:settings'))
 
 
+def subscription_fields(data) -> Optional[dict]:
+    """OrganizationSubscription fields from a Stripe subscription, or None when it carries no price."""
+    # Pull from root first; fall back to first subscription item when Stripe sends fields there
+    items = (data.get('items') or {}).get('data', [])
+    first_item = items[0] if items else {}
+
+    quantity = data.get('quantity') or first_item.get('quantity') or 1
+
+    # Price ID may be under item.price.id (new) or item.plan.id (legacy)
+    price = first_item.get('price') or first_item.get('plan') or {}
+    price_id = price.get('id')
+    if not price_id:
+        return None
+
+    # Current period times may be on root or on the subscription item in some events
+    current_period_start_timestamp = (
+            first_item.get('current_period_start')
+            or data.get('current_period_start')
+    )
+    current_period_end_timestamp = (
+            first_item.get('current_period_end')
+            or data.get('current_period_end')
+    )
+    # Ensure we don't store nulls in non-nullable DateTimeFields
+    if not current_period_start_timestamp:
+        current_period_start_datetime = datetime.now(timezone.utc)
+    else:
+        current_period_start_datetime = _to_dt(current_period_start_timestamp)
+    if not current_period_end_timestamp:
+        current_period_end_datetime = current_period_start_datetime
+    else:
+        current_period_end_datetime = _to_dt(current_period_end_timestamp)
+
+    fields = {
+        "stripe_price_id": price_id,
+        "status": data.get('status'),
+        "quantity": quantity,
+        "current_period_start": current_period_start_datetime,
+        "current_period_end": current_period_end_datetime,
+    }
+    # Payloads that carry no amount keep the one already stored
+    amount = monthly_unit_amount(price)
+    if amount is not None:
+        fields["monthly_unit_amount"] = amount
+    return fields
+
+
 # --- Webhook Handlers ---
 
 # Note: This requires the @csrf_exempt decorator in the URL configuration,
@@ -171,11 +267,11 @@ def subscription_completed_handler(event: stripe.Event):
     stripe_subscription_id = checkout_session.get('subscription')
     customer_id = checkout_session.get('customer')
 
-    logger.info(f"Checkout completed for Subscription ID: {stripe_subscription_id}. Pending PK: {pending_sub_pk}")
+    logger.info("Checkout completed for Subscription ID: %s. Pending PK: %s", stripe_subscription_id, pending_sub_pk)
 
     if not pending_sub_pk or not stripe_subscription_id:
         logger.error(
-            f"Missing IDs in completed session. Sub ID: {stripe_subscription_id}, Pending PK: {pending_sub_pk}")
+            "Missing IDs in completed session. Sub ID: %s, Pending PK: %s", stripe_subscription_id, pending_sub_pk)
         return
 
     try:
@@ -183,39 +279,43 @@ def subscription_completed_handler(event: stripe.Event):
     except CheckoutSessionRecord.DoesNotExist:
         checkout_session_id = checkout_session.get('id')
         logger.error(
-            f"PendingSubscription PK {pending_sub_pk} not found for linking. Trying to use Checkout Session ID instead: {checkout_session_id}")
+            "PendingSubscription PK %s not found for linking. Trying to use Checkout Session ID instead: %s",
+            pending_sub_pk, checkout_session_id)
         try:
             pending_record = CheckoutSessionRecord.objects.get(checkout_session_id=checkout_session_id)
         except CheckoutSessionRecord.DoesNotExist:
-            logger.error(f"PendingSubscription not found for Checkout Session ID either. Giving up.")
+            logger.error("PendingSubscription not found for Checkout Session ID either. Giving up.")
             return
 
     pending_record.stripe_subscription_id = stripe_subscription_id
     pending_record.save()
 
     try:
-        org_meta = OrganizationMeta.objects.get(stripe_customer_id=customer_id)
+        org_meta = OrganizationMeta.objects.select_related('organization__owner').get(stripe_customer_id=customer_id)
         stripe_sub = stripe.Subscription.retrieve(stripe_subscription_id)
         status = stripe_sub.get('status')
         quantity = stripe_sub.get('quantity', 1)
-        price_id = stripe_sub.items.data[0].price.id if stripe_sub.items.data else None
+        price = stripe_sub.items.data[0].price if stripe_sub.items.data else None
+        price_id = price.id if price else None
 
         if not price_id:
-            logger.error(f"Subscription {stripe_subscription_id} has no price data.")
+            logger.error("Subscription %s has no price data.", stripe_subscription_id)
             return
 
-        sub_obj, created = OrganizationSubscription.objects.update_or_create(
-            stripe_subscription_id=stripe_subscription_id,
-            defaults={
-                "organization_meta": org_meta,
-                "stripe_price_id": price_id,
-                "status": status,
-                "quantity": quantity,
-                "started_by": org_meta.organization.owner,
-                "current_period_start": _to_dt(stripe_sub.get("current_period_start")),
-                "current_period_end": _to_dt(stripe_sub.get("current_period_end")),
-            },
-        )
+        with track_subscription_change(stripe_subscription_id):
+            sub_obj, created = OrganizationSubscription.objects.update_or_create(
+                stripe_subscription_id=stripe_subscription_id,
+                defaults={
+                    "organization_meta": org_meta,
+                    "stripe_price_id": price_id,
+                    "monthly_unit_amount": monthly_unit_amount(price),
+                    "status": status,
+                    "quantity": quantity,
+                    "started_by": org_meta.organization.owner,
+                    "current_period_start": _to_dt(stripe_sub.get("current_period_start")),
+                    "current_period_end": _to_dt(stripe_sub.get("current_period_end")),
+                },
+            )
 
         pending_record.subscription = sub_obj
         pending_record.save()
@@ -226,8 +326,8 @@ def subscription_completed_handler(event: stripe.Event):
         organization.save()
 
         logger.info(
-            f"Subscription {stripe_subscription_id} created, active status applied to organization "
-            f"{organization.name}, and auto-renewal consent successfully linked."
+            "Subscription %s created, active status applied to organization %s, "
+            "and auto-renewal consent successfully linked.", stripe_subscription_id, organization.name
         )
 
         # Send a welcome email to the organization owner when a new subscription is created
@@ -265,94 +365,61 @@ def subscription_completed_handler(event: stripe.Event):
                             [owner_email],
                             fail_silently=True,
                         )
-                    logger.info(f"Welcome email sent to {owner_email} for organization {organization.name}.")
+                    logger.info("Welcome email sent to %s for organization %s.", owner_email, organization.name)
                 else:
                     logger.warning(
-                        f"Could not send welcome email: organization owner email missing for {organization.name} ({organization.id})."
+                        "Could not send welcome email: organization owner email missing for %s (%s).",
+                        organization.name, organization.id,
                     )
         except Exception as email_err:
             logger.error(
-                f"Failed to send welcome email for organization {organization.name}: {email_err}",
+                "Failed to send welcome email for organization %s: %s", organization.name, email_err,
                 exc_info=True,
             )
 
     except OrganizationMeta.DoesNotExist:
-        logger.error(f"OrganizationMeta not found for customer ID: {customer_id}.")
+        logger.error("OrganizationMeta not found for customer ID: %s.", customer_id)
     except Exception as e:
-        logger.error(f"Critical error in completion handler: {e}", exc_info=True)
+        logger.error("Critical error in completion handler: %s", e, exc_info=True)
 
 
 def subscription_changed_handler(event: stripe.Event):
     data = event.get('data', {}).get('object')
 
     try:
-        org_meta = OrganizationMeta.objects.get(stripe_customer_id=data.get('customer'))
+        org_meta = OrganizationMeta.objects.select_related('organization__owner').get(
+            stripe_customer_id=data.get('customer'))
         organization = org_meta.organization
     except OrganizationMeta.DoesNotExist:
-        logger.warning(f"Webhook received for unknown customer ID: {data.get('customer')}")
+        logger.warning("Webhook received for unknown customer ID: %s", data.get('customer'))
         return
 
     subscription_id = data.get('id')
-    status = data.get('status')
-
-    # Pull from root first; fall back to first subscription item when Stripe sends fields there
-    items = (data.get('items') or {}).get('data', [])
-    first_item = items[0] if items else {}
-
-    quantity = data.get('quantity') or first_item.get('quantity') or 1
-
-    # Price ID may be under item.price.id (new) or item.plan.id (legacy)
-    price_id = (
-            (first_item.get('price') or {}).get('id')
-            or (first_item.get('plan') or {}).get('id')
-    )
-    if not price_id:
+    fields = subscription_fields(data)
+    if fields is None:
         logger.error(
-            f"Subscription changed event for {organization.name} ({organization.id}) is missing price information.")
+            "Subscription changed event for %s (%s) is missing price information.", organization.name, organization.id)
         return
-
-    # Current period times may be on root or on the subscription item in some events
-    current_period_start_timestamp = (
-            first_item.get('current_period_start')
-            or data.get('current_period_start')
-    )
-    current_period_end_timestamp = (
-            first_item.get('current_period_end')
-            or data.get('current_period_end')
-    )
-    # Ensure we don't store nulls in non-nullable DateTimeFields
-    if not current_period_start_timestamp:
-        current_period_start_datetime = datetime.now(timezone.utc)
-    else:
-        current_period_start_datetime = _to_dt(current_period_start_timestamp)
-    if not current_period_end_timestamp:
-        current_period_end_datetime = current_period_start_datetime
-    else:
-        current_period_end_datetime = _to_dt(current_period_end_timestamp)
-
-    sub_obj, created = OrganizationSubscription.objects.update_or_create(
-        stripe_subscription_id=subscription_id,
-        defaults={
-            "organization_meta": org_meta,
-            "stripe_price_id": price_id,
-            "status": status,
-            "quantity": quantity,
-            "current_period_start": current_period_start_datetime,
-            "current_period_end": current_period_end_datetime,
-        },
-    )
-    if created and not sub_obj.started_by:
-        sub_obj.started_by = org_meta.organization.owner
-        sub_obj.save(update_fields=["started_by"])
+    status = fields['status']
+    quantity = fields['quantity']
+
+    defaults = {"organization_meta": org_meta, **fields}
+    with track_subscription_change(subscription_id):
+        OrganizationSubscription.objects.update_or_create(
+            stripe_subscription_id=subscription_id,
+            defaults=defaults,
+            # Only attribute the subscription on creation; written in the same INSERT
+            create_defaults={**defaults, "started_by": organization.owner},
+        )
 
     if status == 'active':
         organization.subscription = SUBSCRIPTION_TYPE_PRO
         organization.subscription_quantity = quantity
-        logger.info(f"Updated subscription for organization {organization.name} to PRO ({quantity} users)")
+        logger.info("Updated subscription for organization %s to PRO (%s users)", organization.name, quantity)
     else:
         organization.subscription = SUBSCRIPTION_TYPE_FREE
         organization.subscription_quantity = 1
-        logger.info(f"Subscription status for {organization.name} changed to {status}. Set to FREE.")
+        logger.info("Subscription status for %s changed to %s. Set to FREE.", organization.name, status)
 
     organization.save()
 
@@ -361,7 +428,8 @@ def subscription_issue_handler(event: stripe.Event):
     data = event.get('data', {}).get('object')
 
     try:
-        org_meta = OrganizationMeta.objects.get(stripe_customer_id=data.get('customer'))
+        org_meta = OrganizationMeta.objects.select_related('organization__owner').get(
+            stripe_customer_id=data.get('customer'))
         organization = org_meta.organization
 
         email = organization.owner.email  # Assuming the organization model has a primary contact email
@@ -373,9 +441,9 @@ def subscription_issue_handler(event: stripe.Event):
             fail_silently=False,
         )
     except OrganizationMeta.DoesNotExist:
-        logger.warning(f"Invoice failed for unknown customer ID: {data.get('customer')}")
+        logger.warning("Invoice failed for unknown customer ID: %s", data.get('customer'))
     except Exception as err:
-        logger.error(f'Error sending subscription issue email for event ({event.id}): {str(err)}', exc_info=True)
+        logger.error('Error sending subscription issue email for event (%s): %s', event.id, err, exc_info=True)
 
 
 def stripe_webhook(request: HttpRequest) -> HttpResponse:
@@ -388,7 +456,7 @@ def stripe_webhook(request: HttpRequest) -> HttpResponse:
         )
     except ValueError:
         return HttpResponse(status=400)
-    except stripe.error.SignatureVerificationError:
+    except stripe.SignatureVerificationError:
         return HttpResponse(status=400)
 
     if event['type'] == 'checkout.session.completed':
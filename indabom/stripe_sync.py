@@ -0,0 +1,200 @@
+"""
+Bulk Stripe operations behind the OrganizationMeta and OrganizationSubscription admin actions.
+
+The selected rows are worked through a chunk at a time: the chunk's Stripe calls run on a bounded thread pool, its
+results are written with bulk_update, and a Progress is yielded so the admin can show how far along the run is.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import stripe
+from bom.constants import SUBSCRIPTION_TYPE_FREE, SUBSCRIPTION_TYPE_PRO
+from bom.models import Organization
+from django.db import transaction
+from django.utils import timezone
+
+from indabom import billing_metrics
+from indabom.models import OrganizationMeta, OrganizationSubscription
+from indabom.stripe import subscription_fields
+
+logger = logging.getLogger(__name__)
+
+# Stripe allows 100 requests/s in live mode (25 in test); stay well under it alongside regular traffic
+BULK_CONCURRENCY = 8
+BULK_CHUNK_SIZE = 50
+MAX_REPORTED_ERRORS = 20
+
+SUBSCRIPTION_SYNC_FIELDS = ('stripe_price_id', 'status', 'quantity', 'monthly_unit_amount', 'current_period_start',
+                            'current_period_end')
+PERIOD_FIELDS = ('current_period_start', 'current_period_end')
+
+
+@dataclass
+class Progress:
+    total: int
+    done: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def fail(self, label: str, error: object):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{label}: {error}")
+
+
+def _run(items: Sequence, label: Callable[[object], str], fetch: Callable[[object], object],
+         write: Callable[[List[Tuple[object, object]], Progress], int],
+         concurrency: int = BULK_CONCURRENCY) -> Iterator[Progress]:
+    """Fetches every item from Stripe on the pool and writes the results one chunk at a time."""
+    progress = Progress(total=len(items))
+
+    def attempt(item):
+        try:
+            return item, fetch(item), None
+        except stripe.StripeError as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))),
+                            thread_name_prefix='indabom-stripe-bulk') as pool:
+        for start in range(0, len(items), BULK_CHUNK_SIZE):
+            fetched = []
+            for item, result, error in pool.map(attempt, items[start:start + BULK_CHUNK_SIZE]):
+                if error is not None:
+                    progress.fail(label(item), error.user_message or error)
+                else:
+                    fetched.append((item, result))
+            progress.updated += write(fetched, progress)
+            progress.done = min(progress.total, start + BULK_CHUNK_SIZE)
+            yield progress
+    logger.info("Stripe bulk run finished: %s rows, %s updated, %s failed", progress.total, progress.updated,
+                progress.failed)
+
+
+def _save_subscriptions(fetched: List[Tuple[OrganizationMeta, object]], progress: Progress,
+                        fields: Sequence[str] = SUBSCRIPTION_SYNC_FIELDS, create: bool = True) -> int:
+    """
+    Writes Stripe subscriptions, each paired with its OrganizationMeta, onto the local rows and returns how many
+    changed. The local rows are locked while they are compared, so the billing rollup gets exact before/after states.
+    """
+    if not fetched:
+        return 0
+    with transaction.atomic():
+        existing = {subscription.stripe_subscription_id: subscription for subscription in
+                    OrganizationSubscription.objects.select_for_update().filter(
+                        stripe_subscription_id__in=[data.get('id') for _meta, data in fetched])}
+        changed, created, transitions = [], [], []
+        for meta, data in fetched:
+            values = subscription_fields(data)
+            if values is None:
+                progress.fail(data.get('id'), "no price on the subscription")
+                continue
+            values = {name: value for name, value in values.items() if name in fields}
+            subscription = existing.get(data.get('id'))
+            if subscription is None:
+                if create:
+                    subscription = OrganizationSubscription(
+                        organization_meta=meta, stripe_subscription_id=data.get('id'),
+                        started_by_id=meta.organization.owner_id, **values)
+                    created.append(subscription)
+                    transitions.append((None, billing_metrics.state_of(subscription)))
+                continue
+            if all(getattr(subscription, name) == value for name, value in values.items()):
+                continue
+            before = billing_metrics.state_of(subscription)
+            for name, value in values.items():
+                setattr(subscription, name, value)
+            changed.append(subscription)
+            transitions.append((before, billing_metrics.state_of(subscription)))
+
+        OrganizationSubscription.objects.bulk_update(changed, fields)
+        OrganizationSubscription.objects.bulk_create(created)
+        billing_metrics.apply_changes(timezone.localdate(), transitions)
+        if 'status' in fields or 'quantity' in fields:
+            _sync_organization_plans({meta.organization_id for meta, _data in fetched})
+    return len(changed) + len(created)
+
+
+def _sync_organization_plans(organization_ids):
+    """Sets each organization's plan from its active subscription, as the webhook handlers do."""
+    active = dict(OrganizationSubscription.objects.filter(
+        organization_meta__organization_id__in=organization_ids, status='active',
+    ).values_list('organization_meta__organization_id', 'quantity'))
+    organizations = Organization.objects.filter(id__in=organization_ids).only(
+        'id', 'subscription', 'subscription_quantity')
+    changed = []
+    for organization in organizations:
+        plan = (SUBSCRIPTION_TYPE_PRO, active[organization.id]) if organization.id in active \
+            else (SUBSCRIPTION_TYPE_FREE, 1)
+        if (organization.subscription, organization.subscription_quantity) != plan:
+            organization.subscription, organization.subscription_quantity = plan
+            changed.append(organization)
+    # Only the plan fields change, so Organization.save()'s currency bookkeeping is not needed
+    Organization.objects.bulk_update(changed, ['subscription', 'subscription_quantity'])
+
+
+def resync_customers(metas: Sequence[OrganizationMeta],
+                     concurrency: int = BULK_CONCURRENCY) -> Iterator[Progress]:
+    """Pulls every Stripe subscription of each organization's customer onto the local rows, creating missing ones."""
+    metas = [meta for meta in metas if meta.stripe_customer_id]
+
+    def fetch(meta):
+        return list(stripe.Subscription.list(customer=meta.stripe_customer_id, status='all',
+                                             limit=100).auto_paging_iter())
+
+    def write(fetched, progress):
+        return _save_subscriptions([(meta, data) for meta, subscriptions in fetched for data in subscriptions],
+                                   progress)
+
+    return _run(metas, lambda meta: meta.stripe_customer_id, fetch, write, concurrency)
+
+
+def verify_customer_ids(metas: Sequence[OrganizationMeta],
+                        concurrency: int = BULK_CONCURRENCY) -> Iterator[Progress]:
+    """Clears customer ids that no longer exist in Stripe, so the next checkout creates a fresh customer."""
+    metas = [meta for meta in metas if meta.stripe_customer_id]
+
+    def fetch(meta) -> bool:
+        try:
+            customer = stripe.Customer.retrieve(meta.stripe_customer_id)
+        except stripe.InvalidRequestError as e:
+            if e.code == 'resource_missing':
+                return False
+            raise
+        return not customer.get('deleted')
+
+    def write(fetched, progress):
+        stale = [meta for meta, exists in fetched if not exists]
+        for meta in stale:
+            logger.warning("Clearing stale Stripe customer ID '%s' for OrganizationMeta %s", meta.stripe_customer_id,
+                           meta.pk)
+            meta.stripe_customer_id = None
+        OrganizationMeta.objects.bulk_update(stale, ['stripe_customer_id'])
+        return len(stale)
+
+    return _run(metas, lambda meta: meta.stripe_customer_id, fetch, write, concurrency)
+
+
+def _retrieve(subscription: OrganizationSubscription):
+    return stripe.Subscription.retrieve(subscription.stripe_subscription_id)
+
+
+def resync_subscriptions(subscriptions: Sequence[OrganizationSubscription],
+                         concurrency: int = BULK_CONCURRENCY,
+                         fields: Optional[Sequence[str]] = None) -> Iterator[Progress]:
+    """Overwrites each subscription's Stripe-owned fields (or just ``fields``) with what Stripe has now."""
+    fields = fields or SUBSCRIPTION_SYNC_FIELDS
+
+    def write(fetched, progress):
+        return _save_subscriptions([(subscription.organization_meta, data) for subscription, data in fetched],
+                                   progress, fields, create=False)
+
+    return _run(subscriptions, lambda subscription: subscription.stripe_subscription_id, _retrieve, write,
+                concurrency)
+
+
+def refresh_period_dates(subscriptions: Sequence[OrganizationSubscription],
+                         concurrency: int = BULK_CONCURRENCY) -> Iterator[Progress]:
+    return resync_subscriptions(subscriptions, concurrency, PERIOD_FIELDS)
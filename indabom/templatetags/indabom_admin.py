@@ -0,0 +1,11 @@
+from django import template
+
+from indabom import billing_metrics as metrics
+
+register = template.Library()
+
+
+@register.simple_tag
+def billing_metrics():
+    """The billing overview for the admin index, read from the latest daily rollup."""
+    return metrics.dashboard()
@@ -1,13 +1,23 @@
+from io import StringIO
 from unittest.mock import patch, Mock
 
-from bom.models import Organization, UserMeta
+from bom.models import Manufacturer, Organization, Part, PartClass, Seller, UserMeta
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
 from django.utils import timezone
 from django.test import TestCase
 from django.urls import reverse
 
 User = get_user_model()
-from indabom.models import IndabomUserMeta
+from indabom import account_deletion, billing_metrics
+from indabom.models import (
+    AccountDeletionJob,
+    BillingMetricsDay,
+    IndabomUserMeta,
+    OrganizationMeta,
+    OrganizationSubscription,
+)
 
 
 class AccountDeletionTests(TestCase):
@@ -43,7 +53,20 @@ class AccountDeletionTests(TestCase):
         resp = self.client.post(url, data={'password': 'memberpass'})
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'indabom/account-deleted.html')
+        # Deactivated and logged out right away, deleted by the worker
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertNotIn('_auth_user_id', self.client.session)
+        job = AccountDeletionJob.objects.get(user=user)
+        self.assertIsNone(job.organization)
+
+        call_command('process_account_deletions', '--until-idle', stdout=StringIO())
         self.assertFalse(User.objects.filter(id=user.id).exists())
+        self.assertTrue(Organization.objects.filter(id=self.org.id).exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, AccountDeletionJob.STATUS_DONE)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['m@example.com'])
 
     @patch('indabom.views.stripe.get_active_subscription')
     def test_owner_with_active_subscription_blocked_and_redirected(self, mock_active_sub):
@@ -71,6 +94,10 @@ class AccountDeletionTests(TestCase):
         resp = self.client.post(url, data={'password': 'ownerpass'})
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'indabom/account-deleted.html')
+        self.assertTrue(Organization.objects.filter(id=self.org.id).exists())
+        self.assertFalse(User.objects.get(id=self.owner.id).is_active)
+
+        call_command('process_account_deletions', '--until-idle', stdout=StringIO())
         self.assertFalse(User.objects.filter(id=self.owner.id).exists())
         self.assertFalse(Organization.objects.filter(id=self.org.id).exists())
 
@@ -87,3 +114,157 @@ class AccountDeletionTests(TestCase):
         # Should render the same confirm template due to error
         self.assertTemplateUsed(resp, 'indabom/delete-account.html')
         self.assertTrue(User.objects.filter(id=user.id).exists())
+
+
+class AccountDeletionWorkerTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='ownerpass', email='owner@example.com')
+        self.org = Organization.objects.create(name='Org Inc', subscription='F', owner=self.owner)
+        UserMeta.objects.create(user=self.owner, organization=self.org, role='A')
+        part_classes = PartClass.objects.bulk_create(
+            PartClass(organization=self.org, code=f'{n:03}', name=f'Class {n}') for n in range(3))
+        Part.objects.bulk_create(
+            Part(organization=self.org, number_class=part_class, number_item=f'{n:04}')
+            for part_class in part_classes for n in range(4))
+        Seller.objects.bulk_create(Seller(organization=self.org, name=f'Seller {n}') for n in range(5))
+        Manufacturer.objects.bulk_create(Manufacturer(organization=self.org, name=f'Mfr {n}') for n in range(5))
+
+    def test_deletes_in_bounded_batches_and_tracks_progress(self):
+        job = account_deletion.request_deletion(self.owner, self.org)
+        deletes = []
+        original = account_deletion._record_batch
+
+        def record(job, deleted):
+            deletes.append(deleted)
+            original(job, deleted)
+
+        with patch.object(account_deletion, '_record_batch', record):
+            job = account_deletion.run_job(account_deletion.claim_job(), batch_size=2)
+
+        self.assertEqual(job.status, AccountDeletionJob.STATUS_DONE)
+        self.assertTrue(all(sum(deleted.values()) <= 2 for deleted in deletes))
+        self.assertEqual(job.progress['bom.Part'], 12)
+        self.assertEqual(job.progress['bom.PartClass'], 3)
+        self.assertEqual(job.progress['bom.Seller'], 5)
+        self.assertEqual(job.rows_deleted, sum(sum(deleted.values()) for deleted in deletes))
+        self.assertFalse(Part.objects.exists())
+        self.assertFalse(User.objects.filter(id=self.owner.id).exists())
+        job.refresh_from_db()
+        self.assertIsNone(job.user)
+        self.assertIsNone(job.organization)
+
+    def test_deleted_subscriptions_leave_the_billing_rollup(self):
+        meta = OrganizationMeta.objects.create(organization=self.org, stripe_customer_id='cus_org')
+        with billing_metrics.track_subscription_change('sub_old'):
+            OrganizationSubscription.objects.create(
+                organization_meta=meta, stripe_subscription_id='sub_old', stripe_price_id='price_abc',
+                status='canceled', quantity=2, current_period_start=timezone.now(), current_period_end=timezone.now())
+        self.assertEqual(BillingMetricsDay.objects.get().canceled, 1)
+
+        account_deletion.request_deletion(self.owner, self.org)
+        account_deletion.run_job(account_deletion.claim_job())
+
+        self.assertFalse(OrganizationSubscription.objects.exists())
+        self.assertEqual(BillingMetricsDay.objects.get().canceled, 0)
+
+    def test_failed_attempt_is_retried_with_backoff_then_resumes(self):
+        job = account_deletion.request_deletion(self.owner, self.org)
+        original = account_deletion.delete_in_batches
+        failures = [RuntimeError('lost connection')]
+
+        def fail_on_user(model, *args, **kwargs):
+            if model is User and failures:
+                raise failures.pop()
+            return original(model, *args, **kwargs)
+
+        with patch.object(account_deletion, 'delete_in_batches', fail_on_user):
+            job = account_deletion.run_job(account_deletion.claim_job())
+        self.assertEqual(job.status, AccountDeletionJob.STATUS_PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('lost connection', job.error)
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        # The organization went on the first attempt; only the user is left
+        self.assertFalse(Organization.objects.filter(id=self.org.id).exists())
+        self.assertIsNone(account_deletion.claim_job())
+
+        job = account_deletion.run_job(account_deletion.claim_job(now=job.next_attempt_at))
+        self.assertEqual((job.status, job.attempts), (AccountDeletionJob.STATUS_DONE, 2))
+        self.assertFalse(User.objects.filter(id=self.owner.id).exists())
+
+    def test_gives_up_after_max_attempts(self):
+        account_deletion.request_deletion(self.owner, self.org)
+        with patch.object(account_deletion, 'delete_in_batches', side_effect=RuntimeError('boom')):
+            job = account_deletion.run_job(account_deletion.claim_job(), max_attempts=1)
+        self.assertEqual(job.status, AccountDeletionJob.STATUS_FAILED)
+        self.assertIsNone(account_deletion.claim_job(now=timezone.now() + timezone.timedelta(days=1)))
+        self.assertTrue(User.objects.filter(id=self.owner.id, is_active=False).exists())
+
+
+class PurgeInactiveAccountsTests(TestCase):
+    def setUp(self):
+        self.long_ago = timezone.now() - timezone.timedelta(days=1000)
+        self.recently = timezone.now() - timezone.timedelta(days=10)
+
+    def make_user(self, username, last_login=None, joined=None, **kwargs):
+        return User.objects.create_user(username=username, email=f'{username}@example.com',
+                                        last_login=last_login, date_joined=joined or self.long_ago, **kwargs)
+
+    def make_org(self, owner, subscription_status=None):
+        organization = Organization.objects.create(name=f'{owner.username} Inc', subscription='F', owner=owner)
+        UserMeta.objects.create(user=owner, organization=organization, role='A')
+        if subscription_status:
+            meta = OrganizationMeta.objects.create(organization=organization)
+            OrganizationSubscription.objects.create(
+                organization_meta=meta, stripe_subscription_id=f'sub_{owner.username}', stripe_price_id='price_1',
+                status=subscription_status, current_period_start=self.long_ago, current_period_end=self.long_ago)
+        return organization
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_inactive_accounts', '--inactive-days', '365', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_selects_only_accounts_delete_account_would_allow(self):
+        dormant = self.make_user('dormant', last_login=self.long_ago)
+        never = self.make_user('never')
+        dormant_owner = self.make_user('dormant_owner', last_login=self.long_ago)
+        dormant_org = self.make_org(dormant_owner, subscription_status='canceled')
+        Seller.objects.create(organization=dormant_org, name='Seller')
+
+        keep = [
+            self.make_user('recent', last_login=self.recently),
+            self.make_user('new', joined=self.recently),
+            self.make_user('staff', last_login=self.long_ago, is_staff=True),
+        ]
+        accepted = self.make_user('accepted', last_login=self.long_ago)
+        IndabomUserMeta.objects.create(user=accepted, terms_accepted_at=self.recently)
+        paying_owner = self.make_user('paying', last_login=self.long_ago)
+        paying_org = self.make_org(paying_owner, subscription_status='active')
+        paid_member = self.make_user('paid_member', last_login=self.long_ago)
+        UserMeta.objects.create(user=paid_member, organization=paying_org, role='M')
+        busy_owner = self.make_user('busy_owner', last_login=self.long_ago)
+        busy_org = self.make_org(busy_owner)
+        UserMeta.objects.create(user=self.make_user('busy', last_login=self.recently), organization=busy_org,
+                                role='M')
+        queued = self.make_user('queued', last_login=self.long_ago)
+        account_deletion.request_deletion(queued)
+        keep += [accepted, paying_owner, paid_member, busy_owner, queued]
+
+        output = self.purge('--dry-run')
+        self.assertIn('would delete 3 accounts and the 1 organizations they own', output)
+        self.assertIn('never (never logged in)', output)
+        self.assertEqual(User.objects.filter(pk__in=[dormant.pk, never.pk, dormant_owner.pk]).count(), 3)
+
+        output = self.purge()
+        self.assertIn('Purged 3 accounts and 1 organizations', output)
+        self.assertIn('bom.Seller: 1', output)
+        self.assertFalse(User.objects.filter(pk__in=[dormant.pk, never.pk, dormant_owner.pk]).exists())
+        self.assertFalse(Organization.objects.filter(pk=dormant_org.pk).exists())
+        self.assertEqual(User.objects.filter(pk__in=[user.pk for user in keep]).count(), len(keep))
+        self.assertEqual(Organization.objects.filter(pk__in=[paying_org.pk, busy_org.pk]).count(), 2)
+
+    def test_limit(self):
+        for n in range(5):
+            self.make_user(f'dormant{n}', last_login=self.long_ago)
+        self.assertIn('Purged 3 accounts', self.purge('--limit', '3'))
+        self.assertEqual(User.objects.filter(username__startswith='dormant').count(), 2)
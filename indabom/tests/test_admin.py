@@ -0,0 +1,243 @@
+from unittest.mock import patch
+
+from bom.models import Organization
+from django.contrib.admin import site as admin_site
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom import pagination
+from indabom.models import (
+    CheckoutSessionRecord,
+    EmailSendBatch,
+    EmailSendLog,
+    EmailTemplate,
+    OrganizationMeta,
+    OrganizationSubscription,
+    RequestProfile,
+)
+from indabom.pagination import EstimatedCountPaginator
+from indabom.query_budget import QueryCounter
+
+User = get_user_model()
+
+
+class ChangelistQueryTests(TestCase):
+    """Each indabom changelist runs the same number of queries however many rows it shows."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='kasper', email='kasper@example.com', password='pw12345')
+        self.client.force_login(self.admin)
+        self.template = EmailTemplate.objects.create(name='Launch', subject='Hi', html_body='<p>Hi</p>')
+        self.rows = 0
+
+    def add_rows(self, count):
+        now = timezone.now()
+        for _ in range(count):
+            n = self.rows = self.rows + 1
+            user = User.objects.create_user(username=f'user{n}', email=f'user{n}@example.com')
+            organization = Organization.objects.create(name=f'Org{n}', owner=user)
+            meta = OrganizationMeta.objects.create(organization=organization, stripe_customer_id=f'cus_{n}')
+            subscription = OrganizationSubscription.objects.create(
+                organization_meta=meta, stripe_subscription_id=f'sub_{n}', stripe_price_id='price_1',
+                status='active', current_period_start=now, current_period_end=now, started_by=user)
+            CheckoutSessionRecord.objects.create(user=user, organization_subscription=subscription,
+                                                 checkout_session_id=f'cs_{n}', stripe_subscription_id=f'sub_{n}')
+            EmailTemplate.objects.create(name=f'Template {n}', subject='Hi', html_body='<p>Hi</p>')
+            batch = EmailSendBatch.objects.create(template=self.template, run_id='run', number=n)
+            EmailSendLog.objects.create(template=self.template, batch=batch, user=user, email=user.email,
+                                        status=EmailSendLog.STATUS_SENT)
+            RequestProfile.objects.create(user=user, method='GET', path='/', report={'queries': [
+                {'ms': 1.0, 'alias': 'default', 'sql': 'SELECT profiled_marker', 'origin': 'views.py:1'}]})
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:indabom_{model._meta.model_name}_changelist')
+        with QueryCounter() as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return counter.count
+
+    def test_query_count_does_not_grow_with_rows(self):
+        models = (OrganizationMeta, OrganizationSubscription, CheckoutSessionRecord, EmailTemplate, EmailSendBatch,
+                  EmailSendLog, RequestProfile)
+        self.add_rows(2)
+        few = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(4)
+        many = {model: self.changelist_queries(model) for model in models}
+        self.assertEqual(few, many)
+
+    def test_request_profile_list_does_not_load_reports(self):
+        self.add_rows(1)
+        with QueryCounter() as counter:
+            self.client.get(reverse('admin:indabom_requestprofile_changelist'))
+        selects = [sql for sql in counter.queries if 'indabom_requestprofile' in sql]
+        self.assertTrue(selects)
+        self.assertFalse(any('"report"' in sql for sql in selects))
+
+    def test_change_view_still_loads_whole_row(self):
+        self.add_rows(1)
+        profile = RequestProfile.objects.get()
+        response = self.client.get(reverse('admin:indabom_requestprofile_change', args=[profile.pk]))
+        self.assertContains(response, 'SELECT profiled_marker')
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        template = EmailTemplate.objects.create(name='Launch', subject='Hi', html_body='<p>Hi</p>')
+        EmailSendLog.objects.bulk_create(
+            EmailSendLog(template=template, email=f'user{n}@example.com', status=EmailSendLog.STATUS_SENT)
+            for n in range(5))
+
+    def test_unfiltered_uses_table_estimate(self):
+        with patch.object(pagination, 'estimated_row_count', return_value=2_000_000) as estimate, \
+                QueryCounter() as counter:
+            count = EstimatedCountPaginator(EmailSendLog.objects.order_by('pk'), 100).count
+        self.assertEqual(count, 2_000_000)
+        estimate.assert_called_once_with(EmailSendLog, 'default')
+        self.assertEqual(counter.count, 0)
+
+    def test_small_or_unknown_estimate_counts_exactly(self):
+        for estimate in (None, 3):
+            with patch.object(pagination, 'estimated_row_count', return_value=estimate):
+                self.assertEqual(EstimatedCountPaginator(EmailSendLog.objects.order_by('pk'), 100).count, 5)
+
+    def test_filtered_count_is_capped(self):
+        queryset = EmailSendLog.objects.filter(status=EmailSendLog.STATUS_SENT).order_by('pk')
+        with patch.object(pagination, 'FILTERED_COUNT_LIMIT', 3), \
+                patch.object(pagination, 'estimated_row_count') as estimate:
+            paginator = EstimatedCountPaginator(queryset, 2)
+            self.assertEqual(paginator.count, 3)
+        estimate.assert_not_called()
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_sqlite_estimate_needs_analyze(self):
+        self.assertIsNone(pagination.estimated_row_count(EmailSendLog))
+
+
+class EmailTemplateSendLogPanelTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='kasper', email='kasper@example.com', password='pw12345')
+        self.client.force_login(self.admin)
+        self.template = EmailTemplate.objects.create(name='Launch', subject='Hi', html_body='<p>Hi</p>')
+
+    def add_logs(self, count, status=EmailSendLog.STATUS_SENT, sent_at=None):
+        start = EmailSendLog.objects.count()
+        EmailSendLog.objects.bulk_create(
+            EmailSendLog(template=self.template, email=f'user{n}@example.com', status=status,
+                         sent_at=sent_at or timezone.now())
+            for n in range(start, start + count))
+
+    def get(self, url):
+        with QueryCounter() as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, counter.count
+
+    def test_change_page_does_not_load_logs(self):
+        change_url = reverse('admin:indabom_emailtemplate_change', args=[self.template.pk])
+        panel_url = reverse('admin:indabom_emailtemplate_send_logs', args=[self.template.pk])
+        self.add_logs(3)
+        self.get(change_url)  # the first admin request also touches the session
+        response, few = self.get(change_url)
+        self.assertContains(response, f'data-url="{panel_url}"')
+        self.assertNotContains(response, 'user0@example.com')
+        self.add_logs(300)
+        _response, many = self.get(change_url)
+        self.assertEqual(few, many)
+
+    def test_panel_pages_logs_with_grouped_counts(self):
+        url = reverse('admin:indabom_emailtemplate_send_logs', args=[self.template.pk])
+        self.add_logs(2)
+        _response, few = self.get(url)
+        self.add_logs(60, sent_at=timezone.now() - timezone.timedelta(days=1))
+        self.add_logs(5, status=EmailSendLog.STATUS_FAILED)
+        response, many = self.get(url)
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['total'], 67)
+        self.assertEqual(response.context['totals'], [('Sending', 0), ('Sent', 62), ('Failed', 5)])
+        self.assertEqual([counts for _day, counts in response.context['by_day']], [[0, 2, 5], [0, 60, 0]])
+        self.assertEqual(len(response.context['logs']), 50)
+        self.assertEqual((response.context['num_pages'], response.context['next_page']), (2, 2))
+        self.assertContains(response, 'user66@example.com')
+        self.assertContains(response, '?page=2&amp;total=67')
+
+        # Page links reuse the total and leave the counts alone
+        response, paged = self.get(f'{url}?page=2&total=67')
+        self.assertLess(paged, many)
+        self.assertNotIn('by_day', response.context)
+        self.assertEqual(len(response.context['logs']), 17)
+        self.assertIsNone(response.context['next_page'])
+        self.assertContains(response, 'user2@example.com')
+        self.assertEqual(self.client.get(url, {'page': 'x'}).context['page'], 1)
+
+    def test_panel_counts_days_in_the_window_only(self):
+        url = reverse('admin:indabom_emailtemplate_send_logs', args=[self.template.pk])
+        self.add_logs(2)
+        self.add_logs(3, sent_at=timezone.now() - timezone.timedelta(days=30))
+        response, _count = self.get(url)
+        self.assertEqual(response.context['total'], 5)
+        self.assertEqual([counts for _day, counts in response.context['by_day']], [[0, 2, 0]])
+
+    def test_panel_requires_view_permission(self):
+        staff = User.objects.create_user(username='staff', email='staff@example.com', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('admin:indabom_emailtemplate_send_logs', args=[self.template.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='kasper', email='kasper@example.com', password='pw12345')
+        self.client.force_login(self.admin)
+        self.template = EmailTemplate.objects.create(name='Spring launch', subject='New parts', html_body='<p>Hi</p>')
+        for n, address in enumerate(('ann@example.com', 'bob@example.com', 'annie@other.org')):
+            EmailSendLog.objects.create(template=self.template, email=address, status=EmailSendLog.STATUS_SENT,
+                                        message_id=f'<msg{n}@mg.indabom.com>')
+
+    def search(self, model, term):
+        response = self.client.get(reverse(f'admin:indabom_{model._meta.model_name}_changelist'), {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'].queryset
+
+    def test_send_log_search_is_prefix_on_email_and_exact_on_message_id(self):
+        self.assertEqual(sorted(log.email for log in self.search(EmailSendLog, 'ann')),
+                         ['ann@example.com', 'annie@other.org'])
+        self.assertFalse(self.search(EmailSendLog, 'example.com').exists())
+        self.assertEqual([log.email for log in self.search(EmailSendLog, '<msg1@mg.indabom.com>')],
+                         ['bob@example.com'])
+        self.assertEqual([log.email for log in self.search(EmailSendLog, 'msg1@mg.indabom.com')],
+                         ['bob@example.com'])
+        self.assertFalse(self.search(EmailSendLog, 'msg1').exists())
+
+    def test_message_id_search_keeps_list_filters(self):
+        url = reverse('admin:indabom_emailsendlog_changelist')
+        response = self.client.get(url, {'q': 'msg1@mg.indabom.com', 'status__exact': EmailSendLog.STATUS_FAILED})
+        self.assertFalse(response.context['cl'].queryset.exists())
+
+    def test_subscription_search_by_stripe_ids(self):
+        owner = User.objects.create_user(username='alice', email='alice@example.com')
+        organization = Organization.objects.create(name='Acme', owner=owner)
+        meta = OrganizationMeta.objects.create(organization=organization, stripe_customer_id='cus_123')
+        now = timezone.now()
+        OrganizationSubscription.objects.create(organization_meta=meta, stripe_subscription_id='sub_123',
+                                                stripe_price_id='price_1', current_period_start=now,
+                                                current_period_end=now)
+        self.assertEqual(self.search(OrganizationMeta, 'cus_123').get(), meta)
+        self.assertFalse(self.search(OrganizationMeta, 'cus_12').exists())
+        self.assertEqual(self.search(OrganizationSubscription, 'sub_123').count(), 1)
+        self.assertEqual(self.search(OrganizationSubscription, 'cus_123').count(), 1)
+        self.assertEqual(self.search(OrganizationSubscription, 'acm').count(), 1)
+
+    def test_template_search_uses_full_text_index_on_mysql(self):
+        model_admin = admin_site._registry[EmailTemplate]
+        queryset = EmailTemplate.objects.all()
+        results, _duplicates = model_admin.get_search_results(None, queryset, 'launch')
+        self.assertEqual(list(results), [self.template])
+
+        with patch.object(connection, 'vendor', 'mysql'):
+            results, _duplicates = model_admin.get_search_results(None, queryset, 'spring +launch*')
+            sql, params = results.query.sql_with_params()
+        self.assertIn('MATCH ("name", "subject") AGAINST (%s IN BOOLEAN MODE)', sql)
+        self.assertIn('+spring* +launch*', params)
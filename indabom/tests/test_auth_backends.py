@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from django.contrib.auth import authenticate, get_user_model
+from django.core import mail
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from django.urls import reverse
+
+from indabom.auth_backends import email_in_use, users_with_email
+from indabom.forms import UserForm
+from indabom.query_budget import QueryCounter
+
+User = get_user_model()
+
+
+class EmailLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='kasper', email='Kasper@Ghost.com', password='pw12345')
+
+    def test_lookup_ignores_case_through_the_key_expression(self):
+        with QueryCounter() as counter:
+            self.assertTrue(email_in_use(' kasper@GHOST.com'))
+        self.assertEqual(counter.count, 1)
+        sql = counter.queries[0]
+        self.assertIn('NULLIF(LOWER(', sql)
+        self.assertNotIn('COUNT(', sql)
+        self.assertFalse(email_in_use('other@ghost.com'))
+        self.assertFalse(email_in_use(''))
+        self.assertEqual(list(users_with_email('KASPER@ghost.com')), [self.user])
+
+    def test_database_rejects_the_same_address_in_another_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username='copy', email='kasper@ghost.COM')
+        # Accounts without an address are not affected
+        User.objects.create_user(username='blank1', email='')
+        User.objects.create_user(username='blank2', email='')
+
+    def test_signup_form_rejects_taken_address(self):
+        form = UserForm(data={'username': 'copy', 'password1': 'secretpassword', 'password2': 'secretpassword',
+                              'email': 'KASPER@ghost.com', 'first_name': 'K', 'last_name': 'C'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('email', form.errors)
+
+    def test_signup_race_on_the_address_is_a_form_error(self):
+        data = {'username': 'copy', 'password1': 'secretpassword', 'password2': 'secretpassword',
+                'email': 'KASPER@ghost.com', 'first_name': 'K', 'last_name': 'C'}
+        # The other signup commits between clean_email and save
+        with patch('indabom.forms.email_in_use', return_value=False):
+            resp = self.client.post(reverse('signup'), data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('An account with this email address already exists.', resp.context['form'].errors['email'])
+        self.assertFalse(User.objects.filter(username='copy').exists())
+
+    def test_signup_reraises_other_integrity_errors(self):
+        data = {'username': 'copy', 'password1': 'secretpassword', 'password2': 'secretpassword',
+                'email': 'copy@ghost.com', 'first_name': 'K', 'last_name': 'C'}
+        with patch('indabom.forms.UserForm.save', side_effect=IntegrityError('NOT NULL constraint failed')), \
+                self.assertRaises(IntegrityError):
+            self.client.post(reverse('signup'), data)
+
+
+class EmailBackendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='kasper', email='Kasper@Ghost.com', password='pw12345')
+
+    def test_login_with_email_or_username(self):
+        self.assertEqual(authenticate(username='kasper@ghost.com', password='pw12345'), self.user)
+        self.assertEqual(authenticate(username='kasper', password='pw12345'), self.user)
+        self.assertIsNone(authenticate(username='kasper@ghost.com', password='wrong'))
+        self.assertIsNone(authenticate(username='nobody@ghost.com', password='pw12345'))
+
+    def test_username_that_looks_like_an_email_wins(self):
+        other = User.objects.create_user(username='kasper@ghost.com', email='other@ghost.com', password='other')
+        self.assertEqual(authenticate(username='kasper@ghost.com', password='other'), other)
+        self.assertIsNone(authenticate(username='kasper@ghost.com', password='pw12345'))
+
+    def test_inactive_user_cannot_log_in_with_email(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(authenticate(username='kasper@ghost.com', password='pw12345'))
+
+    def test_login_view_accepts_email(self):
+        response = self.client.post(reverse('login'), {'username': 'KASPER@ghost.com', 'password': 'pw12345'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+
+    def test_password_reset_finds_address_in_any_case(self):
+        self.client.post(reverse('password_reset'), {'email': 'kasper@GHOST.com'})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest.mock import patch
+
+import stripe
+from bom.models import Organization
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom import billing_metrics
+from indabom import stripe as stripe_module
+from indabom.models import BillingMetricsDay, CheckoutSessionRecord, OrganizationMeta, OrganizationSubscription
+
+User = get_user_model()
+
+
+def subscription_event(status='active', quantity=3, unit_amount=1500, interval='month', subscription_id='sub_123'):
+    price = {'id': 'price_abc', 'unit_amount': unit_amount, 'recurring': {'interval': interval, 'interval_count': 1}}
+    return {
+        "id": "evt_1",
+        "data": {"object": {
+            "id": subscription_id,
+            "customer": "cus_123",
+            "status": status,
+            "quantity": quantity,
+            "items": {"data": [{"price": price, "current_period_start": 1700000000,
+                                "current_period_end": 1702592000}]},
+        }},
+    }
+
+
+class MonthlyUnitAmountTests(TestCase):
+    def test_normalizes_intervals(self):
+        def price(amount, interval, count=1):
+            return {'unit_amount': amount, 'recurring': {'interval': interval, 'interval_count': count}}
+
+        self.assertEqual(billing_metrics.monthly_unit_amount(price(1500, 'month')), 1500)
+        self.assertEqual(billing_metrics.monthly_unit_amount(price(12000, 'year')), 1000)
+        self.assertEqual(billing_metrics.monthly_unit_amount(price(3000, 'month', 3)), 1000)
+        self.assertEqual(billing_metrics.monthly_unit_amount({'amount': 1200, 'interval': 'year'}), 100)
+        self.assertIsNone(billing_metrics.monthly_unit_amount({'unit_amount': 1500}))
+        self.assertIsNone(billing_metrics.monthly_unit_amount(None))
+
+
+class IncrementalBillingMetricsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="alice", email="alice@example.com", password="pw")
+        self.org = Organization.objects.create(name="Acme", owner=self.owner)
+        OrganizationMeta.objects.create(organization=self.org, stripe_customer_id="cus_123")
+
+    def today(self):
+        return BillingMetricsDay.objects.get(day=timezone.localdate())
+
+    def test_webhooks_update_todays_rollup(self):
+        stripe_module.subscription_changed_handler(subscription_event())
+        today = self.today()
+        self.assertEqual((today.active, today.seats, today.mrr, today.new_subscriptions), (1, 3, 4500, 1))
+
+        stripe_module.subscription_changed_handler(subscription_event(quantity=5))
+        today = self.today()
+        self.assertEqual((today.active, today.seats, today.mrr, today.new_subscriptions), (1, 5, 7500, 1))
+
+        stripe_module.subscription_changed_handler(subscription_event('canceled', quantity=5))
+        today = self.today()
+        self.assertEqual((today.active, today.canceled, today.seats, today.mrr), (0, 1, 0, 0))
+        self.assertEqual(today.churned_subscriptions, 1)
+
+    def test_first_change_of_the_day_carries_the_previous_snapshot_forward(self):
+        BillingMetricsDay.objects.create(day=timezone.localdate() - timedelta(days=3), active=4, seats=10, mrr=9000,
+                                         new_subscriptions=2)
+        stripe_module.subscription_changed_handler(subscription_event(quantity=2, unit_amount=1000))
+        today = self.today()
+        self.assertEqual((today.active, today.seats, today.mrr), (5, 12, 11000))
+        self.assertEqual(today.new_subscriptions, 1)
+
+    def test_unchanged_event_writes_nothing(self):
+        stripe_module.subscription_changed_handler(subscription_event())
+        before = BillingMetricsDay.objects.values().get()
+        stripe_module.subscription_changed_handler(subscription_event())
+        self.assertEqual(BillingMetricsDay.objects.values().get(), before)
+
+    def test_bulk_updates_and_deletes_update_todays_rollup(self):
+        stripe_module.subscription_changed_handler(subscription_event('canceled'))
+        stripe_module.subscription_changed_handler(subscription_event(subscription_id='sub_456'))
+        subscriptions = OrganizationSubscription.objects.all()
+
+        self.assertEqual(billing_metrics.update_subscriptions(subscriptions.filter(stripe_subscription_id='sub_456'),
+                                                              quantity=4), 1)
+        self.assertEqual((self.today().seats, self.today().mrr), (4, 6000))
+
+        # As account deletion removes them
+        billing_metrics.delete_subscriptions(subscriptions)
+        today = self.today()
+        self.assertEqual((today.active, today.canceled, today.seats, today.mrr), (0, 0, 0, 0))
+        self.assertEqual(today.churned_subscriptions, 1)
+
+    def test_dashboard(self):
+        self.assertIsNone(billing_metrics.dashboard())
+        stripe_module.subscription_changed_handler(subscription_event())
+        stripe_module.subscription_changed_handler(subscription_event('past_due', subscription_id='sub_456'))
+        dashboard = billing_metrics.dashboard()
+        self.assertEqual(dashboard['mrr'], 45.0)
+        self.assertEqual(dashboard['by_status'], [('active', 1), ('past_due', 1)])
+        self.assertEqual((dashboard['new'], dashboard['churned']), (1, 0))
+
+        admin = User.objects.create_superuser(username='kasper', email='kasper@example.com', password='pw12345')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:index'))
+        self.assertContains(response, '$45.00')
+
+
+class RebuildBillingMetricsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="alice", email="alice@example.com", password="pw")
+        self.today = timezone.localdate()
+
+    def subscription(self, name, status, started_days_ago, ended_days_ago=None, quantity=2, amount=1000):
+        organization = Organization.objects.create(name=name, owner=self.owner)
+        meta = OrganizationMeta.objects.create(organization=organization, stripe_customer_id=f'cus_{name}')
+        now = datetime.now(dt_timezone.utc)
+        end = now - timedelta(days=ended_days_ago) if ended_days_ago is not None else now + timedelta(days=20)
+        subscription = OrganizationSubscription.objects.create(
+            organization_meta=meta, stripe_subscription_id=f'sub_{name}', stripe_price_id='price_abc',
+            status=status, quantity=quantity, monthly_unit_amount=amount,
+            current_period_start=now - timedelta(days=10), current_period_end=end)
+        CheckoutSessionRecord.objects.create(user=self.owner, organization_subscription=subscription,
+                                             checkout_session_id=f'cs_{name}', stripe_subscription_id=f'sub_{name}',
+                                             renewal_consent_timestamp=now - timedelta(days=started_days_ago))
+        return subscription
+
+    def test_rebuilds_history_in_one_pass(self):
+        self.subscription('a', 'active', started_days_ago=40)
+        self.subscription('b', 'canceled', started_days_ago=30, ended_days_ago=5, quantity=4)
+        # Its current period began before its checkout record, so it counts from the period start
+        self.subscription('c', 'incomplete', started_days_ago=2, amount=None)
+        BillingMetricsDay.objects.create(day=self.today - timedelta(days=100), active=99)
+
+        out = StringIO()
+        call_command('rebuild_billing_metrics', '--skip-prices', stdout=out)
+        self.assertIn('Rebuilt 5 days', out.getvalue())
+
+        days = {row.day: row for row in BillingMetricsDay.objects.all()}
+        self.assertEqual(sorted(self.today - day for day in days),
+                         [timedelta(days=n) for n in (0, 5, 10, 30, 40)])
+        peak = days[self.today - timedelta(days=30)]
+        self.assertEqual((peak.active, peak.seats, peak.mrr, peak.new_subscriptions), (2, 6, 6000, 1))
+        latest = days[self.today]
+        self.assertEqual((latest.active, latest.canceled, latest.incomplete, latest.seats, latest.mrr),
+                         (1, 1, 1, 2, 2000))
+        self.assertEqual(days[self.today - timedelta(days=5)].churned_subscriptions, 1)
+
+    @patch('indabom.management.commands.rebuild_billing_metrics.prime_price_cache')
+    def test_fills_missing_amounts_once_per_price(self, mock_price):
+        mock_price.return_value = {'id': 'price_abc', 'unit_amount': 24000, 'recurring': {'interval': 'year'}}
+        self.subscription('a', 'active', started_days_ago=3, amount=None)
+        self.subscription('b', 'active', started_days_ago=1, amount=None)
+
+        call_command('rebuild_billing_metrics', stdout=StringIO())
+
+        mock_price.assert_called_once_with('price_abc')
+        self.assertEqual(set(OrganizationSubscription.objects.values_list('monthly_unit_amount', flat=True)), {2000})
+        self.assertEqual(BillingMetricsDay.objects.get(day=self.today).mrr, 8000)
+
+    @patch('indabom.management.commands.rebuild_billing_metrics.prime_price_cache',
+           side_effect=stripe.StripeError('No such price'))
+    def test_price_lookup_failure_is_reported_and_skipped(self, _mock_price):
+        self.subscription('a', 'active', started_days_ago=3, amount=None)
+        err = StringIO()
+
+        call_command('rebuild_billing_metrics', stdout=StringIO(), stderr=err)
+
+        self.assertIn('Could not retrieve price price_abc: No such price', err.getvalue())
+        self.assertIsNone(OrganizationSubscription.objects.get().monthly_unit_amount)
+        self.assertEqual(BillingMetricsDay.objects.get(day=self.today).active, 1)
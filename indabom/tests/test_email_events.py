@@ -0,0 +1,133 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from anymail.signals import AnymailTrackingEvent, EventType
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom.email_events import DeliveryEventBuffer, apply_delivery_events
+from indabom.models import EmailSendLog, EmailSuppression, EmailTemplate
+
+User = get_user_model()
+
+SIGNING_KEY = 'test-signing-key'
+
+
+def mailgun_event(event, recipient, message_id, **event_data):
+    timestamp, token = str(int(time.time())), f'token-{recipient}-{event}'
+    signature = hmac.new(SIGNING_KEY.encode(), f'{timestamp}{token}'.encode(), hashlib.sha256).hexdigest()
+    return json.dumps({
+        'signature': {'timestamp': timestamp, 'token': token, 'signature': signature},
+        'event-data': {'event': event, 'recipient': recipient, 'timestamp': float(timestamp),
+                       'message': {'headers': {'message-id': message_id}}, **event_data},
+    })
+
+
+def tracking_event(event_type, recipient, message_id='<batch@mg.indabom.com>', seconds=0):
+    return AnymailTrackingEvent(event_type=event_type, recipient=recipient, message_id=message_id,
+                                timestamp=timezone.now() + timezone.timedelta(seconds=seconds))
+
+
+@override_settings(ANYMAIL={**settings.ANYMAIL, 'MAILGUN_WEBHOOK_SIGNING_KEY': SIGNING_KEY})
+class MailgunTrackingWebhookTests(TestCase):
+    def setUp(self):
+        self.template = EmailTemplate.objects.create(name='launch', subject='Hi', html_body='<p>Hi</p>')
+        # One Mailgun batch send: every recipient shares the message id
+        self.logs = [
+            EmailSendLog.objects.create(template=self.template, email=email, status=EmailSendLog.STATUS_SENT,
+                                        message_id='<batch@mg.indabom.com>')
+            for email in ('ada@example.com', 'bob@example.com')
+        ]
+
+    def post(self, payload):
+        return self.client.post(reverse('mailgun-tracking-webhook'), data=payload, content_type='application/json')
+
+    def test_records_delivery_for_the_recipient(self):
+        response = self.post(mailgun_event('delivered', 'ada@example.com', 'batch@mg.indabom.com'))
+
+        self.assertEqual(response.status_code, 200)
+        ada, bob = (EmailSendLog.objects.get(pk=log.pk) for log in self.logs)
+        self.assertEqual(ada.delivery_status, EmailSendLog.DELIVERY_DELIVERED)
+        self.assertIsNotNone(ada.delivery_updated_at)
+        self.assertIsNone(bob.delivery_status)
+
+    def test_rejects_a_bad_signature(self):
+        payload = json.loads(mailgun_event('complained', 'ada@example.com', 'batch@mg.indabom.com'))
+        payload['signature']['signature'] = 'forged'
+
+        with self.assertLogs('django.security', level='ERROR'):
+            response = self.post(json.dumps(payload))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EmailSuppression.objects.exists())
+        self.assertFalse(EmailSendLog.objects.exclude(delivery_status=None).exists())
+
+    @override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend', DEFAULT_FROM_EMAIL='no-reply@indabom.com')
+    def test_hard_bounces_are_suppressed_from_campaigns(self):
+        self.post(mailgun_event('failed', 'ada@example.com', 'batch@mg.indabom.com', severity='permanent'))
+        self.post(mailgun_event('failed', 'bob@example.com', 'batch@mg.indabom.com', severity='temporary'))
+
+        self.assertEqual(EmailSuppression.objects.get().email, 'ada@example.com')
+        self.assertEqual(EmailSendLog.objects.get(email='bob@example.com').delivery_status,
+                         EmailSendLog.DELIVERY_DEFERRED)
+
+        User.objects.create_user(username='ada', email='ada@example.com', password='pw')
+        User.objects.create_user(username='cat', email='cat@example.com', password='pw')
+        EmailTemplate.objects.create(name='news', subject='News', html_body='<p>News</p>')
+        call_command('send_email_template', '--template-name', 'news', '--max-per-day', '10', stdout=StringIO())
+        self.assertEqual(mail.outbox[0].to, ['cat@example.com'])
+
+
+class ApplyDeliveryEventsTests(TestCase):
+    def setUp(self):
+        template = EmailTemplate.objects.create(name='launch', subject='Hi', html_body='<p>Hi</p>')
+        self.log = EmailSendLog.objects.create(template=template, email='ada@example.com',
+                                               status=EmailSendLog.STATUS_SENT, message_id='<batch@mg.indabom.com>')
+
+    def test_late_deferral_does_not_replace_delivery(self):
+        apply_delivery_events([tracking_event(EventType.DELIVERED, 'ada@example.com')])
+        apply_delivery_events([tracking_event(EventType.DEFERRED, 'ada@example.com', seconds=-60)])
+        self.log.refresh_from_db()
+        self.assertEqual(self.log.delivery_status, EmailSendLog.DELIVERY_DELIVERED)
+
+    def test_latest_event_wins_within_a_batch(self):
+        updated = apply_delivery_events([
+            tracking_event(EventType.COMPLAINED, 'ada@example.com', seconds=10),
+            tracking_event(EventType.DELIVERED, 'ada@example.com'),
+            tracking_event(EventType.OPENED, 'ada@example.com', seconds=5),
+        ])
+        self.assertEqual(updated, 1)
+        self.log.refresh_from_db()
+        self.assertEqual(self.log.delivery_status, EmailSendLog.DELIVERY_COMPLAINED)
+        self.assertEqual(EmailSuppression.objects.get().reason, EmailSuppression.REASON_COMPLAINED)
+
+
+class DeliveryEventBufferTests(SimpleTestCase):
+    @patch('indabom.email_events.apply_delivery_events')
+    def test_concurrent_requests_share_one_write(self, mock_apply):
+        buffer = DeliveryEventBuffer(max_wait=0.5, max_events=2)
+        events = [tracking_event(EventType.DELIVERED, f'user{n}@example.com') for n in range(2)]
+        threads = [threading.Thread(target=buffer.submit, args=([event],)) for event in events]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        mock_apply.assert_called_once()
+        self.assertCountEqual(mock_apply.call_args.args[0], events)
+
+    @patch('indabom.email_events.apply_delivery_events', side_effect=RuntimeError('database down'))
+    def test_failed_write_is_raised_to_the_request(self, _mock_apply):
+        buffer = DeliveryEventBuffer(max_wait=0)
+        with self.assertRaises(RuntimeError):
+            buffer.submit([tracking_event(EventType.DELIVERED, 'ada@example.com')])
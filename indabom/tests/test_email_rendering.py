@@ -0,0 +1,77 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from indabom import email_rendering
+from indabom.email_rendering import get_compiled
+from indabom.models import EmailSendLog, EmailTemplate
+
+User = get_user_model()
+
+
+def row(n, first_name='Ada'):
+    return {'pk': n, 'email': f'user{n}@example.com', 'first_name': first_name, 'last_name': 'Lovelace',
+            'username': f'user{n}'}
+
+
+class EmailRenderingTests(TestCase):
+    def test_compiles_variables_into_merge_placeholders(self):
+        template = EmailTemplate.objects.create(
+            name='launch', subject='Hi {{ user.first_name }}',
+            html_body='<p>{{ user.get_full_name|upper }}<br>{{ user.first_name }} ({{ user.email }})</p>')
+        compiled = get_compiled(template)
+
+        self.assertTrue(compiled.merge)
+        self.assertEqual(compiled.subject, 'Hi %recipient.v0%')
+        self.assertEqual(compiled.html, '<p>%recipient.v1_html%<br>%recipient.v0_html% (%recipient.v2_html%)</p>')
+        self.assertEqual(compiled.text, '%recipient.v1%\n%recipient.v0% (%recipient.v2%)')
+
+        data = compiled.merge_data([row(1, first_name='<Ada>')])
+        self.assertEqual(data['user1@example.com']['v0'], '<Ada>')
+        self.assertEqual(data['user1@example.com']['v0_html'], '&lt;Ada&gt;')
+        self.assertEqual(data['user1@example.com']['v1'], '<ADA> LOVELACE')
+
+    def test_recompiles_when_the_template_changes(self):
+        template = EmailTemplate.objects.create(name='launch', subject='Hi', html_body='<p>One</p>')
+        compiled = get_compiled(template)
+        self.assertIs(get_compiled(template), compiled)
+
+        template.html_body = '<p>Two</p>'
+        template.updated_at += timedelta(seconds=1)
+        self.assertEqual(get_compiled(template).html, '<p>Two</p>')
+
+    def test_tags_fall_back_to_rendering_each_recipient(self):
+        template = EmailTemplate.objects.create(
+            name='launch', subject='Hi {{ user.first_name|default:"there" }}',
+            html_body='{% if user.first_name %}<p>Dear {{ user.first_name }}</p>{% else %}<p>Hello</p>{% endif %}')
+        compiled = get_compiled(template)
+        self.assertFalse(compiled.merge)
+
+        rendered = compiled.render([row(1), row(2, first_name='')])
+        self.assertEqual(rendered, [
+            ('user1@example.com', 'Hi Ada', 'Dear Ada', '<p>Dear Ada</p>'),
+            ('user2@example.com', 'Hi there', 'Hello', '<p>Hello</p>'),
+        ])
+
+        with patch.object(email_rendering, 'PROCESS_POOL_MIN_ROWS', 1), \
+                patch.object(email_rendering, 'PROCESS_POOL_CHUNK_SIZE', 1):
+            self.assertEqual(compiled.render([row(1), row(2, first_name='')]), rendered)
+
+    @override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend', DEFAULT_FROM_EMAIL='no-reply@indabom.com')
+    def test_send_email_template_sends_rendered_messages_individually(self):
+        EmailTemplate.objects.create(
+            name='launch', subject='Hi',
+            html_body='{% if user.first_name %}<p>Dear {{ user.first_name }}</p>{% else %}<p>Hello</p>{% endif %}')
+        User.objects.create_user(username='ada', email='ada@example.com', password='pw', first_name='Ada')
+        User.objects.create_user(username='anon', email='anon@example.com', password='pw')
+
+        call_command('send_email_template', '--template-name', 'launch', '--max-per-day', '10', stdout=StringIO())
+
+        self.assertEqual(sorted((message.to[0], message.body) for message in mail.outbox),
+                         [('ada@example.com', 'Dear Ada'), ('anon@example.com', 'Hello')])
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.STATUS_SENT).count(), 2)
@@ -0,0 +1,60 @@
+import io
+import json
+import logging
+import threading
+
+from django.test import SimpleTestCase
+
+from indabom.log import JsonFormatter, QueueingHandler
+
+
+class BlockingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class QueueingHandlerTests(SimpleTestCase):
+    def _logger(self, handler):
+        logger = logging.getLogger(f'indabom.tests.log.{id(handler)}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        return logger
+
+    def test_records_are_written_as_json_by_listener(self):
+        stream = io.StringIO()
+        handler = QueueingHandler(stream=stream)
+        handler.setFormatter(JsonFormatter())
+        logger = self._logger(handler)
+
+        logger.info('Subscription %s changed', 'sub_1')
+        handler.flush()
+
+        payload = json.loads(stream.getvalue().strip())
+        self.assertEqual(payload['severity'], 'INFO')
+        self.assertEqual(payload['message'], 'Subscription sub_1 changed')
+        self.assertIn('logging.googleapis.com/sourceLocation', payload)
+
+    def test_full_queue_drops_and_reports_once(self):
+        stream = BlockingStream()
+        handler = QueueingHandler(queue_size=2, stream=stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = self._logger(handler)
+
+        for i in range(20):
+            logger.info('record %d', i)
+        self.assertGreater(handler.dropped_total, 0)
+
+        stream.release.set()
+        handler.flush()
+        logger.info('after')
+        handler.flush()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len([line for line in lines if line.startswith('Logging queue full')]), 1)
+        self.assertEqual(lines[-1], 'after')
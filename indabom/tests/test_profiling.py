@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom import profiling
+from indabom.models import IndabomUserMeta, RequestProfile
+
+User = get_user_model()
+
+
+class RequestProfilerMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user(username="staff", email="staff@example.com", password="pw",
+                                              is_staff=True, is_superuser=True)
+        IndabomUserMeta.objects.create(user=self.staff, terms_accepted_at=timezone.now())
+        self.client.force_login(self.staff)
+
+    def test_untriggered_request_is_not_profiled(self):
+        resp = self.client.get(reverse("about"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("X-Indabom-Profile-Id", resp)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_header_token_profiles_request(self):
+        token = profiling.make_token(self.staff)
+        resp = self.client.get(reverse("bom:home"), HTTP_X_INDABOM_PROFILE=token)
+
+        profile = RequestProfile.objects.get(pk=resp["X-Indabom-Profile-Id"])
+        self.assertEqual(profile.path, reverse("bom:home"))
+        self.assertEqual(profile.status_code, resp.status_code)
+        self.assertGreater(profile.query_count, 0)
+        self.assertEqual(profile.query_count, len(profile.report["queries"]))
+        self.assertTrue(profile.report["queries"][0]["origin"])
+        self.assertIn("cumulative", profile.report["profile"])
+
+    def test_query_param_token_profiles_request(self):
+        token = profiling.make_token(self.staff)
+        resp = self.client.get(reverse("about"), {"_profile": token})
+        self.assertIn("X-Indabom-Profile-Id", resp)
+
+    def test_invalid_or_foreign_token_ignored(self):
+        other = User.objects.create_user(username="other", password="pw", is_staff=True)
+        for token in ("garbage", profiling.make_token(other)):
+            resp = self.client.get(reverse("about"), HTTP_X_INDABOM_PROFILE=token)
+            self.assertNotIn("X-Indabom-Profile-Id", resp)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_non_staff_token_ignored(self):
+        self.staff.is_staff = False
+        self.staff.save()
+        resp = self.client.get(reverse("about"), HTTP_X_INDABOM_PROFILE=profiling.make_token(self.staff))
+        self.assertNotIn("X-Indabom-Profile-Id", resp)
+
+    def test_profile_viewable_in_admin(self):
+        token = profiling.make_token(self.staff)
+        resp = self.client.get(reverse("bom:home"), HTTP_X_INDABOM_PROFILE=token)
+        pk = resp["X-Indabom-Profile-Id"]
+
+        resp = self.client.get(reverse("admin:indabom_requestprofile_changelist"))
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(reverse("admin:indabom_requestprofile_change", args=[pk]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "cumulative")
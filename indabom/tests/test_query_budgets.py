@@ -0,0 +1,278 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import patch, MagicMock
+
+from bom.models import Organization
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import caches
+from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.test import TestCase, Client, modify_settings, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from indabom import stripe as stripe_module
+from indabom.models import (
+    BillingMetricsDay, IndabomUserMeta, OrganizationMeta, OrganizationSubscription, CheckoutSessionRecord,
+)
+from indabom.query_budget import (
+    URL_QUERY_BUDGETS,
+    WEBHOOK_QUERY_BUDGETS,
+    QueryBudgetExceeded,
+    QueryCounter,
+    budget_for,
+    query_budget,
+)
+from indabom.settings import STRIPE_WEBHOOK_SECRET
+
+User = get_user_model()
+
+
+class QueryBudgetFacilityTests(TestCase):
+    def test_context_manager_counts_and_raises(self):
+        with query_budget(1) as budget:
+            User.objects.count()
+        self.assertEqual(budget.count, 1)
+
+        with self.assertRaises(QueryBudgetExceeded) as ctx:
+            with query_budget(1, label='two counts'):
+                User.objects.count()
+                User.objects.count()
+        self.assertIn('two counts ran 2 queries, budget is 1', str(ctx.exception))
+
+    def test_decorator_counts_each_call_separately(self):
+        @query_budget(1)
+        def one_query():
+            return User.objects.count()
+
+        one_query()
+        one_query()
+
+    def test_middleware_logs_when_over_budget(self):
+        User.objects.create_user(username="kasper", email="kasper@ghost.com", password="pw12345")
+        caches['throttle'].clear()
+        credentials = {'username': 'kasper', 'password': 'pw12345'}
+        with modify_settings(MIDDLEWARE={'prepend': 'indabom.middleware.QueryBudgetMiddleware'}):
+            with self.assertNoLogs('indabom.middleware', level='WARNING'):
+                self.client.post(reverse('login'), credentials)
+            self.client.logout()
+
+            # A login that takes one query more than its budget is reported
+            budget = budget_for('login', 'POST')
+            with patch.dict(URL_QUERY_BUDGETS, {('login', 'POST'): budget - 1}), \
+                    self.assertLogs('indabom.middleware', level='WARNING') as logs:
+                self.client.post(reverse('login'), credentials)
+        self.assertIn(f'over its query budget of {budget - 1}', logs.output[0])
+
+    def test_head_is_held_to_the_get_budget(self):
+        self.assertEqual(budget_for('checkout', 'HEAD'), URL_QUERY_BUDGETS[('checkout', 'GET')])
+
+
+class UrlQueryBudgetTests(TestCase):
+    """Every URL in indabom.urls stays within its budget in URL_QUERY_BUDGETS."""
+
+    def setUp(self):
+        self.client = Client()
+        caches['throttle'].clear()
+        self.user = User.objects.create_user(username="kasper", email="kasper@ghost.com", password="pw12345")
+        self.org = Organization.objects.create(name="Org1", owner=self.user)
+        profile = self.user.bom_profile()
+        profile.organization = self.org
+        profile.save()
+        IndabomUserMeta.objects.create(user=self.user, terms_accepted_at=timezone.now())
+
+    def assertWithinBudget(self, url_name, method='get', *args, url=None, status_code=None, **kwargs):
+        budget = budget_for(url_name, method.upper())
+        with query_budget(budget, label=f'{method.upper()} {url_name}'):
+            response = getattr(self.client, method)(url or reverse(url_name), *args, **kwargs)
+        if status_code is None:
+            self.assertLess(response.status_code, 500, url_name)
+        else:
+            self.assertEqual(response.status_code, status_code, url_name)
+        return response
+
+    def test_every_url_has_a_budget(self):
+        from indabom import urls
+
+        names = {pattern.name for pattern in urls.urlpatterns if getattr(pattern, 'name', None)}
+        names -= {'admin'}  # Admin changelists are covered by their own tests
+        self.assertEqual(names - {name for name, _method in URL_QUERY_BUDGETS}, set())
+
+    def test_anonymous_pages(self):
+        for name in ('index', 'signup', 'login', 'password_reset', 'password_reset_done', 'password_reset_complete',
+                     'about', 'product', 'privacy-policy', 'terms-and-conditions', 'install', 'pricing', 'sitemap',
+                     'robots-file', 'checkout-success', 'checkout-cancelled'):
+            self.assertWithinBudget(name)
+
+    def test_password_reset_confirm(self):
+        url = reverse('password_reset_confirm', kwargs={'uidb64': 'MQ', 'token': 'set-password'})
+        self.assertWithinBudget('password_reset_confirm', url=url)
+
+    def test_login_post(self):
+        self.assertWithinBudget('login', 'post', {'username': 'kasper', 'password': 'pw12345'}, status_code=302)
+
+    def test_signup_post(self):
+        data = {'username': 'charlie', 'password1': 'secretpassword', 'password2': 'secretpassword',
+                'email': 'charlie@example.com', 'first_name': 'Char', 'last_name': 'Lie'}
+        self.assertWithinBudget('signup', 'post', data, status_code=302)
+
+    def test_password_reset_post(self):
+        self.assertWithinBudget('password_reset', 'post', {'email': 'kasper@ghost.com'}, status_code=302)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_password_reset_confirm_post(self):
+        uidb64 = urlsafe_base64_encode(force_bytes(self.user.pk))
+        token = default_token_generator.make_token(self.user)
+        # The emailed link stores the token in the session and redirects to the set-password form
+        set_password_url = self.client.get(reverse('password_reset_confirm', args=[uidb64, token])).url
+        self.assertWithinBudget('password_reset_confirm', 'post', {'new_password1': 'a-new-secret-1',
+                                                                   'new_password2': 'a-new-secret-1'},
+                                url=set_password_url, status_code=302)
+
+    def test_logout(self):
+        self.client.force_login(self.user)
+        self.assertWithinBudget('logout', 'post')
+
+    def test_update_terms(self):
+        self.client.force_login(self.user)
+        self.assertWithinBudget('update-terms')
+        self.assertWithinBudget('update-terms', 'post', status_code=302)
+
+    @patch("indabom.views.stripe.fetch_price", return_value=(MagicMock(unit_amount=500, product=MagicMock()), None))
+    def test_checkout(self, _mock_price):
+        self.client.force_login(self.user)
+        self.assertWithinBudget('checkout')
+
+    @patch("indabom.views.stripe.subscribe", return_value=MagicMock(id="cs_1", url="/checkout-session"))
+    def test_checkout_post(self, _mock_subscribe):
+        self.client.force_login(self.user)
+        data = {'price_id': 'price_123', 'organization': str(self.org.pk), 'unit': 2, 'renewal_consent': True}
+        self.assertWithinBudget('checkout', 'post', data, status_code=303)
+
+    @patch("indabom.views.stripe.manage_subscription", return_value=HttpResponseRedirect("/portal"))
+    def test_stripe_manage(self, _mock_manage):
+        self.client.force_login(self.user)
+        self.assertWithinBudget('stripe-manage')
+
+    def test_account_delete(self):
+        self.client.force_login(self.user)
+        self.assertWithinBudget('account-delete')
+        self.assertWithinBudget('account-delete', 'post', {'password': 'pw12345'}, status_code=200)
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+
+    def test_stripe_webhook(self):
+        meta = OrganizationMeta.objects.create(organization=self.org, stripe_customer_id="cus_123")
+        BillingMetricsDay.objects.create(day=timezone.localdate())
+        payload = json.dumps({
+            "id": "evt_1", "object": "event", "type": "customer.subscription.created",
+            "data": {"object": {
+                "id": "sub_123", "object": "subscription", "customer": "cus_123", "status": "active", "quantity": 3,
+                "items": {"data": [{"price": {"id": "price_abc"}, "current_period_start": 1700000000,
+                                    "current_period_end": 1702592000}]},
+            }},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(STRIPE_WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256)
+        # Outside of tests the handler runs on commit while the request is still being served, so it counts too
+        with query_budget(budget_for('stripe-webhook', 'POST'), label='POST stripe-webhook'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('stripe-webhook'), data=payload, content_type="application/json",
+                                        HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature.hexdigest()}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OrganizationSubscription.objects.get(organization_meta=meta).quantity, 3)
+
+    def test_abuse_metrics(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertWithinBudget('abuse-metrics', status_code=200)
+
+    def test_stripe_webhook_rejects_bad_signature(self):
+        self.assertWithinBudget('stripe-webhook', 'post', data=b"{}", content_type="application/json",
+                                HTTP_STRIPE_SIGNATURE="bad", status_code=400)
+
+    def test_mailgun_tracking_webhook(self):
+        from indabom.tests.test_email_events import SIGNING_KEY, mailgun_event
+
+        payload = mailgun_event('failed', 'kasper@ghost.com', 'batch@mg.indabom.com', severity='permanent')
+        with override_settings(ANYMAIL={**settings.ANYMAIL, 'MAILGUN_WEBHOOK_SIGNING_KEY': SIGNING_KEY}):
+            self.assertWithinBudget('mailgun-tracking-webhook', 'post', data=payload, content_type='application/json',
+                                    status_code=200)
+
+
+class ReadinessQueryBudgetTests(TestCase):
+    databases = {'default', 'readonly'}
+
+    @patch("indabom.warmup.stripe.prime_price_cache")
+    def test_readiness(self, _mock_prime):
+        from indabom import warmup
+        warmup._report = None
+        self.addCleanup(setattr, warmup, '_report', None)
+        with query_budget(budget_for('readiness', 'GET'), label='readiness'):
+            response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 200)
+
+
+class WebhookQueryBudgetTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="alice", email="alice@example.com", password="pw")
+        self.org = Organization.objects.create(name="Acme", owner=self.owner)
+        self.org_meta = OrganizationMeta.objects.create(organization=self.org, stripe_customer_id="cus_123")
+        # Budgets are for the steady state; the first subscription change of a day also creates the day's rollup
+        BillingMetricsDay.objects.create(day=timezone.localdate())
+
+    def _subscription_event(self, status='active'):
+        return {
+            "id": "evt_1",
+            "data": {"object": {
+                "id": "sub_123",
+                "customer": "cus_123",
+                "status": status,
+                "quantity": 3,
+                "items": {"data": [{"price": {"id": "price_abc"}, "current_period_start": 1700000000,
+                                    "current_period_end": 1702592000}]},
+            }},
+        }
+
+    def test_subscription_changed_handler(self):
+        with query_budget(WEBHOOK_QUERY_BUDGETS['subscription_changed_handler'], label='created'):
+            stripe_module.subscription_changed_handler(self._subscription_event())
+        with query_budget(WEBHOOK_QUERY_BUDGETS['subscription_changed_handler'], label='updated'):
+            stripe_module.subscription_changed_handler(self._subscription_event('canceled'))
+        self.assertEqual(OrganizationSubscription.objects.get().status, 'canceled')
+
+    @patch("indabom.stripe.stripe.Subscription.retrieve")
+    def test_subscription_completed_handler(self, mock_retrieve):
+        pending = CheckoutSessionRecord.objects.create(user=self.owner, checkout_session_id="cs_1",
+                                                       stripe_subscription_id="")
+        stripe_sub = MagicMock()
+        stripe_sub.get.side_effect = {"status": "active", "quantity": 2, "current_period_start": 1700000000,
+                                      "current_period_end": 1702592000}.get
+        stripe_sub.items.data = [MagicMock(price=MagicMock(id="price_abc"))]
+        mock_retrieve.return_value = stripe_sub
+        session = MagicMock()
+        session.metadata = {'pending_subscription_id': pending.pk}
+        session.get.side_effect = {"subscription": "sub_123", "customer": "cus_123", "id": "cs_1"}.get
+
+        with query_budget(WEBHOOK_QUERY_BUDGETS['subscription_completed_handler'], label='completed'):
+            stripe_module.subscription_completed_handler({"data": {"object": session}})
+        self.assertTrue(OrganizationSubscription.objects.filter(stripe_subscription_id="sub_123").exists())
+
+    def test_subscription_issue_handler(self):
+        event = MagicMock(id="evt_2")
+        event.get.side_effect = {"data": {"object": {"customer": "cus_123"}}}.get
+        with query_budget(WEBHOOK_QUERY_BUDGETS['subscription_issue_handler'], label='issue'):
+            stripe_module.subscription_issue_handler(event)
+
+
+class QueryCounterTests(TestCase):
+    def test_counts_without_budget(self):
+        with QueryCounter(using=['default']) as counter:
+            User.objects.exists()
+        self.assertEqual(counter.count, 1)
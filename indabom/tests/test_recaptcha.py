@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from indabom import recaptcha
+from indabom.recaptcha import BoundedReCaptchaField, CircuitBreaker
+
+
+class FakeVerifyServer(ThreadingHTTPServer):
+    """A local siteverify endpoint: tokens starting with 'ok' are valid; ``delay`` and ``status`` simulate trouble."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeVerifyHandler)
+        self.delay = 0.0
+        self.status = 200
+        self.requests = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/recaptcha/api/siteverify'
+
+
+class FakeVerifyHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        form = {key: values[0] for key, values in
+                parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode()).items()}
+        self.server.requests.append(form)
+        time.sleep(self.server.delay)
+        valid = form.get('response', '').startswith('ok')
+        body = json.dumps({'success': valid, **({} if valid else {'error-codes': ['invalid-input-response']})})
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class RecaptchaVerificationTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeVerifyServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.delay, self.server.status = 0.0, 200
+        self.server.requests.clear()
+        recaptcha._stats.clear()
+        overrides = override_settings(RECAPTCHA_VERIFY_URL=self.server.url, RECAPTCHA_VERIFY_TIMEOUT=0.2,
+                                      RECAPTCHA_PRIVATE_KEY='secret', RECAPTCHA_FAIL_OPEN=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        breaker = patch.object(recaptcha, 'breaker', CircuitBreaker(threshold=2, cooldown=60))
+        breaker.start()
+        self.addCleanup(breaker.stop)
+
+    def clean(self, token='ok-token', remote_ip='203.0.113.5'):
+        field = BoundedReCaptchaField()
+        field.remote_ip = remote_ip
+        return field.clean(token)
+
+    def test_valid_and_invalid_tokens(self):
+        self.assertEqual(self.clean(), 'ok-token')
+        self.assertEqual(self.server.requests[-1],
+                         {'secret': 'secret', 'response': 'ok-token', 'remoteip': '203.0.113.5'})
+        with self.assertRaises(ValidationError) as raised:
+            self.clean('forged')
+        self.assertEqual(raised.exception.code, 'captcha_invalid')
+        # A rejected token is an answer, not an outage
+        self.assertFalse(recaptcha.breaker.is_open)
+        self.assertEqual((recaptcha.metrics()['valid'], recaptcha.metrics()['invalid']), (1, 1))
+
+    def test_slow_google_is_cut_off_at_the_timeout(self):
+        self.server.delay = 1.0
+        started = time.perf_counter()
+        with self.assertRaises(ValidationError) as raised:
+            self.clean()
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertEqual(raised.exception.code, 'captcha_error')
+        self.assertEqual(recaptcha.metrics()['timeout'], 1)
+
+    @override_settings(RECAPTCHA_FAIL_OPEN=True)
+    def test_fail_open_lets_signups_through_while_unavailable(self):
+        self.server.status = 503
+        self.assertEqual(self.clean(), 'ok-token')
+        # Fail-open never accepts a token Google actually rejected
+        self.server.status = 200
+        with self.assertRaises(ValidationError):
+            self.clean('forged')
+        self.assertEqual(recaptcha.metrics()['failed_open'], 1)
+
+    def test_breaker_opens_after_threshold_and_recovers(self):
+        self.server.status = 500
+        for _ in range(2):
+            with self.assertRaises(ValidationError):
+                self.clean()
+        self.assertTrue(recaptcha.breaker.is_open)
+
+        # Open: no call is made at all
+        calls = len(self.server.requests)
+        with self.assertRaises(ValidationError):
+            self.clean()
+        self.assertEqual(len(self.server.requests), calls)
+        self.assertEqual(recaptcha.metrics()['short_circuited'], 1)
+
+        # After the cooldown one trial goes through and closes the breaker again
+        self.server.status = 200
+        recaptcha.breaker.opened_at -= 61
+        self.assertEqual(self.clean(), 'ok-token')
+        self.assertFalse(recaptcha.breaker.is_open)
+
+    def test_failed_trial_reopens(self):
+        breaker = recaptcha.breaker
+        breaker.failed()
+        breaker.failed()
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+        # Only one trial at a time
+        self.assertFalse(breaker.allow())
+        breaker.failed()
+        self.assertFalse(breaker.allow())
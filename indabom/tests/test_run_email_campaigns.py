@@ -0,0 +1,106 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from indabom.campaigns import TokenBucket
+from indabom.models import EmailSendBatch, EmailSendLog, EmailTemplate
+
+User = get_user_model()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_starts_full_and_refills_at_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2.0, capacity=10, clock=clock)
+
+        self.assertEqual(bucket.take(4), 4)
+        self.assertEqual(bucket.take(100), 6)
+        self.assertEqual(bucket.take(1), 0)
+        self.assertEqual(bucket.seconds_until(3), 1.5)
+
+        clock.now = 1.5
+        self.assertEqual(bucket.take(5), 3)
+        clock.now = 100
+        self.assertEqual(bucket.take(100), 10)
+
+    def test_unused_tokens_are_returned(self):
+        bucket = TokenBucket(rate=0.0, capacity=5, clock=FakeClock())
+        self.assertEqual(bucket.take(5), 5)
+        bucket.give_back(2)
+        self.assertEqual(bucket.take(5), 2)
+        self.assertEqual(bucket.seconds_until(1), float('inf'))
+
+
+@override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend', DEFAULT_FROM_EMAIL='no-reply@indabom.com')
+class RunEmailCampaignsTests(TestCase):
+    def setUp(self):
+        self.launch = EmailTemplate.objects.create(name='launch', subject='Hi', html_body='<p>Launch</p>',
+                                                   scheduled=True)
+        self.survey = EmailTemplate.objects.create(name='survey', subject='Hi', html_body='<p>Survey</p>',
+                                                   scheduled=True)
+        self.manual = EmailTemplate.objects.create(name='manual', subject='Hi', html_body='<p>Manual</p>')
+        self.users = [
+            User.objects.create_user(username=f'user{n}', email=f'user{n}@example.com', password='pw')
+            for n in range(3)
+        ]
+
+    def run_scheduler(self, *args):
+        out = StringIO()
+        call_command('run_email_campaigns', '--until-idle', '--poll-interval', '0.01', *args,
+                     stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def sent(self, template):
+        return set(EmailSendLog.objects.filter(template=template, status=EmailSendLog.STATUS_SENT)
+                   .values_list('email', flat=True))
+
+    def test_sends_every_scheduled_campaign(self):
+        output = self.run_scheduler('--max-per-day', '100', '--batch-size', '2', '--burst', '100')
+
+        emails = {user.email for user in self.users}
+        self.assertEqual(self.sent(self.launch), emails)
+        self.assertEqual(self.sent(self.survey), emails)
+        self.assertEqual(self.sent(self.manual), set())
+        self.assertEqual(sum(len(message.to) for message in mail.outbox), 6)
+        self.assertTrue(all(len(message.to) <= 2 for message in mail.outbox))
+        self.assertIn('Scheduler stopped: sent 6 emails', output)
+
+    def test_campaigns_share_the_daily_cap(self):
+        EmailSendLog.objects.create(template=self.manual, user=self.users[0], email=self.users[0].email,
+                                    status=EmailSendLog.STATUS_SENT)
+
+        self.run_scheduler('--max-per-day', '5', '--burst', '100')
+
+        self.assertEqual(EmailSendLog.objects.count(), 5)
+        # Neither campaign is starved by the other
+        self.assertTrue(self.sent(self.launch))
+        self.assertTrue(self.sent(self.survey))
+
+    def test_resumes_where_a_previous_run_stopped(self):
+        EmailSendLog.objects.create(template=self.launch, user=self.users[0], email=self.users[0].email,
+                                    status=EmailSendLog.STATUS_SENT)
+        batch = EmailSendBatch.objects.create(template=self.launch, run_id='interrupted', number=1,
+                                              recipient_count=1)
+        EmailSendLog.objects.create(template=self.launch, batch=batch, user=self.users[1],
+                                    email=self.users[1].email, status=EmailSendLog.STATUS_SENDING)
+        self.survey.enabled = False
+        self.survey.save()
+
+        output = self.run_scheduler('--max-per-day', '100')
+        self.assertIn('launch: skipping 1 recipients', output)
+        self.assertEqual([message.to for message in mail.outbox], [[self.users[2].email]])
+
+        self.run_scheduler('--max-per-day', '100', '--resend-interrupted')
+        self.assertEqual(mail.outbox[-1].to, [self.users[1].email])
+        self.assertEqual(self.sent(self.launch), {user.email for user in self.users})
@@ -0,0 +1,203 @@
+from io import StringIO
+from unittest.mock import patch
+
+from anymail.backends.test import EmailBackend as AnymailTestBackend
+from anymail.exceptions import AnymailAPIError
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from indabom import campaigns
+from indabom.campaigns import remaining_quota, reserve_quota
+from indabom.models import EmailSendBatch, EmailSendLog, EmailSendQuota, EmailTemplate
+from indabom.query_budget import QueryCounter
+
+User = get_user_model()
+
+
+class RejectingBackend(AnymailTestBackend):
+    """anymail's test backend, except any batch addressed to user1@example.com is rejected by the "ESP"."""
+
+    def post_to_esp(self, payload, message):
+        if 'user1@example.com' in message.to:
+            raise AnymailAPIError('Rejected by ESP')
+        return super().post_to_esp(payload, message)
+
+
+@override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend', DEFAULT_FROM_EMAIL='no-reply@indabom.com')
+class SendEmailTemplateTests(TestCase):
+    def setUp(self):
+        self.template = EmailTemplate.objects.create(name='launch', subject='Hi {{ user.first_name }}',
+                                                     html_body='<p>Hello {{ user.first_name }}</p>')
+        self.users = [
+            User.objects.create_user(username=f'user{n}', email=f'user{n}@example.com', password='pw',
+                                     first_name=f'User{n}')
+            for n in range(3)
+        ]
+
+    def send(self, *args):
+        out = StringIO()
+        call_command('send_email_template', '--template-name', 'launch', '--max-per-day', '100', *args,
+                     stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_logs_every_recipient_in_one_insert(self):
+        with QueryCounter() as counter:
+            self.send()
+
+        logs = EmailSendLog.objects.filter(template=self.template)
+        self.assertEqual(logs.count(), 3)
+        self.assertTrue(all(log.status == EmailSendLog.STATUS_SENT for log in logs))
+        self.assertEqual({log.user_id for log in logs}, {user.pk for user in self.users})
+        inserts = [sql for sql in counter.queries if sql.startswith('INSERT INTO "indabom_emailsendlog"')]
+        self.assertEqual(len(inserts), 1)
+        self.template.refresh_from_db()
+        self.assertIsNotNone(self.template.last_sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_skips_recipients_already_sent(self):
+        EmailSendLog.objects.create(template=self.template, user=self.users[0], email=self.users[0].email,
+                                    status=EmailSendLog.STATUS_SENT)
+        self.send()
+        self.assertEqual(mail.outbox[0].to, [self.users[1].email, self.users[2].email])
+        self.assertEqual(EmailSendLog.objects.filter(template=self.template).count(), 3)
+
+    def test_selects_recipients_with_an_anti_join(self):
+        for user in self.users[:2]:
+            EmailSendLog.objects.create(template=self.template, user=user, email=user.email,
+                                        status=EmailSendLog.STATUS_SENT)
+        with QueryCounter() as counter:
+            self.send('--dry-run')
+
+        selects = [sql for sql in counter.queries if sql.startswith('SELECT "auth_user"')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('NOT EXISTS', selects[0])
+        self.assertNotIn('"auth_user"."email" IN', selects[0])
+
+    @patch('indabom.campaigns.AnymailMessage.send', side_effect=RuntimeError('down'))
+    def test_batch_failure_logs_each_recipient_as_failed(self, _mock_send):
+        self.send()
+
+        logs = EmailSendLog.objects.filter(template=self.template)
+        self.assertEqual(logs.count(), 3)
+        self.assertTrue(all(log.status == EmailSendLog.STATUS_FAILED and log.error == 'down' for log in logs))
+        self.template.refresh_from_db()
+        self.assertIsNotNone(self.template.last_sent_at)
+
+    def test_rendering_error_fails_the_batch_not_the_run(self):
+        self.template.html_body = '<p>{% if user.first_name %}<a href="{% url "missing" %}">Hi</a>{% endif %}</p>'
+        self.template.save()
+        self.send('--batch-size', '2')
+
+        batches = EmailSendBatch.objects.filter(template=self.template)
+        self.assertEqual(batches.count(), 2)
+        self.assertTrue(all(batch.status == EmailSendBatch.STATUS_FAILED and 'missing' in batch.error
+                            for batch in batches))
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.STATUS_FAILED).count(), 3)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_splits_recipients_into_batches(self):
+        User.objects.create_user(username='user3', email='user3@example.com', password='pw')
+        User.objects.create_user(username='user4', email='user4@example.com', password='pw')
+
+        output = self.send('--batch-size', '2', '--concurrency', '2')
+
+        self.assertEqual(sorted(len(message.to) for message in mail.outbox), [1, 2, 2])
+        self.assertEqual(sorted(message.merge_data.keys() == set(message.to) for message in mail.outbox),
+                         [True, True, True])
+        batches = EmailSendBatch.objects.filter(template=self.template)
+        self.assertEqual(sorted(batch.number for batch in batches), [1, 2, 3])
+        self.assertTrue(all(batch.status == EmailSendBatch.STATUS_SENT and batch.duration_ms is not None
+                            for batch in batches))
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.STATUS_SENT).count(), 5)
+        self.assertIn('Batch 3/3', output)
+        self.assertIn('Sent 5 emails', output)
+
+    @override_settings(EMAIL_BACKEND='indabom.tests.test_send_email_template.RejectingBackend')
+    def test_failed_batch_does_not_fail_the_others(self):
+        self.send('--batch-size', '1')
+
+        failed = EmailSendLog.objects.get(status=EmailSendLog.STATUS_FAILED)
+        self.assertEqual(failed.email, 'user1@example.com')
+        self.assertIn('Rejected by ESP', failed.error)
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.STATUS_SENT).count(), 2)
+        self.assertEqual(failed.batch.status, EmailSendBatch.STATUS_FAILED)
+
+        # Failed recipients are retried on the next run
+        with override_settings(EMAIL_BACKEND='anymail.backends.test.EmailBackend'):
+            self.send()
+        self.assertEqual(mail.outbox[-1].to, ['user1@example.com'])
+
+    def test_resumes_without_resending_unconfirmed_batches(self):
+        # A previous run claimed user0 and stopped before the ESP answered
+        batch = EmailSendBatch.objects.create(template=self.template, run_id='interrupted', number=1,
+                                              recipient_count=1)
+        EmailSendLog.objects.create(template=self.template, batch=batch, user=self.users[0],
+                                    email=self.users[0].email, status=EmailSendLog.STATUS_SENDING)
+
+        output = self.send()
+        self.assertIn('Skipping 1 recipients', output)
+        self.assertEqual(mail.outbox[0].to, [self.users[1].email, self.users[2].email])
+
+        self.send('--resend-interrupted')
+        self.assertEqual(mail.outbox[1].to, [self.users[0].email])
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, EmailSendBatch.STATUS_FAILED)
+        self.assertFalse(EmailSendLog.objects.filter(status=EmailSendLog.STATUS_SENDING).exists())
+
+    def test_recipients_claimed_by_another_sender_are_not_mailed_twice(self):
+        select_recipients = campaigns.select_recipients
+
+        def select_then_race(template, *args):
+            selected = select_recipients(template, *args)
+            # The scheduler claims user0 between this run's selection and its claim
+            EmailSendLog.objects.create(template=template, user=self.users[0], email=self.users[0].email,
+                                        status=EmailSendLog.STATUS_SENDING)
+            return selected
+
+        with patch('indabom.campaigns.select_recipients', side_effect=select_then_race):
+            self.send('--batch-size', '1')
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [self.users[1].email, self.users[2].email])
+        self.assertEqual(EmailSendLog.objects.filter(email=self.users[0].email).count(), 1)
+        self.assertEqual(EmailSendBatch.objects.filter(template=self.template).count(), 2)
+
+    def test_rejects_batches_larger_than_mailgun_allows(self):
+        with self.assertRaises(CommandError):
+            self.send('--batch-size', '1001')
+
+    def test_stops_at_the_daily_cap_reserved_by_other_senders(self):
+        EmailSendQuota.objects.create(day=timezone.localdate(), used=98)
+
+        output = self.send('--batch-size', '1')
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [self.users[0].email, self.users[1].email])
+        self.assertEqual(EmailSendQuota.objects.get().used, 100)
+        self.assertIn('Sent 2 emails', output)
+
+
+class SendQuotaTests(TestCase):
+    def setUp(self):
+        self.template = EmailTemplate.objects.create(name='launch', subject='Hi', html_body='<p>Hello</p>')
+
+    def test_reservations_never_exceed_the_cap(self):
+        self.assertEqual(reserve_quota(10, 6)[1], 6)
+        self.assertEqual(reserve_quota(10, 6)[1], 4)
+        self.assertEqual(reserve_quota(10, 6)[1], 0)
+        self.assertEqual(remaining_quota(10), 0)
+        self.assertEqual(reserve_quota(12, 6)[1], 2)
+
+    def test_ledger_starts_from_todays_logs(self):
+        EmailSendLog.objects.create(template=self.template, email='user@example.com',
+                                    status=EmailSendLog.STATUS_SENT)
+        self.assertEqual(remaining_quota(10), 9)
+
+    def test_reservation_does_not_read_the_send_logs(self):
+        reserve_quota(10, 1)
+        with QueryCounter() as counter:
+            reserve_quota(10, 1)
+        self.assertFalse([sql for sql in counter.queries if 'indabom_emailsendlog' in sql])
+        self.assertLessEqual(counter.count, 5)
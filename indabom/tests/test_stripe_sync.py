@@ -0,0 +1,133 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest.mock import MagicMock, patch
+
+import stripe
+from bom.constants import SUBSCRIPTION_TYPE_FREE, SUBSCRIPTION_TYPE_PRO
+from bom.models import Organization
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom import stripe_sync
+from indabom.models import BillingMetricsDay, OrganizationMeta, OrganizationSubscription
+from indabom.query_budget import QueryCounter
+
+User = get_user_model()
+PERIOD_START = 1700000000
+PERIOD_END = 1702592000
+
+
+def stripe_subscription(subscription_id, customer, status='active', quantity=2, period_end=PERIOD_END):
+    return {
+        'id': subscription_id,
+        'customer': customer,
+        'status': status,
+        'quantity': quantity,
+        'items': {'data': [{'price': {'id': 'price_abc', 'unit_amount': 1000, 'recurring': {'interval': 'month'}},
+                            'current_period_start': PERIOD_START, 'current_period_end': period_end}]},
+    }
+
+
+class StripeBulkActionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='kasper', email='kasper@example.com', password='pw12345')
+        self.client.force_login(self.admin)
+        self.metas = []
+        for n in range(3):
+            organization = Organization.objects.create(name=f'Org{n}', owner=self.admin)
+            self.metas.append(OrganizationMeta.objects.create(organization=organization,
+                                                              stripe_customer_id=f'cus_{n}'))
+
+    def local_subscription(self, meta, status='incomplete', quantity=1):
+        now = datetime.now(dt_timezone.utc)
+        return OrganizationSubscription.objects.create(
+            organization_meta=meta, stripe_subscription_id=f'sub_{meta.stripe_customer_id}', stripe_price_id='old',
+            status=status, quantity=quantity, current_period_start=now, current_period_end=now)
+
+    def run_action(self, model, action, objects):
+        response = self.client.post(reverse(f'admin:indabom_{model._meta.model_name}_changelist'), {
+            'action': action, '_selected_action': [obj.pk for obj in objects]})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    @patch('indabom.stripe_sync.stripe.Subscription.list')
+    def test_resync_customers_creates_and_updates_in_bulk(self, mock_list):
+        existing = self.local_subscription(self.metas[0])
+        mock_list.side_effect = lambda customer, **kwargs: MagicMock(auto_paging_iter=lambda: [
+            stripe_subscription(f'sub_{customer}', customer, quantity=4)])
+
+        with QueryCounter() as counter:
+            page = self.run_action(OrganizationMeta, 'resync_from_stripe', self.metas)
+
+        self.assertIn('3 of 3 done: 3 updated, 0 failed', page)
+        self.assertEqual(mock_list.call_count, 3)
+        existing.refresh_from_db()
+        self.assertEqual((existing.status, existing.quantity, existing.stripe_price_id, existing.monthly_unit_amount),
+                         ('active', 4, 'price_abc', 1000))
+        self.assertEqual(existing.current_period_end, datetime.fromtimestamp(PERIOD_END, tz=dt_timezone.utc))
+        self.assertEqual(OrganizationSubscription.objects.filter(status='active').count(), 3)
+        self.assertEqual(set(Organization.objects.values_list('subscription', 'subscription_quantity')),
+                         {(SUBSCRIPTION_TYPE_PRO, 4)})
+        today = BillingMetricsDay.objects.get(day=timezone.localdate())
+        self.assertEqual((today.active, today.incomplete, today.seats, today.mrr), (3, 0, 12, 12000))
+        # One locked read, bulk writes and one plan update for the chunk, not queries per row
+        self.assertLess(counter.count, 25)
+
+    @patch('indabom.stripe_sync.stripe.Subscription.retrieve')
+    def test_resync_subscriptions_reports_failures(self, mock_retrieve):
+        subscriptions = [self.local_subscription(meta, status='active', quantity=2) for meta in self.metas]
+        Organization.objects.update(subscription=SUBSCRIPTION_TYPE_PRO, subscription_quantity=2)
+
+        def retrieve(subscription_id):
+            if subscription_id == 'sub_cus_2':
+                raise stripe.APIConnectionError('Stripe is down')
+            return stripe_subscription(subscription_id, 'ignored', status='canceled')
+        mock_retrieve.side_effect = retrieve
+
+        page = self.run_action(OrganizationSubscription, 'resync_from_stripe', subscriptions)
+
+        self.assertIn('3 of 3 done: 2 updated, 1 failed', page)
+        self.assertIn('sub_cus_2: Stripe is down', page)
+        self.assertEqual(sorted(OrganizationSubscription.objects.values_list('status', flat=True)),
+                         ['active', 'canceled', 'canceled'])
+        self.assertEqual(Organization.objects.filter(subscription=SUBSCRIPTION_TYPE_FREE).count(), 2)
+        self.assertEqual(BillingMetricsDay.objects.get().churned_subscriptions, 2)
+
+    @patch('indabom.stripe_sync.stripe.Subscription.retrieve')
+    def test_refresh_period_dates_only_touches_periods(self, mock_retrieve):
+        subscription = self.local_subscription(self.metas[0])
+        mock_retrieve.return_value = stripe_subscription('sub_cus_0', 'cus_0', period_end=PERIOD_END + 86400)
+
+        page = self.run_action(OrganizationSubscription, 'refresh_period_dates', [subscription])
+
+        self.assertIn('1 of 1 done: 1 updated, 0 failed', page)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.current_period_end,
+                         datetime.fromtimestamp(PERIOD_END + 86400, tz=dt_timezone.utc))
+        self.assertEqual((subscription.status, subscription.stripe_price_id), ('incomplete', 'old'))
+        self.assertFalse(BillingMetricsDay.objects.exists())
+
+    @patch('indabom.stripe_sync.stripe.Customer.retrieve')
+    def test_verify_customer_ids_clears_missing_customers(self, mock_retrieve):
+        def retrieve(customer_id):
+            if customer_id == 'cus_1':
+                raise stripe.InvalidRequestError('No such customer', 'id', code='resource_missing')
+            return {'id': customer_id, 'deleted': customer_id == 'cus_2'}
+        mock_retrieve.side_effect = retrieve
+
+        with self.assertLogs('indabom.stripe_sync', 'WARNING'):
+            page = self.run_action(OrganizationMeta, 'verify_stripe_customer_ids', self.metas)
+
+        self.assertIn('3 of 3 done: 2 updated, 0 failed', page)
+        self.assertEqual(list(OrganizationMeta.objects.order_by('pk').values_list('stripe_customer_id', flat=True)),
+                         ['cus_0', None, None])
+
+    def test_concurrency_is_bounded(self):
+        subscriptions = [self.local_subscription(meta) for meta in self.metas]
+        with patch('indabom.stripe_sync.ThreadPoolExecutor', wraps=stripe_sync.ThreadPoolExecutor) as pool, \
+                patch('indabom.stripe_sync.stripe.Subscription.retrieve',
+                      side_effect=lambda subscription_id: stripe_subscription(subscription_id, 'cus')):
+            progress = list(stripe_sync.refresh_period_dates(subscriptions, concurrency=2))
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 2)
+        self.assertEqual(progress[-1].done, 3)
@@ -0,0 +1,133 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from indabom import throttling
+from indabom.forms import UserForm
+from indabom.models import IndabomUserMeta
+
+User = get_user_model()
+
+RATES = {
+    'login': {'ip': (5, 60), 'account': (3, 60)},
+    'signup': {'ip': (2, 60)},
+    'password_reset': {'ip': (5, 60), 'account': (1, 60)},
+}
+
+
+@override_settings(THROTTLE_RATES=RATES, THROTTLE_PROXY_COUNT=0)
+class ThrottleTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        throttling._counts.clear()
+        self.user = User.objects.create_user(username='kasper', email='kasper@example.com', password='pw12345')
+
+    def login(self, username, password='wrong', address='198.51.100.1'):
+        return self.client.post(reverse('login'), {'username': username, 'password': password},
+                                REMOTE_ADDR=address)
+
+    def test_account_limit_rejects_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login('kasper').status_code, 200)
+        with patch('django.contrib.auth.base_user.check_password') as check_password:
+            response = self.login('KASPER ', 'pw12345', address='198.51.100.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        check_password.assert_not_called()
+        self.assertEqual(throttling.counters(), {'login.allowed': 3, 'login.rejected_account': 1})
+
+    def test_counters_are_served_to_staff_only(self):
+        self.login('kasper')
+        response = self.client.get(reverse('abuse-metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        staff = User.objects.create_user(username='staff', email='staff@example.com', password='pw', is_staff=True)
+        IndabomUserMeta.objects.create(user=staff, terms_accepted_at=timezone.now())
+        self.client.force_login(staff)
+        response = self.client.get(reverse('abuse-metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['throttled'], {'login.allowed': 1})
+        self.assertIn('recaptcha', response.json())
+
+    def test_ip_limit_spans_accounts(self):
+        for n in range(5):
+            self.assertEqual(self.login(f'user{n}').status_code, 200)
+        self.assertEqual(self.login('kasper', 'pw12345').status_code, 429)
+        # Another address is unaffected
+        self.assertEqual(self.login('kasper', 'pw12345', address='198.51.100.9').status_code, 302)
+
+    def test_successful_login_clears_the_account_count(self):
+        for _ in range(2):
+            self.login('kasper')
+        self.assertEqual(self.login('kasper', 'pw12345').status_code, 302)
+        self.client.logout()
+        for _ in range(3):
+            self.assertEqual(self.login('kasper', address='198.51.100.2').status_code, 200)
+        self.assertEqual(self.login('kasper', address='198.51.100.2').status_code, 429)
+
+    def test_rejected_attempts_do_not_extend_an_account_lockout(self):
+        start = 1_000_000 * 60
+        for n in range(8):
+            hit = throttling.hit('test', 'account', 'kasper', limit=3, window=60, now=start + n, count_rejected=False)
+            self.assertEqual(hit is None, n < 3)
+        # Halfway through the next window the three counted attempts weigh 1.5; the five rejected ones weigh nothing
+        self.assertIsNone(throttling.hit('test', 'account', 'kasper', limit=3, window=60, now=start + 90,
+                                         count_rejected=False))
+
+    def test_address_rejections_are_not_counted_against_the_account(self):
+        for n in range(5):
+            self.login(f'user{n}')
+        for _ in range(5):
+            self.assertEqual(self.login('kasper').status_code, 429)
+        # The account itself has not been tried yet
+        self.assertEqual(self.login('kasper', 'pw12345', address='198.51.100.9').status_code, 302)
+
+    def test_get_is_not_counted(self):
+        for _ in range(10):
+            self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual(throttling.counters(), {})
+
+    def test_signup_rejected_before_form_validation(self):
+        with patch('indabom.views.UserForm', wraps=UserForm) as form:
+            for _ in range(2):
+                self.client.post(reverse('signup'), {'email': 'new@example.com'})
+            self.assertEqual(form.call_count, 2)
+            response = self.client.post(reverse('signup'), {'email': 'other@example.com'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(form.call_count, 2)
+
+    def test_password_reset_sends_one_email_per_account_window(self):
+        for _ in range(3):
+            self.client.post(reverse('password_reset'), {'email': 'Kasper@example.com'})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(throttling.counters()['password_reset.rejected_account'], 2)
+
+    def test_sliding_window_weighs_the_previous_window(self):
+        hit = throttling.hit
+        for _ in range(4):
+            self.assertIsNone(hit('test', 'ip', 'a', limit=4, window=60, now=1_000_000 * 60 + 59))
+        # A quarter into the next window three quarters of the previous one still counts: 3 + 1, then 3 + 2 > 4
+        self.assertIsNone(hit('test', 'ip', 'a', limit=4, window=60, now=1_000_001 * 60 + 15))
+        self.assertEqual(hit('test', 'ip', 'a', limit=4, window=60, now=1_000_001 * 60 + 15), 45)
+        # Once the previous window has slid out, attempts are allowed again
+        self.assertIsNone(hit('test', 'ip', 'a', limit=4, window=60, now=1_000_002 * 60 + 59))
+
+    @override_settings(THROTTLE_PROXY_COUNT=1)
+    def test_client_ip_from_trusted_proxy(self):
+        for _ in range(5):
+            self.client.post(reverse('login'), {'username': 'x', 'password': 'y'},
+                             HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7', REMOTE_ADDR='10.0.0.1')
+        # The spoofable first entry changes but the address the proxy appended does not
+        response = self.client.post(reverse('login'), {'username': 'z', 'password': 'y'},
+                                    HTTP_X_FORWARDED_FOR='5.6.7.8, 203.0.113.7', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(5):
+            self.assertEqual(self.login('kasper').status_code, 200)
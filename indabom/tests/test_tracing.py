@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase
+
+from indabom.tracing import make_traces_sampler
+
+
+class TracesSamplerTests(SimpleTestCase):
+    def setUp(self):
+        self.sampler = make_traces_sampler(default_rate=0.1)
+
+    def _rate(self, path, **extra):
+        return self.sampler({'wsgi_environ': {'PATH_INFO': path}, **extra})
+
+    def test_trivial_paths_not_sampled(self):
+        for path in ('/static/indabom/css/indabom.css', '/robots.txt', '/sitemap.xml', '/readyz/'):
+            self.assertEqual((path, self._rate(path)), (path, 0.0))
+
+    def test_checkout_and_webhooks_sampled_above_default(self):
+        self.assertGreater(self._rate('/checkout/'), 0.1)
+        self.assertGreater(self._rate('/webhooks/stripe/'), 0.1)
+        self.assertEqual(self._rate('/bom/'), 0.1)
+
+    def test_parent_decision_wins(self):
+        self.assertEqual(self._rate('/robots.txt', parent_sampled=True), 1.0)
+        self.assertEqual(self._rate('/checkout/', parent_sampled=False), 0.0)
+
+    def test_scale_is_capped(self):
+        sampler = make_traces_sampler(default_rate=0.1, scale=10.0)
+        self.assertEqual(sampler({'wsgi_environ': {'PATH_INFO': '/checkout/'}}), 1.0)
+        self.assertAlmostEqual(sampler({'wsgi_environ': {'PATH_INFO': '/bom/'}}), 1.0)
@@ -1,3 +1,4 @@
+import threading
 from unittest.mock import patch, MagicMock
 
 from bom.models import Organization
@@ -77,36 +78,93 @@ class IndabomViewTests(TestCase):
             resp = self.client.get(reverse(name))
             self.assertEqual((name, resp.status_code), (name, 200))
 
+    def test_sitemap_lists_static_pages(self):
+        resp = self.client.get(reverse("sitemap"))
+        self.assertEqual(resp.status_code, 200)
+        for name in ("index", "about", "install", "product"):
+            self.assertIn(reverse(name).encode(), resp.content)
+
+    def test_password_reset_confirm_invalid_link(self):
+        url = reverse("password_reset_confirm", kwargs={"uidb64": "MQ", "token": "not-a-token"})
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.context["validlink"])
+        self.assertIn(b"This password reset link is invalid", resp.content)
+        self.assertIn(reverse("password_reset").encode(), resp.content)
+
     # --- checkout (GET) branches ---
-    def test_checkout_get_non_owner_redirects(self):
+    @patch("indabom.views.stripe.get_price_async")
+    def test_checkout_get_non_owner_redirects(self, mock_price_async):
         self.client.force_login(self.user)
         self._set_owner_to_other_user()
 
         resp = self.client.get(reverse("checkout"), HTTP_REFERER=reverse("bom:settings"))
         self.assertEqual(resp.status_code, 302)
         self.assertEqual(resp.url, reverse("bom:settings"))
+        mock_price_async.assert_not_called()
 
+    @patch("indabom.views.stripe.get_price_async")
     @patch("indabom.views.stripe.get_active_subscription", return_value=MagicMock())
-    def test_checkout_get_already_subscribed_redirects_manage(self, _mock_active):
+    def test_checkout_get_already_subscribed_redirects_manage(self, _mock_active, mock_price_async):
         self.client.force_login(self.user)
 
         resp = self.client.get(reverse("checkout"))
         self.assertEqual(resp.status_code, 302)
         self.assertEqual(resp.url, reverse("stripe-manage"))
+        mock_price_async.assert_not_called()
 
     @patch("indabom.views.stripe.get_product")
-    @patch("indabom.views.stripe.get_price")
+    @patch("indabom.views.stripe.fetch_price")
     @patch("indabom.views.stripe.get_active_subscription", return_value=None)
     def test_checkout_get_renders_when_ok(self, _mock_active, mock_price, mock_product):
         self.client.force_login(self.user)
 
-        mock_price.return_value = MagicMock(unit_amount=500, product="prod_1")
+        mock_price.return_value = (MagicMock(unit_amount=500, product="prod_1"), None)
         mock_product.return_value = MagicMock()
 
         resp = self.client.get(reverse("checkout"))
         self.assertEqual(resp.status_code, 200)
         self.assertIn(b"checkout", resp.content.lower())
 
+    @patch("indabom.views.stripe.get_product")
+    @patch("indabom.views.stripe.fetch_price")
+    @patch("indabom.views.stripe.get_active_subscription", return_value=None)
+    def test_checkout_get_uses_expanded_product(self, _mock_active, mock_price, mock_product):
+        self.client.force_login(self.user)
+
+        mock_price.return_value = (MagicMock(unit_amount=500, product=MagicMock()), None)
+
+        resp = self.client.get(reverse("checkout"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_price.call_args.args[1], ["product"])
+        mock_product.assert_not_called()
+
+    @patch("indabom.views.stripe.fetch_price", return_value=(None, "Error fetching subscription details: boom."))
+    @patch("indabom.views.stripe.get_active_subscription", return_value=None)
+    def test_checkout_get_shows_price_error_from_the_pool(self, _mock_active, _mock_price):
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse("checkout"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.context["price_unavailable"])
+        self.assertEqual([str(m) for m in resp.context["messages"]], ["Error fetching subscription details: boom."])
+
+    @patch("indabom.views.STRIPE_CHECKOUT_TIMEOUT", 0.05)
+    @patch("indabom.views.stripe.fetch_price")
+    @patch("indabom.views.stripe.get_active_subscription", return_value=None)
+    def test_checkout_get_renders_price_unavailable_after_deadline(self, _mock_active, mock_price):
+        self.client.force_login(self.user)
+        released = threading.Event()
+        mock_price.side_effect = lambda *args, **kwargs: (released.wait(5), None)
+
+        try:
+            resp = self.client.get(reverse("checkout"))
+        finally:
+            released.set()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.context["price_unavailable"])
+        self.assertIn(b"Price unavailable", resp.content)
+
     # --- checkout (POST) ---
     @patch("indabom.views.stripe.subscribe", return_value=MagicMock(id="sess_1", url="/ok"))
     def test_checkout_post_valid_calls_subscribe(self, mock_subscribe):
@@ -0,0 +1,66 @@
+from unittest.mock import patch, MagicMock
+
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from indabom import warmup
+
+
+class WarmupTests(TestCase):
+    databases = {'default', 'readonly'}
+
+    def setUp(self):
+        self.client = Client()
+        warmup._report = None
+
+    def tearDown(self):
+        warmup._report = None
+
+    @patch("indabom.warmup.stripe.prime_price_cache", return_value=MagicMock())
+    def test_run_warmup_reports_every_step(self, mock_prime):
+        report = warmup.run_warmup()
+
+        self.assertTrue(report['ready'])
+        self.assertEqual([step['name'] for step in report['steps']],
+                         ['url_resolver', 'templates', 'databases', 'price_cache', 'cache'])
+        for step in report['steps']:
+            self.assertTrue(step['ok'])
+            self.assertGreaterEqual(step['seconds'], 0)
+        mock_prime.assert_called_once()
+
+    @patch("indabom.warmup.stripe.prime_price_cache", return_value=MagicMock())
+    def test_readiness_ok_and_only_warms_once(self, mock_prime):
+        resp = self.client.get(reverse("readiness"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()['ready'])
+
+        resp = self.client.get(reverse("readiness"))
+        self.assertEqual(resp.status_code, 200)
+        mock_prime.assert_called_once()
+
+    @patch("indabom.warmup.stripe.prime_price_cache", side_effect=Exception("stripe down"))
+    def test_price_cache_is_best_effort(self, mock_prime):
+        resp = self.client.get(reverse("readiness"))
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertTrue(body['ready'])
+        price_step = next(step for step in body['steps'] if step['name'] == 'price_cache')
+        self.assertEqual((price_step['ok'], price_step['required'], price_step['error']), (False, False, "Exception"))
+        self.assertNotIn(b"stripe down", resp.content)
+
+        # Ready instances are not warmed again, so Stripe stays off the probe path
+        self.client.get(reverse("readiness"))
+        mock_prime.assert_called_once()
+
+    @patch("indabom.warmup.stripe.prime_price_cache", return_value=MagicMock())
+    def test_readiness_retries_only_failed_steps(self, mock_prime):
+        with patch("indabom.warmup.cache.set", side_effect=Exception("cache down")):
+            resp = self.client.get(reverse("readiness"))
+        self.assertEqual(resp.status_code, 503)
+        cache_step = next(step for step in resp.json()['steps'] if step['name'] == 'cache')
+        self.assertEqual(cache_step['error'], "Exception")
+
+        resp = self.client.get(reverse("readiness"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(all(step['ok'] for step in resp.json()['steps']))
+        mock_prime.assert_called_once()
@@ -0,0 +1,158 @@
+"""
+Sliding-window throttling for the login, signup and password reset forms.
+
+Each POST is counted against the client's IP and, where the form names one, the account it targets. Counts live in
+the THROTTLE_CACHE cache as one counter per fixed window, bumped with the cache's atomic ``incr``; the sliding count
+is the current window's counter plus the previous window's weighted by how much of it still overlaps. Over the limit
+the view is never called, so a rejected attempt costs a couple of cache round trips and a short 429 instead of a
+password hash, a reCAPTCHA call or a reset email.
+
+Anyone can send attempts for someone else's account, so the account counter only counts attempts that got through:
+rejected ones, by address or by account, are not added to it, and a successful login clears it. Someone guessing from
+rotating addresses can hold an account at its limit but cannot push the wait further out.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'throttle'
+
+_counts: Counter = Counter()
+_counts_lock = threading.Lock()
+
+
+def _count(scope: str, outcome: str):
+    with _counts_lock:
+        _counts[f'{scope}.{outcome}'] += 1
+
+
+def counters() -> Dict[str, int]:
+    """Allowed and rejected attempts per scope (and rejecting key) since this process started."""
+    with _counts_lock:
+        return dict(_counts)
+
+
+def client_ip(request) -> str:
+    """The client address, read from X-Forwarded-For entries appended by THROTTLE_PROXY_COUNT trusted proxies."""
+    hops = getattr(settings, 'THROTTLE_PROXY_COUNT', 0)
+    if hops:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+
+def _digest(identity: str) -> str:
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def hit(scope: str, kind: str, identity: str, limit: int, window: int, now: Optional[float] = None,
+        count_rejected: bool = True) -> Optional[int]:
+    """
+    Counts one attempt and returns the seconds to wait if it is over ``limit`` per ``window`` seconds. With
+    ``count_rejected`` False an attempt that is already over the limit is not counted.
+    """
+    cache = _cache()
+    now = time.time() if now is None else now
+    current = int(now // window)
+    overlap = 1 - (now % window) / window
+    digest = _digest(identity)
+    key = f'{KEY_PREFIX}:{scope}:{kind}:{digest}:{current}'
+    previous = cache.get(f'{KEY_PREFIX}:{scope}:{kind}:{digest}:{current - 1}', 0)
+    if not count_rejected and previous * overlap + cache.get(key, 0) + 1 > limit:
+        return max(1, math.ceil(overlap * window))
+    # add() is a no-op when the counter exists, so concurrent first attempts still increment one counter
+    cache.add(key, 0, timeout=window * 2)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=window * 2)
+        count = 1
+    if previous * overlap + count <= limit:
+        if not count_rejected and previous * overlap + count + 1 > limit:
+            # Rejected attempts are not counted here, so this is the one chance to log it
+            logger.warning("Throttling further %s attempts by %s %s", scope, kind, digest[:12])
+        return None
+    if count == limit + 1:
+        logger.warning("Throttling %s attempts by %s %s", scope, kind, digest[:12])
+    return max(1, math.ceil(overlap * window))
+
+
+def reset(scope: str, kind: str, identity: str, window: int, now: Optional[float] = None):
+    """Forgets the attempts counted for ``identity`` in the current and previous windows."""
+    now = time.time() if now is None else now
+    current = int(now // window)
+    digest = _digest(identity)
+    _cache().delete_many([f'{KEY_PREFIX}:{scope}:{kind}:{digest}:{window_number}'
+                          for window_number in (current, current - 1)])
+
+
+def _account(request, account_field: Optional[str]) -> str:
+    return request.POST.get(account_field, '').strip().lower() if account_field else ''
+
+
+def check(request, scope: str, account_field: Optional[str] = None) -> Optional[int]:
+    """Counts the request against each of the scope's THROTTLE_RATES; returns the longest wait if any is exceeded."""
+    rates = settings.THROTTLE_RATES.get(scope, {})
+    identities = {'ip': client_ip(request)}
+    account = _account(request, account_field)
+    if account:
+        identities['account'] = account
+    wait = None
+    for kind, identity in identities.items():
+        if kind not in rates:
+            continue
+        if kind == 'account' and wait is not None:
+            # Turned away by address: not an attempt on the account
+            break
+        limit, window = rates[kind]
+        retry_after = hit(scope, kind, identity, limit, window, count_rejected=kind != 'account')
+        if retry_after is not None:
+            _count(scope, f'rejected_{kind}')
+            wait = max(wait or 0, retry_after)
+    if wait is None:
+        _count(scope, 'allowed')
+    return wait
+
+
+def throttle(scope: str, account_field: Optional[str] = None):
+    """
+    Rejects POSTs to the view over the scope's rates with a 429 before the view runs. When the view logs the user
+    in, the attempts counted against the account are forgotten.
+    """
+    def decorator(view):
+        @wraps(view)
+        def throttled(request, *args, **kwargs):
+            if request.method != 'POST' or not getattr(settings, 'THROTTLE_ENABLED', True):
+                return view(request, *args, **kwargs)
+            was_authenticated = request.user.is_authenticated
+            retry_after = check(request, scope, account_field)
+            if retry_after is not None:
+                response = HttpResponse('Too many attempts. Please wait a few minutes and try again.',
+                                        status=429, content_type='text/plain')
+                response['Retry-After'] = str(retry_after)
+                return response
+            response = view(request, *args, **kwargs)
+            account = _account(request, account_field)
+            rate = settings.THROTTLE_RATES.get(scope, {}).get('account')
+            if account and rate and not was_authenticated and request.user.is_authenticated:
+                reset(scope, 'account', account, rate[1])
+            return response
+        return throttled
+    return decorator
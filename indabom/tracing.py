@@ -0,0 +1,54 @@
+# Sentry performance sampling. Kept free of Django imports so settings.py can use it.
+from typing import Any, Dict, Optional, Tuple
+
+# (path prefix, sample rate); first match wins, so list more specific prefixes first
+TRACES_ROUTE_RATES: Tuple[Tuple[str, float], ...] = (
+    ('/static/', 0.0),
+    ('/media/', 0.0),
+    ('/readyz/', 0.0),
+    ('/robots.txt', 0.0),
+    ('/sitemap.xml', 0.0),
+    ('/favicon.ico', 0.0),
+    ('/webhooks/stripe/', 0.5),
+    ('/webhooks/mailgun/', 0.01),
+    ('/checkout', 0.5),
+    ('/stripe-manage/', 0.5),
+    ('/signup/', 0.25),
+    ('/account/delete/', 0.25),
+    ('/admin/', 0.05),
+    ('/explorer/', 0.05),
+)
+TRACES_DEFAULT_RATE = 0.1
+
+
+def _request_path(sampling_context: Dict[str, Any]) -> Optional[str]:
+    environ = sampling_context.get('wsgi_environ')
+    if environ:
+        return environ.get('PATH_INFO')
+    scope = sampling_context.get('asgi_scope')
+    if scope:
+        return scope.get('path')
+    return None
+
+
+def route_rate(path: str, default_rate: float = TRACES_DEFAULT_RATE) -> float:
+    for prefix, rate in TRACES_ROUTE_RATES:
+        if path.startswith(prefix):
+            return rate
+    return default_rate
+
+
+def make_traces_sampler(default_rate: float = TRACES_DEFAULT_RATE, scale: float = 1.0):
+    """Builds a Sentry ``traces_sampler`` applying per-route rates, multiplied by ``scale`` and capped at 1."""
+
+    def traces_sampler(sampling_context: Dict[str, Any]) -> float:
+        # Keep distributed traces whole: follow the upstream decision when there is one
+        parent_sampled = sampling_context.get('parent_sampled')
+        if parent_sampled is not None:
+            return float(parent_sampled)
+
+        path = _request_path(sampling_context)
+        rate = default_rate if path is None else route_rate(path, default_rate)
+        return min(1.0, rate * scale)
+
+    return traces_sampler
@@ -8,7 +8,9 @@ from django.urls import path, include
 from django.views.generic import TemplateView
 
 from . import views
+from .forms import EmailPasswordResetForm, LoginForm
 from .sitemaps import StaticViewSitemap
+from .throttling import throttle
 
 # Dictionary containing your sitemap classes
 sitemaps = {
@@ -24,16 +26,19 @@ urlpatterns = [
     path('signup/', views.signup, name='signup'),
 
     path('admin/', admin.site.urls, name='admin'),
-    path('login/', auth_views.LoginView.as_view(
+    path('login/', throttle('login', 'username')(auth_views.LoginView.as_view(
         template_name='indabom/login.html',
+        authentication_form=LoginForm,
         redirect_authenticated_user=True
-    ), name='login'),
+    )), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
 
-    path('password-reset/', auth_views.PasswordResetView.as_view(template_name='indabom/password-reset.html',
-                                                                 from_email='no-reply@indabom.com',
-                                                                 subject_template_name='indabom/password-reset-subject.txt',
-                                                                 email_template_name='indabom/password-reset-email.html'),
+    path('password-reset/', throttle('password_reset', 'email')(auth_views.PasswordResetView.as_view(
+        template_name='indabom/password-reset.html',
+        form_class=EmailPasswordResetForm,
+        from_email='no-reply@indabom.com',
+        subject_template_name='indabom/password-reset-subject.txt',
+        email_template_name='indabom/password-reset-email.html')),
          name='password_reset'),
     path('password-reset/done/', auth_views.PasswordResetDoneView.as_view(
         template_name='indabom/password-reset-done.html'),
@@ -59,7 +64,10 @@ urlpatterns = [
     path('checkout-cancelled/', views.CheckoutCancelled.as_view(), name=views.CheckoutCancelled.name),
     path('stripe-manage/', views.stripe_manage, name='stripe-manage'),
     path('webhooks/stripe/', views.stripe_webhook, name='stripe-webhook'),
+    path('webhooks/mailgun/tracking/', views.MailgunTrackingWebhook.as_view(), name='mailgun-tracking-webhook'),
     path('account/delete/', views.delete_account, name='account-delete'),
+    path('readyz/', views.readiness, name='readiness'),
+    path('metrics/abuse/', views.abuse_metrics, name='abuse-metrics'),
 
     path('explorer/', include('explorer.urls')),
     path('sentry-debug/', trigger_error)
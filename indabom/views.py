@@ -1,30 +1,37 @@
 import logging
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from typing import Optional
-from urllib.error import URLError
 
+from anymail.webhooks.mailgun import MailgunTrackingWebhookView
 from bom.models import Organization, UserMeta
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
 from django.http import (
     HttpResponseNotFound,
     HttpResponseRedirect,
     HttpResponseServerError,
     HttpResponse,
+    JsonResponse,
 )
 from django.shortcuts import render, redirect
 from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils import timezone
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
 
-from indabom import stripe
+from indabom import account_deletion, auth_backends, recaptcha, stripe, throttling, warmup
+from indabom.email_events import event_buffer
 from indabom.forms import SubscriptionForm, UserForm, PasswordConfirmForm
 from indabom.models import CheckoutSessionRecord, IndabomUserMeta
-from indabom.settings import DEBUG, INDABOM_STRIPE_PRICE_ID, NEW_TERMS_EFFECTIVE
+from indabom.settings import INDABOM_STRIPE_PRICE_ID, NEW_TERMS_EFFECTIVE, STRIPE_CHECKOUT_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -43,21 +50,24 @@ def handler500(request):
     return HttpResponseServerError(render(request, 'indabom/500.html', status=500))
 
 
+@throttling.throttle('signup')
 def signup(request):
     name = 'signup'
 
     if request.method == 'POST':
-        form = UserForm(request.POST)
+        form = UserForm(request.POST, remote_ip=throttling.client_ip(request))
         try:
             if form.is_valid():
-                new_user = form.save()
-                login(request, new_user, backend='django.contrib.auth.backends.ModelBackend')
-                return HttpResponseRedirect(reverse('bom:home'))
-        except URLError:
-            if DEBUG and len(form.errors.keys()) == 1 and 'captcha' in form.errors.keys():
-                new_user = form.save()
+                # A savepoint, so a lost race leaves the connection usable for rendering the error
+                with transaction.atomic():
+                    new_user = form.save()
                 login(request, new_user, backend='django.contrib.auth.backends.ModelBackend')
                 return HttpResponseRedirect(reverse('bom:home'))
+        except IntegrityError as e:
+            # Someone signed up with the same address since clean_email checked it; any other violation is a bug
+            if auth_backends.EMAIL_KEY_INDEX not in str(e):
+                raise
+            form.add_error('email', 'An account with this email address already exists.')
     else:
         form = UserForm()
 
@@ -117,23 +127,45 @@ class Checkout(IndabomTemplateView):
     form_class = SubscriptionForm
     user_profile: Optional[UserMeta] = None
     organization: Optional[Organization] = None
+    price_future: Optional[Future] = None
+    price_deadline: float = 0
 
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         self.user_profile = request.user.bom_profile()
         self.organization = self.user_profile.organization
 
+    def _start_price_fetch(self):
+        self.price_deadline = time.monotonic() + STRIPE_CHECKOUT_TIMEOUT
+        self.price_future = stripe.get_price_async(INDABOM_STRIPE_PRICE_ID)
+
+    def _wait_for_price(self):
+        if self.price_future is None:
+            self._start_price_fetch()
+        try:
+            price, error = self.price_future.result(timeout=max(0.0, self.price_deadline - time.monotonic()))
+        except FutureTimeoutError:
+            self.price_future.cancel()
+            logger.warning("Stripe price lookup exceeded %ss; rendering checkout without a price.",
+                           STRIPE_CHECKOUT_TIMEOUT)
+            return None
+        # The lookup ran on a pool thread; messages belong to this request, so they are added here
+        if error:
+            messages.error(self.request, error)
+        return price
+
     def get_context_data(self, *args, **kwargs):
         context = super(Checkout, self).get_context_data(**kwargs)
         form = self.form_class(owner=self.request.user)
         del form.fields["unit"]
 
-        stripe_price = stripe.get_price(INDABOM_STRIPE_PRICE_ID, self.request)
+        stripe_price = self._wait_for_price()
 
         context.update({
             'organization': self.organization,
             'user_profile': self.user_profile,
             'price': stripe_price,
+            'price_unavailable': stripe_price is None,
             'form': form,
             'product': None,
         })
@@ -143,7 +175,10 @@ class Checkout(IndabomTemplateView):
 
         context.update({'human_readable_price': stripe_price.unit_amount / 100})
 
-        stripe_product = stripe.get_product(stripe_price.product, self.request)
+        # The product comes back expanded on the price; only fall back to a second call if it did not
+        stripe_product = stripe_price.product
+        if isinstance(stripe_product, str):
+            stripe_product = stripe.get_product(stripe_product, self.request)
         if stripe_product is None:
             return context
 
@@ -173,6 +208,9 @@ class Checkout(IndabomTemplateView):
                            f'There was an error getting your organization. Please contact info@indabom.com with this error message.')
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', reverse('bom:settings') + '#organization'))
 
+        # Only pages that will show the price ask Stripe for it. The lookup runs on the Stripe pool so the page can
+        # stop waiting at STRIPE_CHECKOUT_TIMEOUT and render without a price
+        self._start_price_fetch()
         return render(request, self.template_name, self.get_context_data())
 
     def post(self, request, *args, **kwargs):
@@ -251,16 +289,14 @@ def delete_account(request):
     if request.method == 'POST':
         form = PasswordConfirmForm(request.POST, user=user)
         if form.is_valid():
-            # If owner (and not actively subscribed), delete their organization first
-            if is_owner and organization is not None:
-                org_name = organization.name
-                organization.delete()
-                messages.info(request, f'Organization "{org_name}" was deleted as part of account deletion.')
-
-            # Delete the user and logout
+            # Deleting an organization's parts can take a while, so the rows are removed by the
+            # process_account_deletions worker; the account is deactivated and logged out right away
+            owned = organization if is_owner else None
             username = user.username
-            user.delete()
+            account_deletion.request_deletion(user, owned)
             logout(request)
+            if owned is not None:
+                messages.info(request, f'Organization "{owned.name}" will be deleted as part of account deletion.')
             return TemplateResponse(request, 'indabom/account-deleted.html', {'username': username})
         else:
             messages.error(request, 'Incorrect password, please try again.')
@@ -285,10 +321,19 @@ def stripe_webhook(request):
     try:
         return stripe.stripe_webhook(request)
     except Exception as e:
-        logger.error(f"Failed to process Stripe webhook: {e}", exc_info=True)
+        logger.error("Failed to process Stripe webhook: %s", e, exc_info=True)
         return HttpResponse('Webhook failed to process.', status=500)
 
 
+class MailgunTrackingWebhook(MailgunTrackingWebhookView):
+    """Mailgun delivery events, signature-checked by anymail and written to the send logs in group commits."""
+
+    def post(self, request, *args, **kwargs):
+        self.run_validators(request)
+        event_buffer.submit(self.parse_events(request))
+        return HttpResponse()
+
+
 @login_required
 def update_terms(request):
     if request.method == 'POST':
@@ -304,3 +349,17 @@ def update_terms(request):
         'new_terms_effective': NEW_TERMS_EFFECTIVE,
     }
     return TemplateResponse(request, 'indabom/update-terms.html', context)
+
+
+@never_cache
+def readiness(request):
+    """Warms this instance on first call and reports per-step timings; 503 until every required step succeeds."""
+    report = warmup.ensure_warm()
+    return JsonResponse(report, status=200 if report['ready'] else 503)
+
+
+@never_cache
+@staff_member_required
+def abuse_metrics(request):
+    """This instance's throttling and reCAPTCHA counters, for staff; the public probe reports readiness only."""
+    return JsonResponse({'throttled': throttling.counters(), 'recaptcha': recaptcha.metrics()})
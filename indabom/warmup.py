@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver, reverse
+
+from indabom import stripe
+from indabom.settings import INDABOM_STRIPE_PRICE_ID
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEMPLATES = (
+    'indabom/base.html',
+    'indabom/base-bom.html',
+    'indabom/checkout.html',
+    'indabom/index.html',
+)
+WARMUP_DATABASES = ('default', 'readonly')
+
+_lock = threading.Lock()
+_report: Optional[Dict] = None
+
+
+def _populate_url_resolver():
+    resolver = get_resolver()
+    resolver.reverse_dict  # Populating the reverse dict compiles every pattern, including the mounted bom urls
+    reverse('index')
+    reverse('bom:home')
+
+
+def _load_templates():
+    for template_name in WARMUP_TEMPLATES:
+        get_template(template_name)
+
+
+def _check_databases():
+    # Connections belong to the thread that opened them, so this only proves each database is reachable;
+    # request threads still open their own
+    for alias in WARMUP_DATABASES:
+        connections[alias].ensure_connection()
+
+
+def _fill_price_cache():
+    stripe.prime_price_cache(INDABOM_STRIPE_PRICE_ID)
+
+
+def _touch_cache():
+    cache.set('indabom:warmup', time.time(), 60)
+    cache.get('indabom:warmup')
+
+
+# (name, step, required): the instance is ready once every required step has succeeded. The price cache is
+# best-effort, so a Stripe outage does not hold back an instance that can serve everything else; checkout fills the
+# cache itself on first use.
+WARMUP_STEPS: Tuple[Tuple[str, Callable[[], None], bool], ...] = (
+    ('url_resolver', _populate_url_resolver, True),
+    ('templates', _load_templates, True),
+    ('databases', _check_databases, True),
+    ('price_cache', _fill_price_cache, False),
+    ('cache', _touch_cache, True),
+)
+
+
+def run_warmup(previous: Optional[Dict] = None) -> Dict:
+    """Runs the warm-up steps and returns a report with per-step timings.
+
+    Steps that succeeded in ``previous`` are kept as they were and not run again. A failing step is recorded and does
+    not stop the remaining steps. The report is served to unauthenticated probes, so it names the exception class
+    only; the message goes to the log.
+    """
+    done = {step['name']: step for step in previous['steps'] if step['ok']} if previous else {}
+    steps: List[Dict] = []
+    started = time.monotonic()
+    for name, step, required in WARMUP_STEPS:
+        if name in done:
+            steps.append(done[name])
+            continue
+        step_started = time.monotonic()
+        error = None
+        try:
+            step()
+        except Exception as e:  # noqa: BLE001
+            error = type(e).__name__
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        steps.append({
+            'name': name,
+            'required': required,
+            'ok': error is None,
+            'seconds': round(time.monotonic() - step_started, 4),
+            'error': error,
+        })
+
+    report = {
+        'ready': all(step['ok'] for step in steps if step['required']),
+        'seconds': round(time.monotonic() - started, 4),
+        'steps': steps,
+    }
+    logger.info("Warm-up finished in %ss (ready=%s)", report['seconds'], report['ready'])
+    return report
+
+
+def ensure_warm() -> Dict:
+    """Returns the report once the instance is ready, re-running only the failed steps until it is."""
+    global _report
+    with _lock:
+        if _report is None or not _report['ready']:
+            _report = run_warmup(_report)
+        return _report
+
+
+def warm_in_background():
+    """Starts the warm-up on a daemon thread so process start is not delayed."""
+
+    def _run():
+        try:
+            ensure_warm()
+        finally:
+            # Nothing else runs on this thread to reuse the connections the databases step opened
+            connections.close_all()
+
+    threading.Thread(target=_run, name='indabom-warmup', daemon=True).start()
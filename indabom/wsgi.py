@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "indabom.settings")
 
 application = get_wsgi_application()
+
+if settings.WARMUP_ON_START:
+    from indabom.warmup import warm_in_background
+
+    warm_in_background()